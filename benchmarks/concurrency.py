@@ -0,0 +1,99 @@
+# niconico_dl - Concurrency Stress Test
+# 沢山の`NicoNicoVideo`をスレッドプールで同時に動かして、インスタンス同士が影響し合わないことを確認します。
+# 全ての動画が正しくダウンロードされ、`HEADERS`が書き換えられず、間違った`Content-Type`のリクエストがないことを確かめます。
+# 使用方法：`python -m benchmarks.concurrency [インスタンスの数]`
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os.path import join
+from sys import argv, exit
+import asyncio
+
+from niconico_dl import HEADERS, NicoNicoVideo, NicoNicoVideoAsync
+
+from .server import start_server
+
+
+SIZE = 1024 * 1024
+BANDWIDTH = 1024 * 1024
+# Heartbeatがダウンロード中に何回か送られるように寿命を短くする。
+LIFETIME = 4000
+
+
+def check(server, path: str, data: dict, video_id: str) -> None:
+    assert data["video"]["id"] == video_id, data["video"]["id"]
+    with open(path, "rb") as f:
+        assert f.read() == server.body, f"{path}の中身が違います。"
+
+
+def job_sync(server, directory: str, index: int) -> None:
+    video_id, path = f"sm{index}", join(directory, f"sync{index}.mp4")
+    with NicoNicoVideo(server.watch_url(video_id)) as nico:
+        data = nico.get_info()
+        nico.download(path, connections=2)
+    check(server, path, data, video_id)
+
+
+async def job_async(server, directory: str, index: int) -> None:
+    video_id, path = f"so{index}", join(directory, f"async{index}.mp4")
+    async with NicoNicoVideoAsync(server.watch_url(video_id)) as nico:
+        data = await nico.get_info()
+        await nico.download(path, connections=2)
+    check(server, path, data, video_id)
+
+
+def run_sync(server, directory: str, count: int) -> list:
+    with ThreadPoolExecutor(count) as executor:
+        futures = [
+            executor.submit(job_sync, server, directory, index)
+            for index in range(count)
+        ]
+        return [future.exception() for future in futures]
+
+
+async def run_async(server, directory: str, count: int) -> list:
+    return await asyncio.gather(
+        *(job_async(server, directory, index) for index in range(count)),
+        return_exceptions=True
+    )
+
+
+def report(name: str, server, results: list, elapsed: float) -> int:
+    errors = [error for error in results if error is not None]
+    print(
+        f"{name}: jobs {len(results)} failed {len(errors)} "
+        f"elapsed {elapsed:.2f}s stats {server.stats}"
+    )
+    for error in errors[:5]:
+        print(f"  {type(error).__name__}: {error}")
+    return len(errors)
+
+
+def main():
+    count = int(argv[1]) if len(argv) > 1 else 200
+    snapshot = [dict(header) for header in HEADERS]
+    failed = 0
+    with TemporaryDirectory() as directory:
+        server = start_server(SIZE, BANDWIDTH, lifetime=LIFETIME)
+        started = perf_counter()
+        results = run_sync(server, directory, count)
+        failed += report("sync ", server, results, perf_counter() - started)
+        bad_headers = server.stats["bad_headers"]
+        server.shutdown()
+
+        server = start_server(SIZE, BANDWIDTH, lifetime=LIFETIME)
+        started = perf_counter()
+        results = asyncio.run(run_async(server, directory, count))
+        failed += report("async", server, results, perf_counter() - started)
+        bad_headers += server.stats["bad_headers"]
+        server.shutdown()
+
+    changed = [dict(header) for header in HEADERS] != snapshot
+    print(f"bad headers {bad_headers} HEADERS changed {changed}")
+    if failed or bad_headers or changed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# niconico_dl - Download Benchmark
+# 一つの接続と複数の接続でのダウンロード速度を比較します。
+# 使用方法：`python -m benchmarks.download`
+
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from os.path import join, getsize
+import asyncio
+
+from aiohttp import ClientSession
+
+from niconico_dl import NicoNicoVideo, NicoNicoVideoAsync
+
+from .server import start_server
+
+
+SIZE = 32 * 1024 * 1024
+BANDWIDTH = 8 * 1024 * 1024
+CONNECTIONS = (1, 2, 4, 8)
+RESULT_DATA = {"content_auth": {"content_auth_info": {"value": "benchmark"}}}
+
+
+def prepare(nico, url: str):
+    # Heartbeatを動かさずにダウンロードできるようにします。
+    nico._download_link, nico.result_data = url, RESULT_DATA
+    return nico
+
+
+def bench_sync(url: str, path: str, connections: int) -> float:
+    nico = prepare(NicoNicoVideo(url), url)
+    nico._working_heartbeat.set()
+    start = perf_counter()
+    nico.download(path, 65536, connections=connections)
+    return perf_counter() - start
+
+
+async def bench_async(url: str, path: str, connections: int) -> float:
+    async with ClientSession() as session:
+        nico = prepare(NicoNicoVideoAsync(url, session=session), url)
+        nico._working_heartbeat.set()
+        start = perf_counter()
+        await nico.download(path, 65536, connections=connections)
+        return perf_counter() - start
+
+
+def main():
+    for accept_ranges in (True, False):
+        server = start_server(SIZE, BANDWIDTH, accept_ranges)
+        print(f"# accept_ranges={accept_ranges} size={SIZE} bandwidth/conn={BANDWIDTH}")
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, "output.mp4")
+            for connections in CONNECTIONS:
+                elapsed = bench_sync(server.url, path, connections)
+                assert getsize(path) == SIZE
+                print(f"sync  connections={connections}: {elapsed:.2f}s ({SIZE/elapsed/1048576:.1f} MiB/s)")
+                elapsed = asyncio.run(bench_async(server.url, path, connections))
+                assert getsize(path) == SIZE
+                print(f"async connections={connections}: {elapsed:.2f}s ({SIZE/elapsed/1048576:.1f} MiB/s)")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
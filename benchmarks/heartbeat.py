@@ -0,0 +1,58 @@
+# niconico_dl - Heartbeat Benchmark
+# Heartbeatを動かしているだけの時のCPU使用率とスレッドの数を計測します。
+# 使用方法：`python -m benchmarks.heartbeat [セッションの数]`
+
+from time import perf_counter, process_time, sleep
+from threading import active_count
+from sys import argv
+import asyncio
+
+from niconico_dl import NicoNicoVideo, NicoNicoVideoAsync
+
+from .server import start_server
+
+
+IDLE = 5.0
+
+
+def measure(wait) -> float:
+    # `wait`を実行している間のCPU使用率(%)を返します。
+    cpu, wall = process_time(), perf_counter()
+    wait()
+    return (process_time() - cpu) / (perf_counter() - wall) * 100
+
+
+def bench_sync(server, count: int) -> tuple:
+    videos = [NicoNicoVideo(server.watch_url(f"sm{i}")) for i in range(count)]
+    for nico in videos:
+        nico.connect()
+    try:
+        return measure(lambda: sleep(IDLE)), active_count()
+    finally:
+        for nico in videos:
+            nico.close()
+
+
+async def bench_async(server, count: int) -> float:
+    videos = [NicoNicoVideoAsync(server.watch_url(f"sm{i}")) for i in range(count)]
+    await asyncio.gather(*(nico.connect() for nico in videos))
+    try:
+        cpu, wall = process_time(), perf_counter()
+        await asyncio.sleep(IDLE)
+        return (process_time() - cpu) / (perf_counter() - wall) * 100
+    finally:
+        await asyncio.gather(*(nico.aclose() for nico in videos))
+
+
+def main():
+    server = start_server(1024)
+    for count in map(int, argv[1:] or (1, 50, 200)):
+        print(f"sessions={count}")
+        cpu, threads = bench_sync(server, count)
+        print(f"  sync  idle CPU: {cpu:.1f}% threads: {threads}")
+        print(f"  async idle CPU: {asyncio.run(bench_async(server, count)):.1f}%")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
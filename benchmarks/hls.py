@@ -0,0 +1,63 @@
+# niconico_dl - HLS Benchmark
+# HLSのセグメントを並列でダウンロードする速度を、暗号化されていない場合とAES-128で暗号化されている場合で計測します。
+# 復号した結果が配信した動画と同じかも確かめます。暗号化されている場合は`cryptography`が必要です。
+# 使用方法：`python -m benchmarks.hls`
+
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from os.path import join
+import asyncio
+
+from niconico_dl import NicoNicoVideo, NicoNicoVideoAsync
+
+from .server import start_server
+
+
+SIZE = 32 * 1024 * 1024
+BANDWIDTH = 8 * 1024 * 1024
+SEGMENT_SIZE = 1024 * 1024
+CONNECTIONS = (1, 4, 8)
+
+
+def bench_sync(url: str, path: str, connections: int) -> float:
+    with NicoNicoVideo(url, hls=True) as nico:
+        start = perf_counter()
+        nico.download(path, connections=connections)
+        return perf_counter() - start
+
+
+async def bench_async(url: str, path: str, connections: int) -> float:
+    async with NicoNicoVideoAsync(url, hls=True) as nico:
+        start = perf_counter()
+        await nico.download(path, connections=connections)
+        return perf_counter() - start
+
+
+def main():
+    for encrypted in (False, True):
+        server = start_server(
+            SIZE, BANDWIDTH, hls_segment_size=SEGMENT_SIZE,
+            hls_encrypted=encrypted
+        )
+        print(
+            f"# encrypted={encrypted} size={SIZE} segment={SEGMENT_SIZE} "
+            f"bandwidth/conn={BANDWIDTH}"
+        )
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, "output.ts")
+            for connections in CONNECTIONS:
+                for name, bench in (
+                    ("sync ", bench_sync),
+                    ("async", lambda *args: asyncio.run(bench_async(*args)))
+                ):
+                    url = server.watch_url(f"hls{encrypted:d}{connections}")
+                    elapsed = bench(url, path, connections)
+                    with open(path, "rb") as f:
+                        assert f.read() == server.body
+                    print(f"{name} connections={connections}: {elapsed:.2f}s ({SIZE/elapsed/1048576:.1f} MiB/s)")
+        print(f"  server {server.stats}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# niconico_dl - Import Time Benchmark
+# `python -X importtime`で`niconico_dl`の読み込みにかかる時間を計測します。
+# 読み込まれてはいけないモジュールが読み込まれた場合は終了コード1で終了します。
+# 時間はマシンの速さや負荷で変わるので、同じ回に計測した`REFERENCE`の読み込み時間の何倍かを予算にして、
+# 超えた場合は警告だけを表示します。`--strict-time`を指定した場合は時間の超過でも終了コード1で終了します。
+# 使用方法：`python -m benchmarks.importtime [繰り返す回数] [--strict-time]`
+
+from statistics import median
+from subprocess import run
+from sys import argv, executable, exit
+
+
+# 予算の基準にする標準ライブラリの読み込みです。
+REFERENCE = "import asyncio"
+# (計測する文, 予算(`REFERENCE`の何倍か), 読み込まれてはいけないモジュール)
+# 予算は普段の値の二倍ほどにしてあります。
+CASES = (
+    ("import niconico_dl", 0.5, ("aiohttp", "aiofiles", "requests", "bs4")),
+    ("from niconico_dl import NicoNicoVideo", 6, ("aiohttp", "aiofiles", "bs4")),
+    ("from niconico_dl import NicoNicoVideoAsync", 10, ("requests", "bs4")),
+    ("from niconico_dl import Quality, RetryPolicy, Tracer", 0.5,
+     ("aiohttp", "aiofiles", "requests", "bs4")),
+    ("import niconico_dl.__main__", 0.5,
+     ("aiohttp", "aiofiles", "requests", "bs4"))
+)
+REPEAT = 5
+
+
+def measure(statement: str) -> tuple:
+    # 一番外側で読み込まれたモジュールの累計の時間を足して、読み込まれたモジュールの一覧と一緒に返します。
+    # Pythonの起動時に読み込まれるモジュールは`pass`の結果で取り除きます。
+    def importtime(code: str) -> dict:
+        result = run(
+            [executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, check=True
+        )
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            modules[name.strip()] = (
+                int(cumulative), not name[1:].startswith(" ")
+            )
+        return modules
+
+    startup = importtime("pass")
+    modules = importtime(statement)
+    total = sum(
+        cumulative for name, (cumulative, top) in modules.items()
+        if top and name not in startup
+    )
+    return total / 1000, {name.split(".")[0] for name in modules}
+
+
+def main():
+    args = [arg for arg in argv[1:] if arg != "--strict-time"]
+    strict_time = "--strict-time" in argv[1:]
+    repeat = int(args[0]) if args else REPEAT
+    failed = slow = False
+    reference = median(measure(REFERENCE)[0] for _ in range(repeat))
+    print(f"reference {REFERENCE!r}: {reference:.2f} ms")
+    for statement, factor, forbidden in CASES:
+        times, imported = [], set()
+        for _ in range(repeat):
+            elapsed, modules = measure(statement)
+            times.append(elapsed)
+            imported |= modules
+        elapsed, budget = median(times), reference * factor
+        leaked = sorted(set(forbidden) & imported)
+        failed |= bool(leaked)
+        slow |= elapsed > budget
+        print(
+            f"{'FAIL' if leaked else 'SLOW' if elapsed > budget else 'ok  '} "
+            f"{statement:<55} {elapsed:8.2f} ms / {budget:.2f} ms ({factor}x)"
+            + (f"  imported {', '.join(leaked)}" if leaked else "")
+        )
+    if failed or (strict_time and slow):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# niconico_dl - Parse Benchmark
+# ウォッチページから動画の情報を取り出すのにかかる時間とメモリをBeautifulSoupと比較します。
+# 使用方法：`python -m benchmarks.parse [保存したウォッチページのHTML...]`
+# 引数を指定しない場合は`benchmarks/fixtures`にあるHTMLと、それがなければ作ったものを使います。
+
+from glob import glob
+from html import escape
+from json import dumps, loads
+from os.path import dirname, join
+from sys import argv
+from time import perf_counter
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from niconico_dl.templates import _extract_api_data
+
+from .server import make_api_data
+
+
+REPEAT = 20
+
+
+def make_page(comments: int = 2000) -> str:
+    # 本物に近い大きさのウォッチページを作ります。
+    data = make_api_data("sm9")
+    data["comment"] = {"threads": [
+        {"id": i, "label": "default", "text": "コメント" * 20}
+        for i in range(comments)
+    ]}
+    body = "".join(
+        f'<div class="item"><a href="/watch/sm{i}">動画{i}</a></div>'
+        for i in range(comments)
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>Benchmark</title>"
+        + "<script>var x = 1;</script>" * 50 + "</head><body>" + body
+        + f'<div id="js-initial-watch-data" data-api-data="{escape(dumps(data))}"'
+        + ' data-environment="{}"></div>' + body + "</body></html>"
+    )
+
+
+def bench(name: str, function, text: str) -> float:
+    tracemalloc.start()
+    start = perf_counter()
+    for _ in range(REPEAT):
+        data = function(text)
+    elapsed = (perf_counter() - start) / REPEAT
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    loads(data)
+    print(f"  {name:<14} {elapsed * 1000:8.2f} ms  peak {peak / 1048576:7.2f} MiB")
+    return elapsed
+
+
+def soup(text: str) -> str:
+    return BeautifulSoup(text, "html.parser").find(
+        "div", {"id": "js-initial-watch-data"}
+    ).get("data-api-data")
+
+
+def main():
+    paths = argv[1:] or glob(join(dirname(__file__), "fixtures", "*.html"))
+    pages = [(path, open(path, encoding="utf-8").read()) for path in paths]
+    if not pages:
+        pages = [("generated", make_page())]
+    for name, text in pages:
+        print(f"{name} ({len(text) / 1024:.0f} KiB)")
+        slow = bench("BeautifulSoup", soup, text)
+        fast = bench("extractor", _extract_api_data, text)
+        print(f"  {slow / fast:.0f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# niconico_dl - Resume Check
+# 途中で止まったダウンロードと、全て終わった後に記録を消す前に止まったダウンロードを、
+# `NicoNicoVideo`と`NicoNicoVideoAsync`で続きから正しくダウンロードできることを確認します。
+# 失敗した場合は終了コード1で終了します。
+# 使用方法：`python -m benchmarks.resume`
+
+from tempfile import TemporaryDirectory
+from os.path import exists, join
+from sys import exit
+import asyncio
+
+from niconico_dl import DownloadJournal, NicoNicoVideo, NicoNicoVideoAsync
+
+from .server import start_server
+
+
+SIZE = 4 * 1024 * 1024
+
+
+def interrupt(server, path: str, url: str, done: int) -> None:
+    # `done`バイトまでダウンロードしたところで止まった状態のファイルと記録を作ります。
+    with open(path, "wb") as f:
+        f.write(server.body[:done])
+        f.truncate(SIZE)
+    journal = DownloadJournal(path, url)
+    journal.reset(SIZE)
+    if done:
+        journal.add(0, done - 1)
+    journal.save()
+
+
+def download_sync(url: str, path: str) -> None:
+    with NicoNicoVideo(url) as nico:
+        nico.download(path, connections=2)
+
+
+def download_async(url: str, path: str) -> None:
+    async def main():
+        async with NicoNicoVideoAsync(url) as nico:
+            await nico.download(path, connections=2)
+    asyncio.run(main())
+
+
+def check(server, name: str, download, directory: str, done: int) -> bool:
+    url = server.watch_url(f"{name}{done}")
+    path = join(directory, f"{name}{done}.mp4")
+    interrupt(server, path, url, done)
+    before = server.stats["media"]
+    try:
+        download(url, path)
+    except Exception as e:
+        print(f"FAIL {name} done={done}: {type(e).__name__}: {e}")
+        return False
+    with open(path, "rb") as f:
+        ok = f.read() == server.body
+    ok = ok and not exists(path + DownloadJournal.EXTENSION)
+    # 全て終わっている場合は動画を取得し直さない。
+    if done == SIZE:
+        ok = ok and server.stats["media"] == before
+    print(f"{'ok  ' if ok else 'FAIL'} {name} done={done}")
+    return ok
+
+
+def main():
+    server = start_server(SIZE)
+    failed = False
+    with TemporaryDirectory() as directory:
+        for name, download in (("sync", download_sync), ("async", download_async)):
+            for done in (0, SIZE // 3, SIZE):
+                failed |= not check(server, name, download, directory, done)
+    server.shutdown()
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+# niconico_dl - Benchmark Server
+
+# 別のプロセスで動かす場合：`python -m benchmarks.server --port 8000 --latency 0.01`
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+from argparse import ArgumentParser
+from subprocess import PIPE, Popen
+from threading import Thread, Lock
+from random import Random
+from html import escape
+from time import monotonic, sleep
+from typing import Iterable, Optional, Tuple
+from json import loads, dumps
+import sys
+import re
+
+from niconico_dl import templates
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """`Range`に対応した動画配信サーバーの代わりをするハンドラーです。  
+    `server.body`を配信して、接続ごとに`server.bandwidth`バイト毎秒まで速度を制限します。  
+    全てのリクエストは`server.latency`秒待ってから返されます。  
+    `server.disconnect_rate`の確率で動画を半分だけ送って接続を切ります。"""
+
+    protocol_version = "HTTP/1.1"
+    CHUNK_SIZE = 16384
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した場合は無視する。
+            pass
+
+    def _parse_range(self, size: int) -> Optional[tuple]:
+        header = self.headers.get("Range")
+        if header is None or not self.server.accept_ranges:
+            return None
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+        if match is None:
+            return None
+        start, end = match.groups()
+        if start == "":
+            start, end = size - int(end), size - 1
+        else:
+            start, end = int(start), int(end) if end else size - 1
+        return start, min(end, size - 1)
+
+    def _send_headers(self) -> tuple:
+        body = self.server.body
+        range_ = self._parse_range(len(body))
+        if range_ is None:
+            self.send_response(200)
+            start, end = 0, len(body) - 1
+        else:
+            self.send_response(206)
+            start, end = range_
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(body)}"
+            )
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        return start, end
+
+    def _delay(self) -> None:
+        if self.server.latency:
+            sleep(self.server.latency)
+
+    def do_HEAD(self) -> None:
+        self._delay()
+        self._send_headers()
+
+    def _should_disconnect(self) -> bool:
+        if not self.server.disconnect_rate:
+            return False
+        with self.server.lock:
+            disconnect = self.server.random.random() < self.server.disconnect_rate
+            if disconnect:
+                self.server.stats["disconnects"] += 1
+        return disconnect
+
+    def do_GET(self) -> None:
+        self._delay()
+        start, end = self._send_headers()
+        self._write(memoryview(self.server.body)[start:end + 1])
+
+    def _write(self, view: memoryview) -> None:
+        # `server.bandwidth`バイト毎秒まで速度を制限しながら送ります。
+        if self._should_disconnect():
+            # 途中で切断された場合を真似する。
+            view = view[:len(view) // 2]
+            self.close_connection = True
+        delay = (
+            self.CHUNK_SIZE / self.server.bandwidth
+            if self.server.bandwidth else 0
+        )
+        try:
+            if not delay:
+                # 制限しない場合はまとめて送る。
+                self.wfile.write(view)
+                return
+            for i in range(0, len(view), self.CHUNK_SIZE):
+                self.wfile.write(view[i:i + self.CHUNK_SIZE])
+                if delay:
+                    sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    # 数百の接続が同時に来ても取りこぼさないように`listen`のバックログを増やす。
+    # 初期値の5だと接続の再送で一秒ほど待たされ、クライアントではなくサーバーの遅さを計測してしまいます。
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_api_data(video_id: str, lifetime: int = 120000) -> dict:
+    """ウォッチページの`data-api-data`に入っている動画の情報の代わりを作ります。"""
+    return {
+        "video": {
+            "id": video_id, "title": f"Benchmark {video_id}", "duration": 60,
+            "count": {"view": 0, "comment": 0, "mylist": 0, "like": 0}
+        },
+        "owner": {"id": 1, "nickname": "benchmark"},
+        "tag": {"items": [{"name": "benchmark"}]},
+        "media": {"delivery": {"movie": {
+            "audios": [{
+                "id": "archive_aac_64kbps", "isAvailable": True,
+                "metadata": {"bitrate": 64000, "samplingRate": 48000}
+            }],
+            "videos": [
+                {
+                    "id": "archive_h264_360p", "isAvailable": True,
+                    "metadata": {
+                        "label": "360p", "bitrate": 600000,
+                        "resolution": {"width": 640, "height": 360}
+                    }
+                },
+                {
+                    "id": "archive_h264_720p", "isAvailable": True,
+                    "metadata": {
+                        "label": "720p", "bitrate": 2000000,
+                        "resolution": {"width": 1280, "height": 720}
+                    }
+                }
+            ],
+            "session": {
+                "videos": ["archive_h264_720p", "archive_h264_360p"],
+                "audios": ["archive_aac_64kbps"],
+                "heartbeatLifetime": lifetime, "recipeId": "nicovideo-" + video_id,
+                "priority": 0.5, "urls": [{
+                    "url": templates.URLS["base_heartbeat"],
+                    "isWellKnownPort": True, "isSsl": True
+                }],
+                "token": "{}", "signature": "benchmark", "contentId": "out1",
+                "authTypes": {"http": "ht2", "hls": "ht2"},
+                "contentKeyTimeout": 600000, "serviceUserId": "1",
+                "playerId": "benchmark"
+            }
+        }}}
+    }
+
+
+def _encrypt(data: bytes, key: bytes, sequence: int) -> bytes:
+    # HLSのセグメントをAES-128で暗号化します。初期化ベクトルはシーケンス番号です。
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    pad = 16 - len(data) % 16
+    encryptor = Cipher(
+        algorithms.AES(key), modes.CBC(sequence.to_bytes(16, "big"))
+    ).encryptor()
+    return encryptor.update(data + bytes((pad,)) * pad) + encryptor.finalize()
+
+
+# HLSのマスタープレイリストに載せる画質と`BANDWIDTH`です。どれも同じセグメントを返します。
+HLS_VARIANTS = (("360p", 600000), ("720p", 2000000))
+PLAYLIST = "application/vnd.apple.mpegurl"
+
+
+class NicoNicoHandler(MediaHandler):
+    """ウォッチページ、DMCのセッションAPI、動画配信サーバーの代わりをするハンドラーです。  
+    `/watch/<id>`でウォッチページを、`/api/sessions`でセッションAPIを、`/hls/`でHLSのプレイリストとセグメントを、それ以外で動画を返します。  
+    HLSのセッションでは`server.body`を`server.hls_segments`に分けたものを配信し、`server.hls_key`がある場合はAES-128で暗号化します。  
+    `server.strict`が有効な場合は、Heartbeatが`heartbeatLifetime`の間届かなかったセッションを期限切れにして、  
+    期限切れや存在しないセッションへのHeartbeatに`404`を、その認証情報を使った動画のリクエストに`403`を返します。  
+    `server.fail_kinds`に含まれる種類のリクエストは`server.failure_rate`の確率で`server.failure_status`を返します。"""
+
+    def _send_status(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _inject_failure(self, kind: str) -> bool:
+        # 失敗させる場合はエラーを返して`True`を返します。
+        server = self.server
+        if not server.failure_rate or kind not in server.fail_kinds:
+            return False
+        with server.lock:
+            failed = server.random.random() < server.failure_rate
+            if failed:
+                server.stats["failures"] += 1
+        if failed:
+            self._send_status(server.failure_status)
+        return failed
+
+    def _touch(self, session_id: str, create: bool = False) -> bool:
+        # セッションの期限を延ばします。期限切れか存在しない場合は`False`を返します。
+        server, now = self.server, monotonic()
+        with server.lock:
+            deadline = server.sessions.get(session_id)
+            if not create and (deadline is None or deadline < now):
+                if deadline is not None:
+                    server.stats["expired"] += 1
+                    del server.sessions[session_id]
+                return False
+            server.sessions[session_id] = now + server.lifetime / 1000
+            return True
+
+    def _authorized(self) -> bool:
+        # 動画のリクエストの認証情報が生きているセッションのものかを確かめます。
+        if not self.server.strict:
+            return True
+        query = parse_qs(urlsplit(self.path).query)
+        session_id = query.get("ht2_nicovideo", [""])[0]
+        with self.server.lock:
+            deadline = self.server.sessions.get(session_id)
+        return deadline is not None and deadline >= monotonic()
+
+    def _send_body(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, key: str) -> None:
+        with self.server.lock:
+            self.server.stats[key] += 1
+
+    def _do_hls(self) -> None:
+        # HLSのプレイリスト、鍵、セグメントを返します。
+        server, path = self.server, urlsplit(self.path).path
+        self._delay()
+        if self.headers.get("Content-Type") != "video/mp4":
+            self._count("bad_headers")
+        if path == "/hls/master.m3u8":
+            self._count("playlist")
+            if not self._authorized():
+                self._count("unauthorized")
+                self._send_status(403)
+                return
+            self._send_body(("#EXTM3U\n" + "".join(
+                f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}\n{name}/playlist.m3u8\n"
+                for name, bandwidth in HLS_VARIANTS
+            )).encode(), PLAYLIST)
+        elif path.endswith("/playlist.m3u8"):
+            self._count("playlist")
+            lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:6", "#EXT-X-MEDIA-SEQUENCE:0"]
+            if server.hls_key is not None:
+                lines.append('#EXT-X-KEY:METHOD=AES-128,URI="../key"')
+            for index in range(len(server.hls_segments)):
+                lines.extend(("#EXTINF:6.0,", f"{index}.ts"))
+            lines.append("#EXT-X-ENDLIST")
+            self._send_body("\n".join(lines).encode(), PLAYLIST)
+        elif path == "/hls/key" and server.hls_key is not None:
+            self._count("playlist")
+            self._send_body(server.hls_key, "application/octet-stream")
+        else:
+            self._count("media")
+            match = re.fullmatch(r"/hls/\w+/(\d+)\.ts", path)
+            if match is None or int(match.group(1)) >= len(server.hls_segments):
+                self._send_status(404)
+                return
+            if self._inject_failure("media"):
+                return
+            segment = server.hls_segments[int(match.group(1))]
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", str(len(segment)))
+            self.end_headers()
+            self._write(memoryview(segment))
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/hls/"):
+            self._do_hls()
+        elif self.path == "/_stats":
+            # 別のプロセスで動かしている場合に`stats`を取得するためのものです。
+            with self.server.lock:
+                body = dumps(self.server.stats).encode()
+            self._send_body(body, "application/json")
+        elif self.path.startswith("/watch/"):
+            self._delay()
+            self._count("watch")
+            if self._inject_failure("watch"):
+                return
+            video_id = self.path.split("/")[2].split("?")[0]
+            data = escape(dumps(make_api_data(video_id, self.server.lifetime)))
+            self._send_body((
+                '<!DOCTYPE html><html><head><title>Benchmark</title></head><body>'
+                f'<div id="js-initial-watch-data" data-api-data="{data}" '
+                'data-environment="{}"></div></body></html>'
+            ).encode(), "text/html; charset=utf-8")
+        else:
+            self._count("media")
+            if self.headers.get("Content-Type") != "video/mp4":
+                self._count("bad_headers")
+            if not self._authorized():
+                self._count("unauthorized")
+                self._delay()
+                self._send_status(403)
+                return
+            if self._inject_failure("media"):
+                return
+            super().do_GET()
+
+    def do_OPTIONS(self) -> None:
+        self._delay()
+        self._count("options")
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        session = loads(self.rfile.read(length))["session"]
+        self._delay()
+        if self.headers.get("Content-Type") != "application/json":
+            self._count("bad_headers")
+        if "_method=PUT" in self.path:
+            self._count("put")
+            if self._inject_failure("put"):
+                return
+            if not self._touch(session.get("id", "")) and self.server.strict:
+                self._send_status(404)
+                return
+        else:
+            self._count("post")
+            if self._inject_failure("post"):
+                return
+            with self.server.lock:
+                self.server.session_count += 1
+                session["id"] = f"benchmark{self.server.session_count}"
+            self._touch(session["id"], True)
+            protocol = session["protocol"]["parameters"]["http_parameters"]
+            session["content_uri"] = self.server.base + "/hls/master.m3u8" \
+                if "hls_parameters" in protocol["parameters"] else self.server.url
+            session["content_auth"]["content_auth_info"] = {
+                "method": "query", "name": "ht2_nicovideo", "value": session["id"]
+            }
+        self._send_body(
+            dumps({"data": {"session": session}}).encode(), "application/json"
+        )
+
+
+def start_server(
+    size: int = 32 * 1024 * 1024, bandwidth: int = 0,
+    accept_ranges: bool = True, port: int = 0, lifetime: int = 120000,
+    latency: float = 0, strict: bool = False, failure_rate: float = 0,
+    failure_status: int = 503,
+    fail_kinds: Iterable[str] = ("watch", "post", "put", "media"),
+    disconnect_rate: float = 0, seed: Optional[int] = 0,
+    hls_segment_size: int = 1024 * 1024, hls_encrypted: bool = False
+) -> ThreadingHTTPServer:
+    """ベンチマーク用のサーバーを別スレッドで起動します。
+
+    Parameters
+    ----------
+    size : int, default 32 MiB
+        配信するダミーの動画のサイズです。
+    bandwidth : int, default 0
+        接続ごとの最大速度(バイト毎秒)です。0の場合は制限しません。
+    accept_ranges : bool, default True
+        `Range`に対応するかどうかです。
+    port : int, default 0
+        使用するポートです。0の場合は空いているポートが使われます。
+    lifetime : int, default 120000
+        セッションの`heartbeatLifetime`(ミリ秒)です。
+    latency : float, default 0
+        全てのリクエストに追加する遅延(秒)です。
+    strict : bool, default False
+        セッションの期限と動画のリクエストの認証情報を確かめるかどうかです。  
+        無効な場合は`benchmarks.download.prepare`のようにセッションを作らずに動画を取得できます。
+    failure_rate : float, default 0
+        リクエストを失敗させる確率です。
+    failure_status : int, default 503
+        失敗させる際に返すステータスコードです。
+    fail_kinds : Iterable[str], default ("watch", "post", "put", "media")
+        失敗させるリクエストの種類です。
+    disconnect_rate : float, default 0
+        動画を半分だけ送って接続を切る確率です。
+    seed : int, optional, default 0
+        失敗させるかどうかを決める乱数のシードです。同じシードなら同じ順番で失敗します。
+    hls_segment_size : int, default 1 MiB
+        HLSのセッションで配信するセグメント一つのサイズです。
+    hls_encrypted : bool, default False
+        HLSのセグメントをAES-128で暗号化するかどうかです。`cryptography`が必要です。
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        起動したサーバーです。`server.url`で動画のURLを、`server.watch_url(id)`でウォッチページのURLを取得できます。  
+        `server.stats`にはリクエストの種類ごとの回数と、`Content-Type`が間違っていたリクエストの数(`bad_headers`)、  
+        HLSのプレイリストと鍵のリクエストの数(`playlist`)、失敗させた数(`failures`、`disconnects`)、期限切れのセッションの数(`expired`)、認証に失敗した動画のリクエストの数(`unauthorized`)が入ります。  
+        失敗させる確率などは`server.failure_rate`のように後から変えることもできます。  
+        セッションAPIとウォッチページのURLは`niconico_dl.templates.URLS`に設定されます。  
+        終了する際は`server.shutdown`を実行してください。"""
+    server = BenchmarkServer(("127.0.0.1", port), NicoNicoHandler)
+    server.body = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    server.bandwidth, server.accept_ranges = bandwidth, accept_ranges
+    server.lifetime, server.lock, server.session_count = lifetime, Lock(), 0
+    server.latency, server.strict = latency, strict
+    server.failure_rate, server.failure_status = failure_rate, failure_status
+    server.fail_kinds, server.disconnect_rate = frozenset(fail_kinds), disconnect_rate
+    server.random, server.sessions = Random(seed), {}
+    server.hls_key = b"niconico_dl-hls!" if hls_encrypted else None
+    server.hls_segments = [
+        server.body[start:start + hls_segment_size]
+        for start in range(0, size, hls_segment_size)
+    ]
+    if server.hls_key is not None:
+        server.hls_segments = [
+            _encrypt(segment, server.hls_key, sequence)
+            for sequence, segment in enumerate(server.hls_segments)
+        ]
+    server.stats = dict.fromkeys((
+        "watch", "post", "options", "put", "media", "playlist", "bad_headers",
+        "failures", "disconnects", "expired", "unauthorized"
+    ), 0)
+    server.base = "http://127.0.0.1:%d" % server.server_address[1]
+    server.url = server.base + "/video.mp4"
+    server.watch_url = lambda video_id: f"{server.base}/watch/{video_id}"
+    use_server(server.base)
+    Thread(
+        target=server.serve_forever, name="niconico_dl.benchmark",
+        daemon=True
+    ).start()
+    return server
+
+
+def use_server(base: str) -> None:
+    """セッションAPIとウォッチページのURLを`base`のサーバーに向けます。"""
+    templates.URLS["base_heartbeat"] = base + "/api/sessions"
+    templates.URLS["base_watch"] = base + "/watch/"
+
+
+def spawn_server(**options) -> Tuple[Popen, str]:
+    """ベンチマーク用のサーバーを別のプロセスで起動します。  
+    サーバーの処理が計測するプロセスのCPU時間やGILに影響しないようにするためのものです。
+
+    Parameters
+    ----------
+    **options
+        `start_server`の引数です。
+
+    Returns
+    -------
+    process, base : Tuple[subprocess.Popen, str]
+        サーバーのプロセスと`http://127.0.0.1:<port>`のようなURLです。  
+        URLは`use_server`で設定されます。終了する際は`process.terminate`を実行してください。"""
+    args = [sys.executable, "-m", "benchmarks.server"]
+    for key, value in options.items():
+        if key == "fail_kinds":
+            value = ",".join(value)
+        if key == "accept_ranges":
+            if not value:
+                args.append("--no-ranges")
+            continue
+        if isinstance(value, bool):
+            if value:
+                args.append(f"--{key.replace('_', '-')}")
+            continue
+        args.extend((f"--{key.replace('_', '-')}", str(value)))
+    process = Popen(args, stdout=PIPE, text=True)
+    base = process.stdout.readline().strip()
+    if not base:
+        process.kill()
+        raise RuntimeError("ベンチマーク用のサーバーを起動できませんでした。")
+    use_server(base)
+    return process, base
+
+
+def fetch_stats(base: str) -> dict:
+    """別のプロセスで動かしているサーバーの`stats`を取得します。"""
+    with urlopen(base + "/_stats") as r:
+        return loads(r.read())
+
+
+def main():
+    parser = ArgumentParser(description="ベンチマーク用のニコニコ動画の代わりをするサーバーを動かします。")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--size", type=int, default=32 * 1024 * 1024)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--no-ranges", dest="accept_ranges", action="store_false")
+    parser.add_argument("--lifetime", type=int, default=120000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--strict", action="store_true")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument(
+        "--fail-kinds", type=lambda value: value.split(","),
+        default=("watch", "post", "put", "media")
+    )
+    parser.add_argument("--disconnect-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hls-segment-size", type=int, default=1024 * 1024)
+    parser.add_argument("--hls-encrypted", action="store_true")
+    server = start_server(**vars(parser.parse_args()))
+    # 起動したことを`spawn_server`に伝える。
+    print(server.base, flush=True)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# niconico_dl - Benchmark Suite
+# ローカルのサーバーを相手に`get_info`、セッションの作成、Heartbeat、ダウンロードにかかる時間を、
+# `NicoNicoVideo`と`NicoNicoVideoAsync`のそれぞれで同時に動かす数を変えながら計測します。
+# サーバーは別のプロセスで動かすので、CPU使用率は計測しているプロセスだけのものです。
+# 結果はJSONで保存され、`--baseline`で以前の結果と比べて遅くなっていた場合は終了コード1で終了します。
+# `benchmarks/results/baseline.json`は`--repeat 3`で作ったもので、作ったマシンは`meta`に記録されています。
+# 比べる前に同じマシンで作り直し、`--tolerance`は計測のばらつきに合わせて調整してください。
+# 使用方法：`python -m benchmarks.suite [--jobs 1 10 100 500] [--repeat 3] [--baseline benchmarks/results/baseline.json]`
+
+from typing import Callable, Dict, List, Optional
+
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from argparse import ArgumentParser, Namespace
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time, sleep, strftime
+from os.path import dirname, join
+from json import dump, load
+from os import makedirs
+import platform
+import asyncio
+import sys
+
+import niconico_dl
+from niconico_dl import NicoNicoVideo, NicoNicoVideoAsync
+from niconico_dl.pool import percentile
+
+from .server import fetch_stats, spawn_server
+
+
+RESULTS = join(dirname(__file__), "results")
+# 名前がこれで終わる指標は大きいほど良く、それ以外は小さいほど良い。
+HIGHER_IS_BETTER = ("_mib_s",)
+
+
+def summarize(
+    name: str, times: List[float], errors: List[BaseException]
+) -> Dict[str, float]:
+    # 一つの処理の時間のリストを中央値と99パーセンタイル(ミリ秒)にします。
+    return {
+        f"{name}_p50_ms": (percentile(times, 50) or 0.0) * 1000,
+        f"{name}_p99_ms": (percentile(times, 99) or 0.0) * 1000,
+        f"{name}_errors": len(errors)
+    }
+
+
+def timed(function: Callable, times: list, errors: list):
+    # 関数を実行してかかった時間を`times`に、失敗した場合はエラーを`errors`に追加します。
+    started = perf_counter()
+    try:
+        result = function()
+    except Exception as e:
+        errors.append(e)
+        return None
+    times.append(perf_counter() - started)
+    return result
+
+
+async def timed_async(coroutine, times: list, errors: list):
+    started = perf_counter()
+    try:
+        result = await coroutine
+    except Exception as e:
+        errors.append(e)
+        return None
+    times.append(perf_counter() - started)
+    return result
+
+
+def heartbeat_result(
+    videos: list, base: str, before: dict, cpu: float, wall: float
+) -> Dict[str, float]:
+    # Heartbeatを動かしていた間のCPU使用率と、送ったHeartbeatの数と往復にかかった時間です。
+    latencies = [
+        nico.heartbeat.latency for nico in videos
+        if nico.heartbeat is not None and nico.heartbeat.latency is not None
+    ]
+    return {
+        "heartbeat_cpu_percent": cpu / wall * 100,
+        "heartbeat_puts": fetch_stats(base)["put"] - before["put"],
+        "heartbeat_rtt_ms": sum(latencies) / len(latencies) * 1000
+        if latencies else 0.0
+    }
+
+
+def download_result(
+    times: List[float], errors: list, size: int, wall: float
+) -> Dict[str, float]:
+    result = summarize("download", times, errors)
+    result["throughput_mib_s"] = size * len(times) / wall / 1048576
+    return result
+
+
+def bench_sync(base: str, jobs: int, options: Namespace, directory: str) -> dict:
+    videos = [
+        NicoNicoVideo(f"{base}/watch/sync{jobs}x{i}") for i in range(jobs)
+    ]
+    result = {}
+    with ThreadPoolExecutor(jobs) as executor:
+        def run(name: str, function: Callable) -> tuple:
+            times, errors = [], []
+            started = perf_counter()
+            list(executor.map(
+                lambda nico: timed(lambda: function(nico), times, errors),
+                videos
+            ))
+            result.update(summarize(name, times, errors))
+            return times, errors, perf_counter() - started
+
+        try:
+            run("get_info", NicoNicoVideo.get_info)
+            run("session", NicoNicoVideo.connect)
+
+            before = fetch_stats(base)
+            cpu, wall = process_time(), perf_counter()
+            sleep(options.idle)
+            result.update(heartbeat_result(
+                videos, base, before, process_time() - cpu, perf_counter() - wall
+            ))
+
+            times, errors, wall = run(
+                "download", lambda nico: nico.download(
+                    join(directory, f"{id(nico)}.mp4"),
+                    connections=options.connections, resume=False
+                )
+            )
+            result.update(download_result(times, errors, options.size, wall))
+        finally:
+            for nico in videos:
+                nico.close()
+    return result
+
+
+async def bench_async(base: str, jobs: int, options: Namespace, directory: str) -> dict:
+    videos = [
+        NicoNicoVideoAsync(f"{base}/watch/async{jobs}x{i}") for i in range(jobs)
+    ]
+    result = {}
+
+    async def run(name: str, function: Callable) -> tuple:
+        times, errors = [], []
+        started = perf_counter()
+        await asyncio.gather(*(
+            timed_async(function(nico), times, errors) for nico in videos
+        ))
+        result.update(summarize(name, times, errors))
+        return times, errors, perf_counter() - started
+
+    try:
+        await run("get_info", NicoNicoVideoAsync.get_info)
+        await run("session", NicoNicoVideoAsync.connect)
+
+        before = fetch_stats(base)
+        cpu, wall = process_time(), perf_counter()
+        await asyncio.sleep(options.idle)
+        result.update(heartbeat_result(
+            videos, base, before, process_time() - cpu, perf_counter() - wall
+        ))
+
+        times, errors, wall = await run(
+            "download", lambda nico: nico.download(
+                join(directory, f"{id(nico)}.mp4"),
+                connections=options.connections, resume=False
+            )
+        )
+        result.update(download_result(times, errors, options.size, wall))
+    finally:
+        await asyncio.gather(*(nico.aclose() for nico in videos))
+    return result
+
+
+def merge(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    # 同じ条件で繰り返した結果を、指標ごとの中央値(エラーの数は最大値)にまとめます。
+    return {
+        key: (max if key.endswith("_errors") else median)(run[key] for run in runs)
+        for key in runs[0]
+    }
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    # 以前の結果より`tolerance`の割合以上悪くなった指標の一覧を返します。
+    # エラーの数は一つでも増えたら悪くなったとします。
+    regressions = []
+    for case, metrics in results.items():
+        for key, value in metrics.items():
+            old = baseline.get(case, {}).get(key)
+            if old is None or key in ("heartbeat_puts",):
+                continue
+            if key.endswith("_errors"):
+                worse = value > old
+            elif key.endswith(HIGHER_IS_BETTER):
+                worse = value < old * (1 - tolerance)
+            else:
+                # 小さい値は誤差が大きいので、1(1ミリ秒や1%)までの差は無視する。
+                worse = value > old * (1 + tolerance) + 1
+            if worse:
+                regressions.append(f"{case} {key}: {old:.2f} -> {value:.2f}")
+    return regressions
+
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=("sync", "async"))
+    parser.add_argument("--repeat", type=int, default=1, help="同じ条件で繰り返す回数です。結果は中央値になります。")
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="動画一つのサイズ(バイト)です。")
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.005, help="サーバーの全てのリクエストに追加する遅延(秒)です。")
+    parser.add_argument("--bandwidth", type=int, default=0, help="サーバーの接続ごとの最大速度(バイト毎秒)です。")
+    parser.add_argument("--lifetime", type=int, default=4000, help="セッションの`heartbeatLifetime`(ミリ秒)です。")
+    parser.add_argument("--idle", type=float, default=3.0, help="Heartbeatだけを動かす秒数です。")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--disconnect-rate", type=float, default=0)
+    parser.add_argument("--output", help="結果の保存先です。指定しない場合は`benchmarks/results/<日時>.json`です。")
+    parser.add_argument("--baseline", help="比べる以前の結果です。")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="許容する悪化の割合です。")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    options = make_parser().parse_args(argv)
+    process, base = spawn_server(
+        size=options.size, bandwidth=options.bandwidth, latency=options.latency,
+        lifetime=options.lifetime, strict=True,
+        failure_rate=options.failure_rate,
+        disconnect_rate=options.disconnect_rate
+    )
+    results: Dict[str, dict] = {}
+    try:
+        with TemporaryDirectory() as directory:
+            for jobs in options.jobs:
+                for mode in options.modes:
+                    runs = []
+                    for _ in range(options.repeat):
+                        if mode == "sync":
+                            runs.append(bench_sync(base, jobs, options, directory))
+                        else:
+                            runs.append(asyncio.run(
+                                bench_async(base, jobs, options, directory)
+                            ))
+                    result = results[f"{mode}/{jobs}"] = merge(runs)
+                    print(
+                        f"{mode:<5} jobs={jobs:<4} "
+                        f"get_info p50 {result['get_info_p50_ms']:7.1f}ms p99 {result['get_info_p99_ms']:7.1f}ms  "
+                        f"session p50 {result['session_p50_ms']:7.1f}ms p99 {result['session_p99_ms']:7.1f}ms  "
+                        f"heartbeat cpu {result['heartbeat_cpu_percent']:5.1f}% rtt {result['heartbeat_rtt_ms']:6.1f}ms  "
+                        f"download {result['throughput_mib_s']:7.1f}MiB/s  "
+                        f"errors {sum(value for key, value in result.items() if key.endswith('_errors'))}",
+                        flush=True
+                    )
+        stats = fetch_stats(base)
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "meta": {
+            "time": strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "niconico_dl": niconico_dl.__version__,
+            "options": vars(options), "server": stats
+        },
+        "results": results
+    }
+    output = options.output or join(RESULTS, strftime("%Y%m%d-%H%M%S") + ".json")
+    makedirs(dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        dump(report, f, indent=2)
+    print(f"saved {output}")
+
+    if options.baseline:
+        with open(options.baseline, "r") as f:
+            regressions = compare(results, load(f)["results"], options.tolerance)
+        for regression in regressions:
+            print(f"  regression {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# niconico_dl - Throughput Benchmark
+# 速度を制限しないローカルのサーバーからダウンロードした時の速度とCPU時間を計測します。
+# 使用方法：`python -m benchmarks.throughput [サイズ(MiB)] [回数]`
+
+from time import perf_counter, process_time
+from tempfile import TemporaryDirectory
+from os.path import join, getsize
+from sys import argv
+import asyncio
+
+from aiohttp import ClientSession
+
+from niconico_dl import NicoNicoVideo, NicoNicoVideoAsync
+
+from .download import prepare
+from .server import start_server
+
+
+def bench_sync(url: str, path: str, connections: int) -> tuple:
+    nico = prepare(NicoNicoVideo(url), url)
+    nico._working_heartbeat.set()
+    wall, cpu = perf_counter(), process_time()
+    nico.download(path, connections=connections, resume=False)
+    return perf_counter() - wall, process_time() - cpu
+
+
+async def bench_async(url: str, path: str, connections: int) -> tuple:
+    async with ClientSession() as session:
+        nico = prepare(NicoNicoVideoAsync(url, session=session), url)
+        nico._working_heartbeat.set()
+        wall, cpu = perf_counter(), process_time()
+        await nico.download(path, connections=connections, resume=False)
+        return perf_counter() - wall, process_time() - cpu
+
+
+def main():
+    size = int(argv[1]) * 1048576 if len(argv) > 1 else 256 * 1048576
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    server = start_server(size)
+    print(f"# size={size // 1048576}MiB")
+    with TemporaryDirectory() as tmp:
+        path = join(tmp, "output.mp4")
+        for connections in (1, 4):
+            for name, bench in (
+                ("sync ", bench_sync),
+                ("async", lambda *args: asyncio.run(bench_async(*args)))
+            ):
+                # サーバーのCPU時間も同じプロセスなので含まれる。一番速かった回を使う。
+                wall, cpu = min(
+                    bench(server.url, path, connections) for _ in range(repeat)
+                )
+                assert getsize(path) == size
+                print(
+                    f"{name} connections={connections}: {size / wall / 1048576:.0f} MiB/s "
+                    f"cpu {cpu / (size / 1048576) * 1000:.2f}ms/MiB"
+                )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
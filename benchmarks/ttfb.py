@@ -0,0 +1,67 @@
+# niconico_dl - Time To First Byte Benchmark
+# 動画を読み込み始めてから最初の1バイトが届くまでの時間を`SessionPool`を使う場合と使わない場合で計測します。
+# 使用方法：`python -m benchmarks.ttfb [動画の数] [リクエストごとの遅延(秒)]`
+
+from time import perf_counter
+from sys import argv
+import asyncio
+
+from niconico_dl import NicoNicoVideoAsync, SessionPool
+from niconico_dl.pool import percentile
+
+from .server import start_server
+
+
+async def first_byte(nico: NicoNicoVideoAsync) -> None:
+    async with await nico.stream() as stream:
+        assert await stream.read(1)
+
+
+async def bench_cold(server, count: int) -> list:
+    results = []
+    for i in range(count):
+        started = perf_counter()
+        nico = NicoNicoVideoAsync(server.watch_url(f"cold{i}"))
+        await first_byte(nico)
+        results.append(perf_counter() - started)
+        await nico.aclose()
+    return results
+
+
+async def bench_warm(server, count: int) -> tuple:
+    results = []
+    async with SessionPool(max_size=4) as pool:
+        ids = [f"warm{i}" for i in range(count)]
+        pool.prefetch(ids)
+        for video_id in ids:
+            # 再生している間に次のセッションが作られる状況を真似する。
+            await asyncio.sleep(server.latency * 4)
+            started = perf_counter()
+            nico = await pool.claim(video_id)
+            await first_byte(nico)
+            results.append(perf_counter() - started)
+            await nico.aclose()
+        return results, pool.stats()
+
+
+def report(name: str, results: list) -> None:
+    p50, p99 = percentile(results, 50), percentile(results, 99)
+    print(f"  {name}: p50 {p50 * 1000:.1f}ms p99 {p99 * 1000:.1f}ms")
+
+
+def main():
+    count = int(argv[1]) if len(argv) > 1 else 20
+    server = start_server(1024 * 1024, latency=float(argv[2]) if len(argv) > 2 else 0.05)
+    print(f"videos={count} latency={server.latency * 1000:.0f}ms")
+    report("cold", asyncio.run(bench_cold(server, count)))
+    results, stats = asyncio.run(bench_warm(server, count))
+    report("warm", results)
+    print(
+        f"  pool: hits {stats['hits']} misses {stats['misses']} "
+        f"ttfb p50 {stats['p50'] * 1000:.1f}ms p99 {stats['p99'] * 1000:.1f}ms"
+    )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
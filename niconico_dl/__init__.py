@@ -2,11 +2,89 @@
 .. include:: ../README.md
 """
 
-from .async_video_manager import *
-from .video_manager import *
+from typing import TYPE_CHECKING
 
+from importlib import import_module
 
-__all__ = ("HEADERS", "NicoNicoAcquisitionFailed",
-           "NicoNicoVideoAsync", "NicoNicoVideo")
+
+# `aiohttp`や`requests`などの読み込みに時間がかかるので、クラスなどは使われた時に読み込みます。
+# 例えば`from niconico_dl import NicoNicoVideo`では`aiohttp`は読み込まれません。
+_LAZY = {
+    "HEADERS": "templates", "HeaderSet": "templates",
+    "NicoNicoAcquisitionFailed": "templates", "URLS": "templates",
+    "MODES": "templates",
+    "NicoNicoVideoAsync": "async_video_manager",
+    "NicoNicoVideo": "video_manager",
+    "DownloadJournal": "journal",
+    "TokenBucket": "limiter", "RateLimiter": "limiter",
+    "FileTokenBucket": "limiter",
+    "HeartbeatManager": "heartbeat", "AsyncHeartbeatManager": "heartbeat",
+    "HeartbeatSession": "heartbeat",
+    "InfoCache": "cache", "SQLiteInfoCache": "cache",
+    "VideoReader": "stream", "AsyncVideoStream": "stream",
+    "Progress": "progress", "ProgressTracker": "progress",
+    "format_progress": "progress", "terminal_renderer": "progress",
+    "CombinedProgress": "progress",
+    "fetch_infos": "crawler", "project": "crawler",
+    "NicoNicoBatch": "batch", "BatchResult": "batch",
+    "RelayServer": "relay",
+    "SessionPool": "pool",
+    "Tracer": "tracing", "OpenTelemetryTracer": "tracing", "Span": "tracing",
+    "DownloadStats": "tracing",
+    "RetryPolicy": "retry", "RetryBudget": "retry",
+    "Quality": "variants", "Variant": "variants"
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        value = getattr(import_module(f".{_LAZY[name]}", __name__), name)
+        # 二回目からは普通の属性として取り出せるようにする。
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+if TYPE_CHECKING:
+    # 型チェッカーのために普通に読み込みます。
+    from .templates import (
+        HEADERS, HeaderSet, NicoNicoAcquisitionFailed, URLS, MODES
+    )
+    from .async_video_manager import NicoNicoVideoAsync
+    from .video_manager import NicoNicoVideo
+    from .journal import DownloadJournal
+    from .limiter import FileTokenBucket, RateLimiter, TokenBucket
+    from .heartbeat import (
+        AsyncHeartbeatManager, HeartbeatManager, HeartbeatSession
+    )
+    from .cache import InfoCache, SQLiteInfoCache
+    from .stream import AsyncVideoStream, VideoReader
+    from .progress import (
+        CombinedProgress, Progress, ProgressTracker, format_progress,
+        terminal_renderer
+    )
+    from .crawler import fetch_infos, project
+    from .batch import BatchResult, NicoNicoBatch
+    from .relay import RelayServer
+    from .pool import SessionPool
+    from .tracing import DownloadStats, OpenTelemetryTracer, Span, Tracer
+    from .retry import RetryBudget, RetryPolicy
+    from .variants import Quality, Variant
+
+
+__all__ = ("HEADERS", "HeaderSet", "NicoNicoAcquisitionFailed", "URLS", "MODES",
+           "NicoNicoVideoAsync", "NicoNicoVideo", "DownloadJournal",
+           "TokenBucket", "NicoNicoBatch", "BatchResult", "HeartbeatManager",
+           "AsyncHeartbeatManager", "HeartbeatSession", "InfoCache",
+           "SQLiteInfoCache", "fetch_infos", "project", "VideoReader",
+           "AsyncVideoStream", "RelayServer",
+           "SessionPool", "Progress", "ProgressTracker", "format_progress",
+           "terminal_renderer", "Tracer", "OpenTelemetryTracer", "Span",
+           "DownloadStats", "RetryPolicy", "RetryBudget", "RateLimiter",
+           "FileTokenBucket", "Quality", "Variant", "CombinedProgress")
 __author__ = "tasuren"
 __version__ = "2.2.8"
@@ -1,27 +1,204 @@
 # niconico_dl - Main
 
-from niconico_dl import NicoNicoVideo
-from sys import argv
-
-
-args = [
-    arg for arg in argv
-    if not arg.startswith(
-        ("py", "-m")
-    ) and "niconico_dl" not in arg
-]
-HELP = """# niconico_dl
-ニコニコ動画にある動画をmp4形式ダウンロードします。
-使用方法：`niconico_dl [URL]`
-ダウンロードした動画は`output.mp4`という名前で実行したディレクトリに保存されます。"""
-
-
-def main():
-    if args and args[0]:
-        with NicoNicoVideo(args[0], log=True) as nico:
-            nico.download("output.mp4")
-    else:
-        print(HELP)
+from typing import Iterable, Iterator, List, Optional
+
+from argparse import ArgumentParser, Namespace
+from string import Formatter
+from json import dumps
+import sys
+
+
+# `--help`などをすぐに表示できるように`niconico_dl`のクラスは使う時に読み込みます。
+HELP = """ニコニコ動画にある動画をmp4形式でダウンロードします。
+URLか動画IDを複数指定でき、`--input`で指定したファイルや標準入力から一行ずつ読み込むこともできます。"""
+# `-o`で使える置き換えの名前です。
+FIELDS = ("id", "title")
+EPILOG = """例：`niconico_dl sm9 sm9664372 -o "{title}.mp4" --jobs 4`
+`niconico_dl serve`で動画を配信するHTTPサーバーを動かせます。詳細は`niconico_dl serve --help`を見てください。"""
+
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="niconico_dl", description=HELP, epilog=EPILOG)
+    parser.add_argument("urls", nargs="*", help="ニコニコ動画のURLか動画IDです。")
+    parser.add_argument(
+        "-i", "--input", action="append", default=[], metavar="FILE",
+        help="URLか動画IDを一行ずつ書いたファイルです。`-`の場合は標準入力から読み込みます。"
+    )
+    parser.add_argument(
+        "-o", "--output", default="{id}.mp4",
+        help="保存先です。`{id}`と`{title}`が動画のIDとタイトルに置き換えられます。(初期値：`{id}.mp4`)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=4, help="同時にダウンロードする動画の数です。"
+    )
+    parser.add_argument(
+        "-c", "--connections", type=int, default=1,
+        help="動画一つあたりに使う接続の数です。"
+    )
+    parser.add_argument(
+        "--bandwidth", type=int, help="全てのダウンロードの合計の最大速度(バイト毎秒)です。0の場合は制限しません。"
+    )
+    parser.add_argument(
+        "--skip-existing", action="store_true",
+        help="保存先が既にある動画をダウンロードしません。途中までダウンロードされている場合は続きからダウンロードします。"
+    )
+    parser.add_argument(
+        "--info-only", action="store_true",
+        help="ダウンロードせずに動画の情報をJSON Lines形式で標準出力に出力します。"
+    )
+    parser.add_argument(
+        "--fields", type=lambda value: value.split(","),
+        help="`--info-only`で出力する項目をカンマ区切りで指定します。例：`video.title,video.duration`"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="進捗を表示しません。"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="ログ出力をします。"
+    )
+    return parser
+
+
+def check_output(template: str) -> Optional[str]:
+    # 保存先のテンプレートが使えない場合はその理由を返します。
+    try:
+        for _, name, _, _ in Formatter().parse(template):
+            if name is not None and name not in FIELDS:
+                return f"`{{{name}}}`"
+        template.format(**{name: "" for name in FIELDS})
+    except (ValueError, IndexError, KeyError) as e:
+        return str(e)
+    return None
+
+
+def read_urls(urls: Iterable[str], inputs: Iterable[str]) -> Iterator[str]:
+    # 引数とファイルからURLか動画IDを一つずつ取り出します。空の行と`#`で始まる行は飛ばします。
+    yield from urls
+    for source in inputs:
+        f = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+async def info_only(urls: Iterable[str], parsed: Namespace) -> int:
+    # 動画の情報を取得できたものから順番に一行ずつ出力します。
+    from niconico_dl import fetch_infos
+
+    failed = 0
+    async for video_id, data in fetch_infos(
+        urls, concurrency=parsed.jobs, fields=parsed.fields,
+        return_exceptions=True
+    ):
+        if isinstance(data, BaseException):
+            failed += 1
+            print(f"[niconico_dl] Failed {video_id}: {data!r}", file=sys.stderr)
+            continue
+        if parsed.fields:
+            data = {"id": video_id, **data}
+        print(dumps(data, ensure_ascii=False), flush=True)
+    return failed
+
+
+def download(urls: Iterable[str], parsed: Namespace, total: Optional[int]) -> int:
+    # `NicoNicoBatch`でダウンロードして、全ての動画の進捗をまとめて一行に表示します。
+    from niconico_dl import CombinedProgress, NicoNicoBatch
+
+    kwargs = {}
+    progress = None
+    # 端末でない場合は進捗の代わりに終わった動画を一行ずつ表示する。
+    if not parsed.quiet and sys.stderr.isatty():
+        progress = kwargs["progress"] = CombinedProgress(total)
+    report = progress.message if progress is not None \
+        else lambda text: print(text, file=sys.stderr)
+
+    failed = 0
+    batch = NicoNicoBatch(
+        urls, parsed.output, info_concurrency=parsed.jobs * 2,
+        session_concurrency=parsed.jobs, download_concurrency=parsed.jobs,
+        bandwidth=parsed.bandwidth, log=parsed.verbose,
+        skip_existing=parsed.skip_existing,
+        connections=parsed.connections, **kwargs
+    )
+    try:
+        for result in batch:
+            if result.skipped:
+                report(f"[niconico_dl] Skipped {result.path} (already exists)")
+            elif not result.ok:
+                failed += 1
+                report(f"[niconico_dl] Failed {result.url}: {result.error!r}")
+            elif parsed.verbose or progress is None:
+                report(f"[niconico_dl] Saved {result.path}")
+            if progress is not None:
+                progress.complete(result.url, result.ok)
+    finally:
+        if progress is not None:
+            progress.close()
+    return failed
+
+
+def serve(args: list) -> None:
+    from niconico_dl import RelayServer
+
+    parser = ArgumentParser(
+        prog="niconico_dl serve",
+        description="`/watch/<動画ID>`で動画を配信するHTTPサーバーを動かします。"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="サーバーのホストです。")
+    parser.add_argument("--port", type=int, default=8080, help="サーバーのポートです。")
+    parser.add_argument(
+        "--idle-timeout", type=float, default=60,
+        help="誰も見ていないセッションを閉じるまでの秒数です。"
+    )
+    parsed = parser.parse_args(args)
+    print(f"[niconico_dl] Serving on http://{parsed.host}:{parsed.port}/watch/<id>")
+    RelayServer(parsed.host, parsed.port, parsed.idle_timeout).run()
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "serve":
+        return serve(argv[1:])
+
+    parser = make_parser()
+    parsed = parser.parse_args(argv)
+    if parsed.jobs < 1 or parsed.connections < 1:
+        parser.error("`--jobs`と`--connections`は1以上にしてください。")
+    if not parsed.info_only:
+        reason = check_output(parsed.output)
+        if reason is not None:
+            parser.error(
+                f"`--output`のテンプレートが正しくありません：{reason} "
+                "使えるのは`{id}`と`{title}`だけです。"
+            )
+    inputs = list(parsed.input)
+    if not parsed.urls and not inputs:
+        if sys.stdin.isatty():
+            parser.print_help()
+            return
+        # パイプで渡された場合は標準入力から読み込む。
+        inputs.append("-")
+    urls = read_urls(parsed.urls, inputs)
+
+    try:
+        if parsed.info_only:
+            import asyncio
+
+            failed = asyncio.run(info_only(urls, parsed))
+        else:
+            failed = download(
+                urls, parsed, None if inputs else len(parsed.urls)
+            )
+    except KeyboardInterrupt:
+        print("\n[niconico_dl] Interrupted.", file=sys.stderr)
+        sys.exit(130)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,81 @@
 # niconico_dl - Async Video Manager by tasuren
 
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from aiofiles import open as async_open
-from aiohttp import ClientSession
+from aiohttp import (
+    ClientSession, ClientError, ClientResponseError, ClientTimeout,
+    TCPConnector, TraceConfig
+)
+from os.path import exists, getsize
 from json import loads, dumps
-from bs4 import BeautifulSoup
-from time import time
+from collections import deque
+from itertools import islice
+from time import perf_counter, time
 import asyncio
 
 from .templates import (
-    _make_sessiondata, HEADERS, URLS, NicoNicoAcquisitionFailed
+    _make_sessiondata, _parse_api_data, _split_ranges, _video_id,
+    _RangeNotSupported,
+    HEADERS, MODES, URLS, HeaderSet, NicoNicoAcquisitionFailed
+)
+from .journal import DownloadJournal
+from .stream import AsyncVideoStream
+from .writer import AdaptiveBuffer, FileWriter, MIN_BUFFER_SIZE
+from .progress import (
+    ProgressCallback, ProgressTracker, format_progress
+)
+from .tracing import DownloadStats, Span, Tracer, _span
+from . import hls
+from .cache import InfoCache
+from .limiter import RateLimiter, TokenBucket
+from .retry import RetryPolicy
+from .variants import (
+    Quality, Variant, _src_ids, choose_variants, list_variants,
+    resolve_variants
 )
+from .heartbeat import AsyncHeartbeatManager, HeartbeatSession
+
+
+def _make_trace_config() -> TraceConfig:
+    # DNSの名前解決、接続、TLSにかかった時間を`trace_request_ctx`の`DownloadStats`に記録します。
+    # `aiohttp`にはTLSのハンドシェイクのフックがないので、HTTPSの接続の時間からDNSの時間を引いたものをTLSとして記録する。
+    def stats_of(context) -> Optional[DownloadStats]:
+        stats = context.trace_request_ctx
+        return stats if isinstance(stats, DownloadStats) else None
+
+    async def request_start(session, context, params):
+        context.secure = params.url.scheme == "https"
+
+    async def dns_start(session, context, params):
+        context.dns_started = perf_counter()
+
+    async def dns_end(session, context, params):
+        if hasattr(context, "dns_started"):
+            context.dns = perf_counter() - context.dns_started
+            stats = stats_of(context)
+            if stats is not None:
+                stats.dns.append(context.dns)
+
+    async def connect_start(session, context, params):
+        context.connect_started, context.dns = perf_counter(), 0.0
+
+    async def connect_end(session, context, params):
+        stats = stats_of(context)
+        if stats is None or not hasattr(context, "connect_started"):
+            return
+        elapsed = perf_counter() - context.connect_started
+        stats.connect.append(elapsed)
+        if getattr(context, "secure", False):
+            stats.tls.append(elapsed - context.dns)
+
+    config = TraceConfig()
+    config.on_request_start.append(request_start)
+    config.on_dns_resolvehost_start.append(dns_start)
+    config.on_dns_resolvehost_end.append(dns_end)
+    config.on_connection_create_start.append(connect_start)
+    config.on_connection_create_end.append(connect_end)
+    return config
 
 
 class NicoNicoVideoAsync:
@@ -25,32 +89,90 @@ class NicoNicoVideoAsync:
         ニコニコ動画のURLです。
     log : bool, default False
         ログ出力をするかどうかです。
-    headers : dict, optional
-        通信時に使用するヘッダーです。  
-        デフォルトは`niconico_dl.HEADERS`が使われるので普通は変えなくて大丈夫です。
+    headers : HeaderSet or list, optional
+        通信時に使用するヘッダーです。`niconico_dl.HEADERS`と同じ形式のリストも使えます。  
+        デフォルトは`niconico_dl.HEADERS`が使われるので普通は変えなくて大丈夫です。  
+        渡したものはコピーされて書き換えられることはありません。
     loop : asyncio.AbstractLoop, optional
         使用するイベントループです。  
         指定しない場合は`asyncio.get_event_loop`によって自動で取得されます。
+    session : aiohttp.ClientSession, optional
+        通信に使用するセッションです。  
+        指定しない場合は同じイベントループを使う全ての`NicoNicoVideoAsync`で共有されるセッションが使われます。  
+        指定したセッションは`close`で閉じられないので、使い終わったら自分で閉じてください。
+    heartbeat_manager : AsyncHeartbeatManager, optional
+        Heartbeatを送るのに使う`AsyncHeartbeatManager`です。  
+        指定しない場合はイベントループごとに共有されるものが使われ、全てのセッションのHeartbeatが一つのTaskから送られます。
+    cache : InfoCache, optional
+        `get_info`で取得した動画の情報を保存しておくキャッシュです。  
+        指定した場合は同じ動画の情報をウォッチページから取得し直さずにキャッシュから取り出します。
+    hls : bool, default False
+        HLSで動画を配信するセッションを作るかどうかです。  
+        有効にした場合`download`はセグメントを並列でダウンロードしてつなげたMPEG-TSを保存します。
+    tracer : Tracer, optional
+        ウォッチページの取得やセッションの作成、ダウンロードなどの処理にかかった時間を受け取る`Tracer`です。  
+        指定した場合は`download`が`DownloadStats`を返します。指定しない場合は計測しません。
+    quality : Quality, optional
+        セッションを作る際の画質の選び方です。  
+        指定しない場合は使える全ての画質を要求して、どれを配信するかはニコニコ動画に任せます。  
+        後から`select_variant`で変えることもできます。
+    limits : RateLimiter, optional
+        ウォッチページの取得、セッションの作成、動画のダウンロードの制限に使う`RateLimiter`です。  
+        指定しない場合はプロセス全体で共有される`RateLimiter.get_default`が使われます。
+    audio_only : bool, default False
+        音声だけを配信するセッションを作るかどうかです。  
+        `download`、`get_download_link`、`open`(`stream`)の全てで音声だけになり、通信量を大きく減らせます。  
+        保存したファイルは音声だけのMP4なので、拡張子は`.m4a`にするのがおすすめです。  
+        音声だけのセッションをニコニコ動画が受け付けない場合は、一番ビットレートの低い動画と組み合わせたセッションになります。
 
     Attributes
     ----------
     loop : asyncio.AbstractEventLoop
         使用しているイベントループです。
-    heartbeat_task : asyncio.Task
-        HeartbeatのTaskです。  
+    heartbeat : HeartbeatSession
+        Heartbeatで生かしているセッションです。`health`で状態を確認できます。  
         Heartbeatを動かすまでこれはNoneです。
+    variant : Tuple[Optional[Variant], Optional[Variant]], optional
+        今のセッションで要求している動画と音声です。  
+        `quality`も`select_variant`も使っていない場合はNoneで、その場合は全ての画質を要求しています。  
+        `audio_only`が有効な場合は動画がNoneで、音声だけのセッションを受け付けられなかった場合は組み合わせた動画になります。
 
     SeeAlso
     -------
     NicoNicoVideo : このクラスの非非同期版です。"""
+
+    JOURNAL_CHUNK_SIZE = 1048576
+    CONNECTOR_OPTIONS = {
+        "limit": 100, "limit_per_host": 0,
+        "ttl_dns_cache": 300, "keepalive_timeout": 30
+    }
+    # イベントループごとの共有セッションとそれを使っているインスタンスの数です。
+    _shared_sessions: dict = {}
+
     def __init__(
         self, url: str, log: bool = False, headers: Optional[dict] = None,
-        loop: Optional[asyncio.AbstractEventLoop] = None
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        session: Optional[ClientSession] = None,
+        heartbeat_manager: Optional[AsyncHeartbeatManager] = None,
+        cache: Optional[InfoCache] = None, hls: bool = False,
+        tracer: Optional[Tracer] = None,
+        quality: Optional[Quality] = None,
+        limits: Optional[RateLimiter] = None, audio_only: bool = False
     ):
         self.loop: asyncio.AbstractEventLoop = loop or asyncio.get_event_loop()
-        self._headers = headers or HEADERS
+        self._headers = HeaderSet.make(headers or HEADERS)
         self._download_link = None
-        self.heartbeat_task: asyncio.Task = None
+        self.heartbeat: Optional[HeartbeatSession] = None
+        self._heartbeat_manager, self._cache = heartbeat_manager, cache
+        self._hls, self._tracer = hls, tracer
+        self.limits = limits or RateLimiter.get_default()
+        self._quality, self._audio_only = quality, audio_only
+        self._selected: Optional[Tuple[Optional[Variant], Optional[Variant]]] = None
+        self.variant: Optional[Tuple[Optional[Variant], Optional[Variant]]] = None
+        self._session, self._shared = session, False
+        self._closing: Optional[asyncio.Task] = None
+        # 動画の最初のレスポンスが返ってきた時に一度だけ呼ばれます。`SessionPool`が使います。
+        self._on_first_byte: Optional[Callable[[], Any]] = None
 
         if "nico.ms" in url:
             url = url.replace("nico.ms/", "www.nicovideo.jp/watch/")
@@ -59,9 +181,9 @@ class NicoNicoVideoAsync:
             url = url.replace("sp", "www")
 
         self._url, self._log = url, log
+        self.stats = DownloadStats(url) if tracer is not None else None
         self._data, self._download_link = {}, None
         self._working_heartbeat = asyncio.Event()
-        self._stop = False
 
     def print(self, *args, first: str = "", **kwargs) -> None:
         """niconico_dl用に用意したログ出力用の`print`です。"""
@@ -79,8 +201,68 @@ class NicoNicoVideoAsync:
 
     async def __aexit__(self, exc_type, exc, tb):
         # `async with`構文から抜けた際に呼び出されるもの。
-        # Heartbeatをストップします。
-        self.close()
+        # Heartbeatをストップして共有セッションを手放します。
+        await self.aclose()
+
+    @classmethod
+    def configure_connector(cls, **options) -> None:
+        """共有セッションのコネクションプールの設定をします。  
+        設定は次に共有セッションが作られる時から使われます。
+
+        Parameters
+        ----------
+        **options
+            `aiohttp.TCPConnector`に渡す引数です。  
+            例えば`limit`(全体の最大接続数)、`limit_per_host`(ホストごとの最大接続数)、
+            `ttl_dns_cache`(DNSのキャッシュの秒数)、`keepalive_timeout`(Keep-Aliveの秒数)などです。"""
+        cls.CONNECTOR_OPTIONS = dict(cls.CONNECTOR_OPTIONS, **options)
+
+    def _get_session(self) -> ClientSession:
+        # 通信に使うセッションを取得します。
+        # セッションが指定されていない場合は共有セッションを使います。
+        if self._session is None:
+            # 計測をする場合は計測用の設定をしたセッションを別に共有する。
+            key = (self.loop, self._tracer is not None)
+            shared = self._shared_sessions.get(key)
+            if shared is None or shared[0].closed:
+                shared = self._shared_sessions[key] = [
+                    ClientSession(
+                        connector=TCPConnector(**self.CONNECTOR_OPTIONS),
+                        # 大きい動画のダウンロードが途中で切られないように全体の時間制限はなくす。
+                        timeout=ClientTimeout(total=None, sock_read=60),
+                        trace_configs=[_make_trace_config()]
+                        if self._tracer is not None else None
+                    ), 0
+                ]
+            shared[1] += 1
+            self._session, self._shared = shared[0], True
+        return self._session
+
+    def _release_session(self, session: ClientSession) -> None:
+        # 共有セッションを手放します。誰も使っていないなら閉じます。
+        # 使っている数はすぐに減らして、閉じる処理だけはイベントループが動いているならタスクにします。
+        key = (self.loop, self._tracer is not None)
+        shared = self._shared_sessions.get(key)
+        if shared is None or shared[0] is not session:
+            return
+        shared[1] -= 1
+        if shared[1] > 0:
+            return
+        del self._shared_sessions[key]
+        if self.loop.is_running():
+            self._closing = self.loop.create_task(session.close())
+        elif not self.loop.is_closed():
+            # `asyncio.run`の後などイベントループが止まっている場合はその場で閉じる。
+            self.loop.run_until_complete(session.close())
+        else:
+            # イベントループが閉じている場合は接続も既に使えないので、閉じた状態にだけする。
+            session.detach()
+
+    def _first_byte(self) -> None:
+        # 動画の本体の最初のレスポンスが返ってきたことを`_on_first_byte`に伝えます。
+        callback, self._on_first_byte = self._on_first_byte, None
+        if callback is not None:
+            callback()
 
     async def connect(self) -> None:
         """ニコニコ動画に接続します。  
@@ -95,10 +277,7 @@ class NicoNicoVideoAsync:
         async with niconico_dl.NicoNicoVideoAsync(url) as nico:
             await nico.download("video.mp4")
         ```"""
-        self.heartbeat_task = self.loop.create_task(
-            self._heartbeat(), name="niconico_dl.heartbeat"
-        )
-        await self.wait_until_working_heartbeat()
+        await self._start_session(MODES[0] if self._hls else MODES[1])
 
     def close(self) -> None:
         """NicoNicoVideoAsyncを終了します。  
@@ -109,14 +288,23 @@ class NicoNicoVideoAsync:
 
         Warnings
         --------
-        これを使用してもイベントループは閉じません。"""
-        self._stop = True
-        if self.heartbeat_task:
-            try:
-                self.heartbeat_task.cancel()
-            except Exception as e:
-                if not isinstance(e, asyncio.CancelledError):
-                    raise e
+        これを使用してもイベントループは閉じません。  
+        イベントループが動いている場合、共有セッションを閉じる処理は後で行われます。  
+        閉じ終わるまで待つ場合は`aclose`を使用してください。"""
+        self._working_heartbeat.clear()
+        if self.heartbeat is not None:
+            self._get_heartbeat_manager().unregister(self.heartbeat)
+        if self._shared:
+            session, self._session, self._shared = self._session, None, False
+            self._release_session(session)
+
+    async def aclose(self) -> None:
+        """`close`をして、共有セッションを閉じ終わるまで待つコルーチン関数です。  
+        `async with`構文から抜けた際にはこれが実行されます。"""
+        self.close()
+        if self._closing is not None:
+            closing, self._closing = self._closing, None
+            await closing
 
     async def get_info(self) -> dict:
         """ニコニコ動画のウェブページから動画のデータを取得するコルーチン関数です。
@@ -131,24 +319,37 @@ class NicoNicoVideoAsync:
         NicoNicoAcquisitionFailed
             ニコニコ動画から情報を取得するのに失敗した際に発生します。"""
         self.print("Getting video data...")
+        if not self._data and self._cache is not None:
+            self._data = self._cache.get(_video_id(self._url)) or {}
         if not self._data:
             # もし動画データを取得していないなら動画URLのHTMLから動画データを取得する。
             # Heartbeatの通信にも必要なものでもあります。
-            async with ClientSession(raise_for_status=True) as session:
-                async with session.get(self._url, headers=self._headers[2]) as r:
-                    soup = BeautifulSoup(await r.text(), "html.parser")
-                    data = soup.find(
-                        "div", {"id": "js-initial-watch-data"}
-                    ).get("data-api-data")
-                    if data:
-                        self._data = loads(data)
-                    else:
-                        raise NicoNicoAcquisitionFailed(
-                            "ニコニコ動画から情報を取得するのに失敗しました。"
-                        )
+            await self._fetch_info()
         self.print("Done.")
         return self._data
 
+    async def _fetch_info(self) -> None:
+        # ウォッチページから動画データを取得します。
+        video_id = _video_id(self._url)
+        await self.limits.acquire_async("watch_page")
+        with _span(self._tracer, "watch_page", self.stats, video=video_id):
+            async with self._get_session().get(
+                self._url, headers=self._headers[2],
+                trace_request_ctx=self.stats
+            ) as r:
+                r.raise_for_status()
+                text = await r.text()
+        with _span(self._tracer, "parse", self.stats, video=video_id):
+            data = _parse_api_data(text)
+        if data:
+            self._data = loads(data)
+            if self._cache is not None:
+                self._cache.set(video_id, self._data)
+        else:
+            raise NicoNicoAcquisitionFailed(
+                "ニコニコ動画から情報を取得するのに失敗しました。"
+            )
+
     async def wait_until_working_heartbeat(self) -> None:
         """Heartbeatが動き出すまで待機します。"""
         await self._working_heartbeat.wait()
@@ -160,7 +361,49 @@ class NicoNicoVideoAsync:
         -------
         is_working : bool
             Heartbeatが動いているかどうかの真偽値です。"""
-        return self._working_heartbeat.is_set()
+        return self._working_heartbeat.is_set() and self.heartbeat.alive
+
+    async def get_variants(self) -> Dict[str, List[Variant]]:
+        """選べる画質と音質の一覧を取得します。
+
+        Returns
+        -------
+        variants : Dict[str, List[Variant]]
+            `video`と`audio`それぞれの`Variant`のリストです。ビットレートの高い順に並んでいます。"""
+        return list_variants((await self.get_info())["media"]["delivery"]["movie"])
+
+    async def select_variant(
+        self, video: Optional[str] = None, audio: Optional[str] = None,
+        quality: Optional[Quality] = None
+    ) -> Tuple[Optional[Variant], Optional[Variant]]:
+        """セッションで要求する動画と音声を選びます。  
+        `video`と`audio`でIDを指定するか、`quality`で選び方を指定します。  
+        IDを指定しなかった方は`quality`で、`quality`も指定しない場合は一番良いものが選ばれます。  
+        既にHeartbeatが動いている場合は選んだものでセッションを作り直します。
+
+        Parameters
+        ----------
+        video : str, optional
+            動画のIDです。`get_variants`で取得できる`Variant.id`です。
+        audio : str, optional
+            音声のIDです。
+        quality : Quality, optional
+            選び方です。
+
+        Returns
+        -------
+        variant : Tuple[Optional[Variant], Optional[Variant]]
+            選んだ動画と音声です。
+
+        Raises
+        ------
+        ValueError
+            存在しないか使えないIDを指定した場合に発生します。"""
+        movie = (await self.get_info())["media"]["delivery"]["movie"]
+        self._selected = choose_variants(movie, video, audio, quality)
+        if self.heartbeat is not None and self._working_heartbeat.is_set():
+            await self._reconnect()
+        return self._selected
 
     async def get_download_link(self) -> str:
         """
@@ -187,7 +430,40 @@ class NicoNicoVideoAsync:
 
         return self._download_link
 
-    async def download(self, path: str, load_chunk_size: int = 1024) -> None:
+    async def stream(
+        self, chunk_size: int = 65536, buffer_size: int = 16,
+        retry: Union[int, RetryPolicy] = 3
+    ) -> AsyncVideoStream:
+        """動画を少しずつ読み込むための`AsyncVideoStream`を作ります。  
+        一時ファイルを作らずにffmpegやボイスクライアントに動画を渡したい場合に使えます。  
+        Heartbeatが動いていない場合は動かして、`AsyncVideoStream`を閉じた際に止めます。
+
+        Parameters
+        ----------
+        chunk_size : int, default 65536
+            一度に読み込むバイト数です。
+        buffer_size : int, default 16
+            先読みしておくチャンクの最大数です。
+        retry : int or RetryPolicy, default 3
+            読み込みに失敗した際に接続し直して今の位置から読み込み直す回数か`RetryPolicy`です。
+
+        Returns
+        -------
+        stream : AsyncVideoStream
+            `async for`で読み込める非同期イテレータです。`seek`と`read`も使えます。"""
+        return await AsyncVideoStream(
+            self, chunk_size, buffer_size, not self.is_working_heartbeat(),
+            retry
+        )._prepare()
+
+    async def download(
+        self, path: str, load_chunk_size: int = MIN_BUFFER_SIZE,
+        connections: int = 1, resume: bool = True,
+        retry: Union[int, RetryPolicy] = 3,
+        limiter: Optional[TokenBucket] = None,
+        progress: Optional[ProgressCallback] = None,
+        progress_interval: float = 0.5
+    ) -> Optional[DownloadStats]:
         """ニコニコ動画の動画をダウンロードします。  
         mp4形式でダウンロードされます。
 
@@ -204,15 +480,105 @@ class NicoNicoVideoAsync:
         Notes
         -----
         もし`async with`構文を使用しないでダウンロードする場合は、ダウンロード前に`connect`を、ダウンロード終了後に`close`を実行してください。  
-        動画データの通信に必要なHeartbeatが永遠に動き続けることになります。
+        動画データの通信に必要なHeartbeatが永遠に動き続けることになります。  
+        `connections`を2以上にした場合は動画をバイト範囲に分割して複数の接続で同時にダウンロードします。  
+        サーバーが`Range`に対応していない場合は通常通り一つの接続でダウンロードします。  
+        `resume`が有効な場合はダウンロードの進捗を`<path>.niconico_dl`に記録します。  
+        ダウンロードに失敗した際は`retry`に従って少し待ってからニコニコ動画に接続し直して、ダウンロードが終わっていない部分だけをダウンロードし直します。  
+        これは`resume`が無効な場合も同じです。Heartbeatが止まってセッションが切れていた場合もセッションを作り直します。  
+        同じ保存先で実行し直した場合も前回の続きからダウンロードします。  
+        `hls`を有効にしている場合は`connections`は同時にダウンロードするセグメントの数になり、`resume`は使われません。
 
         Parameters
         ----------
         path : str
             ダウンロードするニコニコ動画の動画の保存先です。
-        load_chunk_size : int, default 1024
-            一度にどれほどの量をダウンロードするかです。"""
+        load_chunk_size : int, default 65536
+            一度にどれほどの量をダウンロードするかの最初の値です。  
+            読み込める量に合わせて`niconico_dl.writer.MAX_BUFFER_SIZE`(4MiB)まで自動で大きくなります。
+        connections : int, default 1
+            同時に使用する接続の数です。
+        resume : bool, default True
+            途中からのダウンロードをできるようにするかどうかです。
+        retry : int or RetryPolicy, default 3
+            ダウンロードに失敗した際に接続し直す回数か、やり直し方を決める`RetryPolicy`です。  
+            回数を指定した場合は`RetryPolicy`の初期設定で、待つ時間を伸ばしながらやり直します。
+        limiter : TokenBucket, optional
+            ダウンロードの速度を制限するための`TokenBucket`です。  
+            複数のダウンロードで同じものを使えば合計の速度を制限できます。
+        progress : Callable[[Progress], None], optional
+            進捗を受け取る関数です。`progress_interval`秒ごとに`Progress`が渡されます。  
+            指定しない場合は`log`が有効な時だけ`terminal_renderer`と同じ表示で進捗を出力します。
+        progress_interval : float, default 0.5
+            `progress`を呼び出す最短の間隔(秒)です。
+
+        Returns
+        -------
+        stats : DownloadStats, optional
+            `tracer`を指定した場合はダウンロードの統計です。指定していない場合はNoneです。"""
         self.print("Now loading...")
+        BASE = "Downloading video... :"
+        journal = DownloadJournal(path, self._url, persist=resume) \
+            if not self._hls else None
+        policy = RetryPolicy.from_value(retry)
+        if progress is None and self._log:
+            progress = lambda progress: self.print(
+                BASE, format_progress(progress), first="\r", end=""
+            )
+        tracker = ProgressTracker(progress, self._url, progress_interval) \
+            if progress is not None else None
+
+        with _span(self._tracer, "download", self.stats, video=_video_id(self._url)):
+            attempt, reconnect = 0, False
+            while True:
+                try:
+                    if reconnect or (
+                        self.heartbeat is not None and not self.heartbeat.alive
+                    ):
+                        # 失敗した後やHeartbeatが止まってセッションが切れている場合はセッションを作り直す。
+                        await self._reconnect()
+                        reconnect = False
+                    if self._hls:
+                        await self._download_hls(
+                            path, connections, BASE, limiter, tracker
+                        )
+                    else:
+                        await self._download(
+                            path, load_chunk_size, connections, journal, BASE,
+                            limiter, tracker
+                        )
+                except (ClientError, asyncio.TimeoutError) as e:
+                    if journal is not None and journal.size is not None:
+                        journal.save()
+                    if not policy.should_retry(attempt, e):
+                        raise e
+                    delay = policy.delay(attempt, e)
+                    self.print(
+                        f"Failed to download ({e}), retrying in {delay:.1f}s...",
+                        first="\n"
+                    )
+                    if self.stats is not None:
+                        self.stats.retries += 1
+                    await asyncio.sleep(delay)
+                    attempt, reconnect = attempt + 1, True
+                else:
+                    policy.succeeded()
+                    break
+
+        if journal is not None:
+            journal.remove()
+        if tracker is not None:
+            tracker.finish()
+        self.print("Done.", first="\n")
+        return self._finish_stats()
+
+    async def _download(
+        self, path: str, load_chunk_size: int, connections: int,
+        journal: Optional[DownloadJournal], base: str,
+        limiter: Optional[TokenBucket] = None,
+        tracker: Optional[ProgressTracker] = None
+    ) -> None:
+        # ダウンロードが終わっていない部分をダウンロードします。
         url = await self.get_download_link()
 
         params = (
@@ -221,87 +587,315 @@ class NicoNicoVideoAsync:
                 self.result_data["content_auth"]["content_auth_info"]["value"]
             ),
         )
-        headers = self._headers[1]
-        headers["Content-Type"] = "video/mp4"
+        headers = self._headers.media
 
-        BASE = "Downloading video... :"
-        self.print(BASE, "Now loading...", first="\r", end="")
-
-        async with ClientSession(raise_for_status=True) as session:
-            async with session.get(url, headers=headers, params=params) as r:
-                size, now_size = r.content_length, 0
-
-                self.print(BASE, "Making a null file...", first="\r", end="")
-
-                async with async_open(path, "wb") as f:
-                    await f.write(b"")
-                async with async_open(path, "ab") as f:
-                    async for chunk in r.content.iter_chunked(load_chunk_size):
-                        if chunk:
-                            now_size += len(chunk)
-                            await f.write(chunk)
-                            self.print(
-                                BASE,
-                                f"{int(now_size/size*100)}% ({now_size}/{size})",
-                                first="\r", end=""
-                            )
+        self.print(base, "Now loading...", first="\r", end="")
 
-        self.print("Done.")
+        session = self._get_session()
+        with _span(self._tracer, "head", self.stats):
+            started = perf_counter()
+            async with session.head(
+                url, headers=headers, params=params,
+                trace_request_ctx=self.stats
+            ) as r:
+                if self.stats is not None:
+                    self.stats.ttfb.append(perf_counter() - started)
+                r.raise_for_status()
+                size = r.content_length
+                ranged = r.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+        if (
+            ranged and journal is not None and journal.load(size)
+            and exists(path) and getsize(path) == size
+        ):
+            missing = journal.missing()
+            self.print(
+                base, f"Resuming from {journal.done_size}/{size}...",
+                first="\r", end=""
+            )
+        else:
+            # 先にファイルを動画のサイズで作っておいて各範囲をその位置に直接書き込む。
+            self.print(base, "Making a null file...", first="\r", end="")
+            async with async_open(path, "wb") as f:
+                await f.truncate(size)
+            if journal is not None:
+                journal.reset(size)
+            missing = [(0, size - 1)]
+
+        if tracker is not None:
+            tracker.reset(
+                size - sum(end - start + 1 for start, end in missing), size
+            )
+
+        async def fetch(start: int, end: int, use_range: bool) -> None:
+            # 指定されたバイト範囲をダウンロードしてファイルのその位置に書き込みます。
+            with _span(
+                self._tracer, "transfer", self.stats, start=start, end=end
+            ) as span:
+                started = perf_counter()
+                async with session.get(
+                    url, params=params, headers=dict(
+                        headers, Range=f"bytes={start}-{end}"
+                    ) if use_range else headers, trace_request_ctx=self.stats
+                ) as r:
+                    r.raise_for_status()
+                    if use_range and r.status != 206:
+                        raise _RangeNotSupported()
+                    if self._on_first_byte is not None:
+                        self._first_byte()
+                    if self.stats is not None:
+                        span.attributes["ttfb"] = perf_counter() - started
+                        self.stats.ttfb.append(span.attributes["ttfb"])
+                    # 読み込んだデータをまとめて、書き込みは別スレッドでしている間に次を読み込む。
+                    buffer, batch, now = AdaptiveBuffer(load_chunk_size), bytearray(), start
+                    writing: Optional[asyncio.Future] = None
+                    written = (start, start)
+                    with FileWriter(path) as writer:
+                        try:
+                            while True:
+                                data = await r.content.read(buffer.size)
+                                if data:
+                                    buffer.update(len(data))
+                                    await self.limits.acquire_async("media", len(data))
+                                    if limiter is not None:
+                                        await limiter.acquire_async(len(data))
+                                    batch += data
+                                    if tracker is not None:
+                                        tracker.advance(len(data))
+                                if batch and (
+                                    not data or len(batch) >= self.JOURNAL_CHUNK_SIZE
+                                ):
+                                    if writing is not None:
+                                        await writing
+                                        # 書き込みが終わった部分を記録する。
+                                        if journal is not None:
+                                            journal.add(*written)
+                                    written = (now, now + len(batch) - 1)
+                                    writing = self.loop.run_in_executor(
+                                        None, writer.write, batch, now
+                                    )
+                                    now += len(batch)
+                                    batch = bytearray()
+                                if not data:
+                                    break
+                            if writing is not None:
+                                await writing
+                                writing = None
+                                if journal is not None:
+                                    journal.add(*written)
+                        finally:
+                            # 書き込み中のままファイルを閉じないようにする。
+                            # 失敗した場合もやり直す際にその続きから始められるように書き込めた部分を記録する。
+                            if writing is not None:
+                                await asyncio.wait((writing,))
+                                if journal is not None and not writing.cancelled() \
+                                        and writing.exception() is None:
+                                    journal.add(*written)
+                            if self.stats is not None:
+                                span.attributes["bytes"] = now - start
+                                self.stats.add_bytes(now - start)
+
+        if not missing:
+            # 前回のダウンロードが記録を消す前に止まった場合など、全て終わっている場合は何もしない。
+            return
+        if not ranged or (connections <= 1 and missing == [(0, size - 1)]):
+            return await fetch(0, size - 1, False)
+
+        ranges, semaphore = _split_ranges(missing, connections), \
+            asyncio.Semaphore(connections)
+
+        async def worker(start: int, end: int) -> None:
+            async with semaphore:
+                await fetch(start, end, True)
+
+        tasks = [
+            self.loop.create_task(
+                worker(*range_), name="niconico_dl.download"
+            ) for range_ in ranges
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except _RangeNotSupported:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        else:
+            return
+
+        self.print(
+            "Range is not supported, falling back to single connection...",
+            first="\n"
+        )
+        if journal is not None:
+            journal.reset(size)
+        if tracker is not None:
+            tracker.reset(0, size)
+        await fetch(0, size - 1, False)
+
+    async def _download_hls(
+        self, path: str, connections: int, base: str,
+        limiter: Optional[TokenBucket] = None,
+        tracker: Optional[ProgressTracker] = None
+    ) -> None:
+        # HLSのセグメントを並列でダウンロードして順番通りにつなげて保存します。
+        url = await self.get_download_link()
+        params = (
+            (
+                "ht2_nicovideo",
+                self.result_data["content_auth"]["content_auth_info"]["value"]
+            ),
+        )
+        headers, session = self._headers.media, self._get_session()
+
+        async def get(url: str, segment: bool = False, **kwargs) -> tuple:
+            async with session.get(
+                url, headers=headers, trace_request_ctx=self.stats, **kwargs
+            ) as r:
+                r.raise_for_status()
+                if segment and self._on_first_byte is not None:
+                    self._first_byte()
+                return await r.read(), str(r.url)
+
+        self.print(base, "Loading playlist...", first="\r", end="")
+        text, url = await get(url, params=params)
+        text = text.decode()
+        if hls.is_master(text):
+            # 一番画質の良いものを使う。
+            text, url = await get(hls.parse_master(text, url)[-1][1])
+            text = text.decode()
+        segments, keys = hls.parse_media(text, url), {}
+
+        async def fetch(segment: hls.Segment) -> bytes:
+            with _span(
+                self._tracer, "transfer", self.stats, segment=segment.url
+            ) as span:
+                data = (await get(segment.url, True))[0]
+                if self.stats is not None:
+                    span.attributes["bytes"] = len(data)
+                    self.stats.add_bytes(len(data))
+            if segment.key is not None:
+                if segment.key.uri not in keys:
+                    keys[segment.key.uri] = self.loop.create_task(
+                        get(segment.key.uri)
+                    )
+                key = (await keys[segment.key.uri])[0]
+                data = hls.decrypt(data, key, segment.iv)
+            return data
+
+        # 同時にダウンロードするのは`connections`個までで、終わったものから順番に書き込む。
+        window, tasks, iterator = max(1, connections), deque(), iter(segments)
+        for segment in islice(iterator, window):
+            tasks.append(self.loop.create_task(fetch(segment)))
+        try:
+            async with async_open(path, "wb") as f:
+                for _ in segments:
+                    data = await tasks.popleft()
+                    segment = next(iterator, None)
+                    if segment is not None:
+                        tasks.append(self.loop.create_task(fetch(segment)))
+                    await self.limits.acquire_async("media", len(data))
+                    if limiter is not None:
+                        await limiter.acquire_async(len(data))
+                    await f.write(data)
+                    if tracker is not None:
+                        tracker.advance(len(data))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _reconnect(self) -> None:
+        # Heartbeatを止めてニコニコ動画に接続し直します。
+        # 新しいセッションでダウンロードリンクを取得し直すのに使います。
+        self._working_heartbeat.clear()
+        if self.heartbeat is not None:
+            self._get_heartbeat_manager().unregister(self.heartbeat)
+        self._download_link = None
+        await self.connect()
+
+    def _get_heartbeat_manager(self) -> AsyncHeartbeatManager:
+        if self._heartbeat_manager is None:
+            self._heartbeat_manager = AsyncHeartbeatManager.get_default(self.loop)
+        return self._heartbeat_manager
+
+    def _on_heartbeat(self, data: dict) -> None:
+        # Heartbeatが成功した際に`AsyncHeartbeatManager`から呼ばれます。
+        self.result_data = data
+        self.print("Received data", data)
+        if self._tracer is not None and self.heartbeat is not None:
+            latency = self.heartbeat.latency
+            self.stats.heartbeat.append(latency)
+            self._tracer.record(Span(
+                "heartbeat", time() - latency, latency,
+                {"video": _video_id(self._url), "session": self.heartbeat.id}
+            ))
+
+    def _finish_stats(self) -> Optional[DownloadStats]:
+        # 統計を`Tracer`に渡して次のダウンロード用に新しくします。
+        if self._tracer is None:
+            return None
+        stats, self.stats = self.stats, DownloadStats(self._url)
+        self._tracer.finish(stats)
+        return stats
+
+    async def _post_session(
+        self, session: ClientSession, movie: dict, mode: str
+    ) -> dict:
+        # `self.variant`で選んだものを要求するセッションを作ります。
+        videos, audios = _src_ids(self.variant, self._audio_only)
+        data = _make_sessiondata(movie, mode=mode, videos=videos, audios=audios)
+        self.print("Sending Heartbeat Init Data... :", data)
+        await self.limits.acquire_async("session")
+        with _span(
+            self._tracer, "session", self.stats, video=_video_id(self._url)
+        ):
+            async with session.post(
+                URLS["base_heartbeat"] + "?_format=json",
+                headers=self._headers[1], json=data,
+                trace_request_ctx=self.stats
+            ) as r:
+                r.raise_for_status()
+                return (await r.json(loads=loads))["data"]["session"]
 
-    async def _heartbeat(self, mode = "http_output_download_parameters") -> None:
-        # Heartbeatです。
+    async def _start_session(self, mode = "http_output_download_parameters") -> None:
+        # セッションを作って`AsyncHeartbeatManager`にHeartbeatを任せます。
         self.print("Starting heartbeat...")
-        if not self._data:
+        if self._cache is not None and not \
+                self._cache.is_volatile_fresh(_video_id(self._url)):
+            # キャッシュの`media.delivery`の情報が古い場合は取得し直す。
+            await self._fetch_info()
+        elif not self._data:
             await self.get_info()
 
         # セッションに必要なデータを`NicoNicoVideoAsync.get_info`で取得したデータから取得します。
-        data = _make_sessiondata(
-            self._data["media"]["delivery"]["movie"], mode=mode
+        movie = self._data["media"]["delivery"]["movie"]
+        self.variant = resolve_variants(
+            movie, self._selected, self._quality, self._audio_only
         )
-        self.print("Sending Heartbeat Init Data... :", data)
 
         # 一番最初のHeartbeatの通信をします。
-        async with ClientSession(raise_for_status=True) as session:
-            async with session.post(
-                URLS["base_heartbeat"] + "?_format=json",
-                headers=self._headers[1], json=data
-            ) as r:
-                self.result_data = (await r.json(loads=loads))["data"]["session"]
-        session_id = self.result_data["id"]
+        session = self._get_session()
+        try:
+            self.result_data = await self._post_session(session, movie, mode)
+        except ClientResponseError as e:
+            if not self._audio_only or self.variant[0] is not None \
+                    or e.status >= 500:
+                raise
+            # 音声だけのセッションを受け付けない場合は一番小さい動画と組み合わせる。
+            self.print("Audio only session was rejected, retrying with the smallest video...")
+            self.variant = resolve_variants(
+                movie, self._selected, self._quality, True, True
+            )
+            self.result_data = await self._post_session(session, movie, mode)
 
-        self.print("Done. session_id. : " + str(session_id))
+        self.print("Done. session_id. : " + str(self.result_data["id"]))
+        self.heartbeat = self._get_heartbeat_manager().register(
+            HeartbeatSession(
+                self.result_data, session, self._headers, self._on_heartbeat
+            )
+        )
         self._working_heartbeat.set()
-
-        data, first = {"session": self.result_data}, True
-        get_interval = lambda now: now + data["session"]["keep_method"]["heartbeat"]["lifetime"] / 1000 - 3
-        make_url = lambda session_id: f"{URLS['base_heartbeat']}/{session_id}?_format=json&_method=PUT"
-        after = get_interval(time())
-
-        while not self._stop:
-            now = time()
-            # ここで定期的にHeartbeatを送ります。
-            if now >= after:
-                self.print("Sending heartbeat...", data)
-
-                if first:
-                    # 最初は普通とは違うやつもリクエストしないといけないのでする。
-                    async with ClientSession(raise_for_status=True) as session:
-                        async with session.options(
-                            make_url(session_id), headers=self._headers[0]
-                        ) as r:
-                            r.raise_for_status()
-                    first = False
-
-                async with ClientSession(raise_for_status=True) as session:
-                    async with session.post(
-                        make_url(session_id),
-                        headers=self._headers[1], json=data
-                    ) as r:
-                        self.result_data = (await r.json(loads=loads))["data"]["session"]
-
-                self.print("Done.")
-                data = {"session": self.result_data}
-
-                after = get_interval(now)
-            else:
-                await asyncio.sleep(0.05)
\ No newline at end of file
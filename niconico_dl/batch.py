@@ -0,0 +1,224 @@
+# niconico_dl - Batch
+
+from typing import (
+    AsyncIterator, Callable, Iterable, Iterator, List, NamedTuple, Optional,
+    Union
+)
+
+from os.path import dirname, exists
+from os import makedirs
+import asyncio
+import re
+
+from .async_video_manager import NicoNicoVideoAsync
+from .journal import DownloadJournal
+from .limiter import TokenBucket
+from .cache import InfoCache
+from .templates import _make_url
+
+
+class BatchResult(NamedTuple):
+    """`NicoNicoBatch`でダウンロードした動画一つ分の結果です。
+
+    Attributes
+    ----------
+    url : str
+        ニコニコ動画のURLです。
+    path : str, optional
+        動画の保存先です。ダウンロードする前に失敗した場合はNoneです。
+    data : dict, optional
+        `get_info`で取得した動画の情報です。取得に失敗した場合はNoneです。
+    error : BaseException, optional
+        失敗した場合に発生したエラーです。成功した場合はNoneです。
+    skipped : bool, default False
+        `skip_existing`が有効で、保存先が既にあったためダウンロードしなかったかどうかです。"""
+    url: str
+    path: Optional[str]
+    data: Optional[dict]
+    error: Optional[BaseException]
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """ダウンロードに成功したかどうかです。"""
+        return self.error is None
+
+
+# ファイル名に使えない文字です。
+_UNSAFE_CHARACTERS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def _safe_filename(name: str) -> str:
+    # タイトルなどをファイル名に使えるようにします。
+    return _UNSAFE_CHARACTERS.sub("_", name).strip() or "_"
+
+
+class NicoNicoBatch:
+    """たくさんのニコニコ動画の動画をまとめてダウンロードするためのクラスです。  
+    動画の情報の取得、セッションの作成、ダウンロードをそれぞれ別の同時実行数で並列に実行します。  
+    非同期で動きますが`run_sync`や`for`文を使えば非同期でないところからも使えます。
+
+    Parameters
+    ----------
+    urls : Iterable[str]
+        ダウンロードするニコニコ動画のURLか動画IDです。  
+        必要になった時に一つずつ取り出されるので、ジェネレーターなどを渡すこともできます。
+    path : str or Callable[[dict], str], default "{id}.mp4"
+        動画の保存先です。  
+        文字列の場合は`str.format`で`{id}`と`{title}`が動画のIDとタイトルに置き換えられます。  
+        タイトルのファイル名に使えない文字は`_`に置き換えられます。  
+        関数の場合は`get_info`で取得した動画の情報が渡されるので、保存先を返してください。
+    info_concurrency : int, default 8
+        同時に動画の情報を取得する数です。
+    session_concurrency : int, default 4
+        同時にセッションを作る数です。
+    download_concurrency : int, default 4
+        同時にダウンロードする数です。
+    bandwidth : int, optional
+        全てのダウンロードの合計の最大速度(バイト毎秒)です。指定しないか0の場合は制限しません。
+    log : bool, default False
+        ログ出力をするかどうかです。
+    headers : dict, optional
+        通信時に使用するヘッダーです。
+    cache : InfoCache, optional
+        動画の情報を保存しておくキャッシュです。
+    skip_existing : bool, default False
+        保存先が既にある動画をダウンロードしないかどうかです。  
+        途中までダウンロードされていて`<保存先>.niconico_dl`がある場合は続きからダウンロードします。
+    **kwargs
+        `NicoNicoVideoAsync.download`に渡す引数です。
+
+    Examples
+    --------
+    ```python
+    async def main():
+        batch = niconico_dl.NicoNicoBatch(["sm9", "sm9664372"])
+        async for result in batch:
+            print(result.url, "OK" if result.ok else result.error)
+
+    # 非同期でない場合
+    for result in niconico_dl.NicoNicoBatch(["sm9", "sm9664372"]):
+        print(result.url, "OK" if result.ok else result.error)
+    ```"""
+
+    def __init__(
+        self, urls: Iterable[str],
+        path: Union[str, Callable[[dict], str]] = "{id}.mp4",
+        info_concurrency: int = 8, session_concurrency: int = 4,
+        download_concurrency: int = 4, bandwidth: Optional[int] = None,
+        log: bool = False, headers: Optional[dict] = None,
+        cache: Optional[InfoCache] = None, skip_existing: bool = False,
+        **kwargs
+    ):
+        self._urls, self._path = urls, path
+        self.info_concurrency = info_concurrency
+        self.session_concurrency = session_concurrency
+        self.download_concurrency = download_concurrency
+        self._log, self._headers, self._kwargs = log, headers, kwargs
+        self._cache, self.skip_existing = cache, skip_existing
+        if bandwidth:
+            self._kwargs.setdefault("limiter", TokenBucket(bandwidth))
+
+    def _make_path(self, data: dict) -> str:
+        # 動画の情報から保存先を作ります。
+        if callable(self._path):
+            return self._path(data)
+        return self._path.format(
+            id=data["video"]["id"], title=_safe_filename(data["video"]["title"])
+        )
+
+    async def _process(
+        self, url: str, semaphores: tuple, loop: asyncio.AbstractEventLoop
+    ) -> BatchResult:
+        # 動画一つ分の情報の取得、セッションの作成、ダウンロードを行います。
+        info, session, download = semaphores
+        url = _make_url(url)
+        nico = NicoNicoVideoAsync(
+            url, log=self._log, headers=self._headers, loop=loop,
+            cache=self._cache
+        )
+        data = path = None
+        try:
+            async with info:
+                data = await nico.get_info()
+            path = self._make_path(data)
+            if self.skip_existing and exists(path) \
+                    and not exists(path + DownloadJournal.EXTENSION):
+                return BatchResult(url, path, data, None, True)
+            # `videos/{title}.mp4`のような保存先のフォルダがない場合は作ります。
+            makedirs(dirname(path) or ".", exist_ok=True)
+            # セッションはダウンロードできるようになってから作ります。
+            # 先に作ると待っている間もHeartbeatを動かし続けることになるからです。
+            async with download:
+                async with session:
+                    await nico.connect()
+                await nico.download(path, **self._kwargs)
+        except Exception as e:
+            return BatchResult(url, path, data, e)
+        finally:
+            await nico.aclose()
+        return BatchResult(url, path, data, None)
+
+    async def __aiter__(self) -> AsyncIterator[BatchResult]:
+        # 終わったものから順番に結果を返します。
+        loop = asyncio.get_event_loop()
+        semaphores = (
+            asyncio.Semaphore(self.info_concurrency),
+            asyncio.Semaphore(self.session_concurrency),
+            asyncio.Semaphore(self.download_concurrency)
+        )
+        # 一度にたくさんの動画を渡されてもメモリを使いすぎないように、
+        # 同時に処理する動画の数を制限しながら一つずつ取り出します。
+        window = self.info_concurrency + self.download_concurrency
+        urls, pending = iter(self._urls), set()
+        try:
+            while True:
+                for url in urls:
+                    pending.add(loop.create_task(
+                        self._process(url, semaphores, loop),
+                        name="niconico_dl.batch"
+                    ))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def run(self) -> List[BatchResult]:
+        """全ての動画をダウンロードして、その結果をリストで返します。
+
+        Returns
+        -------
+        results : List[BatchResult]
+            それぞれの動画の結果です。終わった順番に並んでいます。"""
+        return [result async for result in self]
+
+    def __iter__(self) -> Iterator[BatchResult]:
+        # 非同期でないところから使うためのものです。
+        loop = asyncio.new_event_loop()
+        iterator = self.__aiter__()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(iterator.aclose())
+            loop.close()
+
+    def run_sync(self) -> List[BatchResult]:
+        """`run`の非同期でない版です。
+
+        Returns
+        -------
+        results : List[BatchResult]
+            それぞれの動画の結果です。終わった順番に並んでいます。"""
+        return list(self)
@@ -0,0 +1,227 @@
+# niconico_dl - Cache
+
+from typing import Optional, Tuple
+
+from collections import OrderedDict
+from json import loads, dumps
+from threading import Lock
+from time import time
+import sqlite3
+import zlib
+
+
+class InfoCache:
+    """`get_info`で取得した動画の情報をメモリに保存しておくためのキャッシュです。
+    動画IDごとに保存され、保存できる数を超えた場合は最後に使われたのが一番古いものから消されます。
+
+    Notes
+    -----
+    動画の情報のうちタイトルや投稿者などはあまり変わりませんが、`media.delivery`に入っているセッションを作るためのトークンはすぐに使えなくなります。
+    そのため`ttl`とは別に`volatile_ttl`を設定できるようになっていて、それを過ぎた情報はセッションを作る際には使われずに取得し直されます。
+
+    Parameters
+    ----------
+    ttl : float, default 3600
+        情報を使う最長の秒数です。
+    volatile_ttl : float, default 60
+        `media.delivery`の情報を使う最長の秒数です。
+    maxsize : int, default 1024
+        保存する動画の情報の最大数です。
+
+    Attributes
+    ----------
+    hits : int
+        キャッシュが使われた回数です。
+    misses : int
+        キャッシュが使えなかった回数です。
+
+    Examples
+    --------
+    ```python
+    cache = niconico_dl.InfoCache(ttl=86400)
+    data = niconico_dl.NicoNicoVideo(url, cache=cache).get_info()
+    ```"""
+
+    def __init__(
+        self, ttl: float = 3600, volatile_ttl: float = 60, maxsize: int = 1024
+    ):
+        self.ttl, self.volatile_ttl, self.maxsize = ttl, volatile_ttl, maxsize
+        self.hits, self.misses = 0, 0
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """キャッシュの統計を返します。
+
+        Returns
+        -------
+        stats : dict
+            `hits`、`misses`、`size`(保存されている数)が入ります。"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def _is_fresh(self, stored: float, volatile: bool) -> bool:
+        return time() - stored <= (self.volatile_ttl if volatile else self.ttl)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _load(self, video_id: str) -> Optional[Tuple[float, dict]]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                self._entries.move_to_end(video_id)
+            return entry
+
+    def _store(self, video_id: str, stored: float, data: dict) -> None:
+        with self._lock:
+            self._entries[video_id] = (stored, data)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _delete(self, video_id: str) -> None:
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def get(self, video_id: str, volatile: bool = False) -> Optional[dict]:
+        """保存されている動画の情報を取得します。
+
+        Parameters
+        ----------
+        video_id : str
+            動画IDです。
+        volatile : bool, default False
+            `media.delivery`の情報も使うかどうかです。
+            `True`の場合は`volatile_ttl`を過ぎた情報は返されません。
+
+        Returns
+        -------
+        data : dict, optional
+            動画の情報です。ないか古い場合はNoneです。"""
+        entry = self._load(video_id)
+        if entry is not None and not self._is_fresh(entry[0], False):
+            self._delete(video_id)
+            entry = None
+        hit = entry is not None and self._is_fresh(entry[0], volatile)
+        self._count(hit)
+        return entry[1] if hit else None
+
+    def is_volatile_fresh(self, video_id: str) -> bool:
+        """保存されている`media.delivery`の情報がまだ使えるかどうかを返します。  
+        `get`とは違いこれは`hits`と`misses`を増やしません。
+
+        Parameters
+        ----------
+        video_id : str
+            動画IDです。
+
+        Returns
+        -------
+        fresh : bool
+            `volatile_ttl`を過ぎていない情報が保存されているかどうかです。"""
+        entry = self._load(video_id)
+        return entry is not None and self._is_fresh(entry[0], True)
+
+    def set(self, video_id: str, data: dict) -> None:
+        """動画の情報を保存します。
+
+        Parameters
+        ----------
+        video_id : str
+            動画IDです。
+        data : dict
+            `get_info`で取得した動画の情報です。"""
+        self._store(video_id, time(), data)
+
+    def clear(self) -> None:
+        """保存されている全ての情報を消します。"""
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteInfoCache(InfoCache):
+    """動画の情報をSQLiteのファイルに圧縮して保存するキャッシュです。
+    複数のプロセスで同じファイルを使うことができます。
+    使い方は`InfoCache`と同じです。
+
+    Parameters
+    ----------
+    path : str
+        SQLiteのファイルのパスです。
+    ttl : float, default 3600
+        情報を使う最長の秒数です。
+    volatile_ttl : float, default 60
+        `media.delivery`の情報を使う最長の秒数です。
+    maxsize : int, default 65536
+        保存する動画の情報の最大数です。"""
+
+    def __init__(
+        self, path: str, ttl: float = 3600, volatile_ttl: float = 60,
+        maxsize: int = 65536
+    ):
+        super().__init__(ttl, volatile_ttl, maxsize)
+        self.path = path
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS info ("
+                "video_id TEXT PRIMARY KEY, stored REAL, accessed REAL, data BLOB)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS info_accessed ON info (accessed)"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM info"
+            ).fetchone()[0]
+
+    def _load(self, video_id: str) -> Optional[Tuple[float, dict]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT stored, data FROM info WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE info SET accessed = ? WHERE video_id = ?",
+                (time(), video_id)
+            )
+        return row[0], loads(zlib.decompress(row[1]))
+
+    def _store(self, video_id: str, stored: float, data: dict) -> None:
+        blob = zlib.compress(dumps(data, ensure_ascii=False).encode())
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?)",
+                (video_id, stored, stored, blob)
+            )
+            self._connection.execute(
+                "DELETE FROM info WHERE video_id IN (SELECT video_id FROM info "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.maxsize,)
+            )
+
+    def _delete(self, video_id: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM info WHERE video_id = ?", (video_id,)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM info")
+
+    def close(self) -> None:
+        """SQLiteのファイルを閉じます。"""
+        with self._lock:
+            self._connection.close()
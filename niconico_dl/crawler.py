@@ -0,0 +1,156 @@
+# niconico_dl - Crawler
+
+from typing import (
+    AsyncIterator, Iterable, Optional, Sequence, Tuple, Union
+)
+
+from aiohttp import ClientSession, ClientError, TCPConnector
+from json import loads
+import asyncio
+
+from .templates import (
+    _make_url, _parse_api_data, _video_id, HEADERS, HeaderSet,
+    NicoNicoAcquisitionFailed
+)
+from .limiter import RateLimiter, TokenBucket
+from .cache import InfoCache
+from .retry import RetryPolicy, TRANSIENT_STATUSES
+
+
+RETRY_STATUSES = TRANSIENT_STATUSES
+
+
+def project(data: dict, fields: Sequence[str]) -> dict:
+    """動画の情報から指定された項目だけを取り出します。
+
+    Parameters
+    ----------
+    data : dict
+        `get_info`で取得した動画の情報です。
+    fields : Sequence[str]
+        取り出す項目です。`video.title`や`video.count.view`のように`.`で区切って指定します。
+
+    Returns
+    -------
+    projection : dict
+        項目とその値の辞書です。項目がない場合の値はNoneになります。"""
+    projection = {}
+    for field in fields:
+        value = data
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        projection[field] = value
+    return projection
+
+
+async def fetch_infos(
+    ids: Iterable[str], concurrency: int = 8,
+    fields: Optional[Sequence[str]] = None, rate: Optional[float] = None,
+    retry: Union[int, RetryPolicy] = 3, session: Optional[ClientSession] = None,
+    headers: Optional[list] = None, cache: Optional[InfoCache] = None,
+    return_exceptions: bool = False
+) -> AsyncIterator[Tuple[str, Union[dict, BaseException]]]:
+    """たくさんの動画の情報を並列で取得して、取得できたものから順番に返す非同期ジェネレーターです。  
+    `NicoNicoVideoAsync`と違いHeartbeatなどは使わず、ウォッチページから情報を取得するだけです。  
+    動画IDは必要になった時に一つずつ取り出され、取得した情報も保持しないので、何百万件あってもメモリの使用量は増えません。
+
+    Parameters
+    ----------
+    ids : Iterable[str]
+        動画IDかニコニコ動画のURLです。
+    concurrency : int, default 8
+        同時に取得する数です。
+    fields : Sequence[str], optional
+        取り出す項目です。指定した場合は`project`で取り出した項目だけを返します。
+    rate : float, optional
+        一秒間にウォッチページを取得する最大の回数です。  
+        指定しない場合はプロセス全体で共有される`RateLimiter.get_default`の`watch_page`の制限に従います。
+    retry : int or RetryPolicy, default 3
+        通信に失敗した場合や`429`や`5xx`が返された場合にやり直す回数か`RetryPolicy`です。  
+        回数を指定した場合は`RETRY_STATUSES`のステータスコードだけをやり直します。
+    session : aiohttp.ClientSession, optional
+        通信に使用するセッションです。指定しない場合は作られ、終わった時に閉じられます。
+    headers : list, optional
+        通信時に使用するヘッダーです。`niconico_dl.HEADERS`と同じ形式です。
+    cache : InfoCache, optional
+        動画の情報を保存しておくキャッシュです。
+    return_exceptions : bool, default False
+        失敗した場合にエラーを発生させずに、エラーを情報の代わりに返すかどうかです。
+
+    Yields
+    ------
+    result : Tuple[str, Union[dict, BaseException]]
+        動画IDとその情報です。
+
+    Examples
+    --------
+    ```python
+    async for video_id, data in niconico_dl.fetch_infos(
+        ids, concurrency=16, fields=("video.title", "video.count.view")
+    ):
+        print(video_id, data["video.title"])
+    ```"""
+    headers = HeaderSet.make(headers or HEADERS)
+    limiter = TokenBucket(rate) if rate else RateLimiter.get_default().watch_page
+    policy = retry if isinstance(retry, RetryPolicy) \
+        else RetryPolicy(retry, statuses=RETRY_STATUSES)
+    own_session = session is None
+    if own_session:
+        session = ClientSession(connector=TCPConnector(
+            limit=concurrency, ttl_dns_cache=300
+        ))
+
+    async def fetch(url: str) -> Tuple[str, Union[dict, BaseException]]:
+        video_id = _video_id(url)
+        try:
+            data = cache.get(video_id) if cache is not None else None
+            for count in range(policy.attempts + 1):
+                if data is not None:
+                    break
+                if limiter is not None:
+                    await limiter.acquire_async()
+                try:
+                    async with session.get(url, headers=headers[2]) as r:
+                        r.raise_for_status()
+                        text = await r.text()
+                except (ClientError, asyncio.TimeoutError) as e:
+                    if not policy.should_retry(count, e):
+                        raise
+                    # 少しずつ待つ時間を伸ばしながらやり直す。
+                    await asyncio.sleep(policy.delay(count, e))
+                    continue
+                text = _parse_api_data(text)
+                if not text:
+                    raise NicoNicoAcquisitionFailed(
+                        "ニコニコ動画から情報を取得するのに失敗しました。"
+                    )
+                data = loads(text)
+                policy.succeeded()
+                if cache is not None:
+                    cache.set(video_id, data)
+        except Exception as e:
+            return video_id, e
+        return video_id, project(data, fields) if fields else data
+
+    urls, pending = map(_make_url, ids), set()
+    try:
+        while True:
+            for url in urls:
+                pending.add(asyncio.ensure_future(fetch(url)))
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                video_id, data = task.result()
+                if isinstance(data, BaseException) and not return_exceptions:
+                    raise data
+                yield video_id, data
+    finally:
+        for task in pending:
+            task.cancel()
+        if own_session:
+            await session.close()
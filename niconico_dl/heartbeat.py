@@ -0,0 +1,420 @@
+# niconico_dl - Heartbeat Manager
+
+from typing import Any, Callable, Dict, List, Optional
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Thread, Condition, Lock
+from weakref import WeakKeyDictionary
+from itertools import count
+from heapq import heappush, heappop
+from json import loads, dumps
+from time import time
+import asyncio
+
+from .templates import URLS
+from .retry import RetryPolicy, TRANSIENT_STATUSES
+
+
+class HeartbeatSession:
+    """`HeartbeatManager`によって生かされているDMCのセッション一つ分です。
+    セッションの状態は`health`で取得できます。
+
+    Parameters
+    ----------
+    data : dict
+        セッションを作った際に返された`session`のデータです。
+    http : requests.Session or aiohttp.ClientSession
+        Heartbeatの通信に使うセッションです。
+    headers : list
+        通信時に使用するヘッダーです。`niconico_dl.HEADERS`と同じ形式です。
+    on_update : Callable[[dict], Any], optional
+        Heartbeatが成功してセッションのデータが更新された際に呼ばれる関数です。
+
+    Attributes
+    ----------
+    id : str
+        セッションのIDです。
+    data : dict
+        最新のセッションのデータです。
+    alive : bool
+        セッションが生きているかどうかです。
+        Heartbeatの失敗が続いてセッションの寿命が切れた場合や、  
+        `404`などが返されてセッションが既に切れていることがわかった場合に`False`になります。
+    sent : int
+        成功したHeartbeatの回数です。
+    failures : int
+        連続で失敗したHeartbeatの回数です。
+    latency : float, optional
+        最後に成功したHeartbeatにかかった秒数です。
+    last_error : BaseException, optional
+        最後に失敗したHeartbeatのエラーです。"""
+
+    MARGIN = 3
+
+    def __init__(
+        self, data: dict, http: Any, headers: list,
+        on_update: Optional[Callable[[dict], Any]] = None
+    ):
+        self.id, self.data = data["id"], data
+        self.http, self.headers, self.on_update = http, headers, on_update
+        self.alive, self.first = True, True
+        self.sent, self.failures = 0, 0
+        self.latency: Optional[float] = None
+        self.last_error: Optional[BaseException] = None
+        self.last_success = time()
+        self.deadline = self.last_success + self.lifetime - self.MARGIN
+
+    @property
+    def lifetime(self) -> float:
+        """セッションの寿命(秒)です。"""
+        return self.data["keep_method"]["heartbeat"]["lifetime"] / 1000
+
+    @property
+    def url(self) -> str:
+        """Heartbeatを送るURLです。"""
+        return f"{URLS['base_heartbeat']}/{self.id}?_format=json&_method=PUT"
+
+    @property
+    def healthy(self) -> bool:
+        """セッションが生きていて、最後のHeartbeatが成功しているかどうかです。"""
+        return self.alive and not self.failures
+
+    def health(self) -> dict:
+        """セッションの状態を辞書で返します。
+
+        Returns
+        -------
+        health : dict
+            `alive`、`healthy`、`sent`、`failures`、`latency`、`last_error`、
+            `last_success`(最後に成功した時刻)、`next`(次のHeartbeatの時刻)が入ります。"""
+        return {
+            "alive": self.alive, "healthy": self.healthy, "sent": self.sent,
+            "failures": self.failures, "latency": self.latency,
+            "last_error": self.last_error, "last_success": self.last_success,
+            "next": self.deadline
+        }
+
+    def _succeeded(self, data: dict, latency: float) -> None:
+        # Heartbeatが成功した際に呼ばれます。
+        now = time()
+        self.data, self.sent, self.failures = data, self.sent + 1, 0
+        self.latency, self.last_success = latency, now
+        self.deadline = now + self.lifetime - self.MARGIN
+        if self.on_update is not None:
+            self.on_update(data)
+
+    def _failed(
+        self, error: BaseException, retry_interval: Optional[float]
+    ) -> None:
+        # Heartbeatが失敗した際に呼ばれます。
+        # セッションの寿命が残っている間は少し後にやり直します。
+        # `retry_interval`がNoneの場合はやり直しても無駄なのでセッションを終わらせます。
+        now = time()
+        self.failures, self.last_error = self.failures + 1, error
+        if retry_interval is None \
+                or now + retry_interval >= self.last_success + self.lifetime:
+            self.alive = False
+        else:
+            self.deadline = now + retry_interval
+
+
+class _BaseHeartbeatManager:
+    # 同期版と非同期版の`HeartbeatManager`で共通の部分です。
+
+    BATCH_WINDOW = 1.0
+    # セッションが切れたことを示す`403`や`404`などはやり直さない。
+    RETRY_POLICY = RetryPolicy(
+        backoff=0.5, max_backoff=5.0, statuses=TRANSIENT_STATUSES
+    )
+
+    def __init__(self):
+        self._sessions: Dict[str, HeartbeatSession] = {}
+        self._heap, self._counter = [], count()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def health(self) -> Dict[str, dict]:
+        """登録されている全てのセッションの状態を返します。
+
+        Returns
+        -------
+        health : Dict[str, dict]
+            セッションIDと`HeartbeatSession.health`の辞書です。"""
+        return {
+            session_id: session.health()
+            for session_id, session in list(self._sessions.items())
+        }
+
+    def _push(self, session: HeartbeatSession) -> None:
+        heappush(self._heap, (session.deadline, next(self._counter), session))
+
+    def _registered(self, session: HeartbeatSession) -> bool:
+        return self._sessions.get(session.id) is session
+
+    def _next_deadline(self) -> Optional[float]:
+        # 登録が解除されたセッションや古い予定を捨てて、一番近い予定の時刻を返します。
+        while self._heap:
+            deadline, _, session = self._heap[0]
+            if self._registered(session) and session.deadline == deadline:
+                return deadline
+            heappop(self._heap)
+        return None
+
+    def _pop_due(self) -> List[HeartbeatSession]:
+        # `BATCH_WINDOW`秒以内に予定があるセッションをまとめて取り出します。
+        due, limit = [], time() + self.BATCH_WINDOW
+        while self._next_deadline() is not None and self._heap[0][0] <= limit:
+            due.append(heappop(self._heap)[2])
+        return due
+
+    def _retry_interval(
+        self, session: HeartbeatSession, error: BaseException
+    ) -> Optional[float]:
+        # 失敗したHeartbeatをやり直すまでの秒数を返します。やり直せない場合はNoneです。
+        if not self.RETRY_POLICY.is_retryable(error):
+            return None
+        return self.RETRY_POLICY.delay(session.failures)
+
+    def _reschedule(self, sessions: List[HeartbeatSession]) -> None:
+        for session in sessions:
+            if self._registered(session):
+                if session.alive:
+                    self._push(session)
+                else:
+                    del self._sessions[session.id]
+
+
+class HeartbeatManager(_BaseHeartbeatManager):
+    """プロセス内の全ての`NicoNicoVideo`のDMCセッションを一つのスレッドで生かし続けるためのクラスです。
+    一番近いHeartbeatの時刻まで眠り、同じ頃に時刻が来たHeartbeatはまとめて並列に送ります。
+    通常は`get_default`で取得できるプロセス全体で共有されるものが使われます。
+
+    Parameters
+    ----------
+    max_workers : int, default 16
+        同時に送るHeartbeatの最大数です。"""
+
+    _default: Optional["HeartbeatManager"] = None
+    _default_lock = Lock()
+
+    def __init__(self, max_workers: int = 16):
+        super().__init__()
+        self.max_workers = max_workers
+        self._condition = Condition()
+        self._thread: Optional[Thread] = None
+
+    @classmethod
+    def get_default(cls) -> "HeartbeatManager":
+        """プロセス全体で共有される`HeartbeatManager`を取得します。
+
+        Returns
+        -------
+        manager : HeartbeatManager
+            共有されている`HeartbeatManager`です。"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @property
+    def thread(self) -> Optional[Thread]:
+        """Heartbeatを送っているスレッドです。セッションが一つもない間はNoneです。"""
+        return self._thread
+
+    def register(self, session: HeartbeatSession) -> HeartbeatSession:
+        """セッションを登録してHeartbeatを送り始めます。
+
+        Parameters
+        ----------
+        session : HeartbeatSession
+            登録するセッションです。
+
+        Returns
+        -------
+        session : HeartbeatSession
+            登録したセッションです。"""
+        with self._condition:
+            self._sessions[session.id] = session
+            self._push(session)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="niconico_dl.heartbeat", daemon=True
+                )
+                self._thread.start()
+            else:
+                self._condition.notify()
+        return session
+
+    def unregister(self, session: HeartbeatSession) -> None:
+        """セッションの登録を解除してHeartbeatを送るのをやめます。
+
+        Parameters
+        ----------
+        session : HeartbeatSession
+            登録を解除するセッションです。"""
+        with self._condition:
+            if self._registered(session):
+                del self._sessions[session.id]
+                self._condition.notify()
+
+    def _beat(self, session: HeartbeatSession) -> None:
+        # Heartbeatを一回送ります。
+        start = time()
+        try:
+            if session.first:
+                # 最初は普通とは違うものを先にリクエストする必要があるのでそれをリクエストする。
+                session.http.options(
+                    session.url, headers=session.headers[0]
+                ).raise_for_status()
+                session.first = False
+            r = session.http.post(
+                session.url, headers=session.headers[1],
+                data=dumps({"session": session.data})
+            )
+            r.raise_for_status()
+            session._succeeded(r.json()["data"]["session"], time() - start)
+        except Exception as e:
+            session._failed(e, self._retry_interval(session, e))
+
+    def _run(self) -> None:
+        # 一番近いHeartbeatの時刻か登録か登録の解除があるまで眠り、時刻が来たHeartbeatを送ります。
+        with ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="niconico_dl.heartbeat"
+        ) as executor:
+            while True:
+                with self._condition:
+                    while True:
+                        deadline = self._next_deadline()
+                        if deadline is None:
+                            self._thread = None
+                            return
+                        if deadline <= time():
+                            break
+                        self._condition.wait(deadline - time())
+                    due = self._pop_due()
+                wait([executor.submit(self._beat, session) for session in due])
+                with self._condition:
+                    self._reschedule(due)
+
+
+class AsyncHeartbeatManager(_BaseHeartbeatManager):
+    """`HeartbeatManager`の非同期版です。
+    イベントループ内の全ての`NicoNicoVideoAsync`のDMCセッションを一つのTaskで生かし続けます。
+    通常は`get_default`で取得できるイベントループごとに共有されるものが使われます。
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop, optional
+        使用するイベントループです。"""
+
+    _defaults = WeakKeyDictionary()
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        super().__init__()
+        self.loop = loop or asyncio.get_event_loop()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def get_default(
+        cls, loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> "AsyncHeartbeatManager":
+        """イベントループごとに共有される`AsyncHeartbeatManager`を取得します。
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop, optional
+            使用するイベントループです。
+
+        Returns
+        -------
+        manager : AsyncHeartbeatManager
+            共有されている`AsyncHeartbeatManager`です。"""
+        loop = loop or asyncio.get_event_loop()
+        if loop not in cls._defaults:
+            cls._defaults[loop] = cls(loop)
+        return cls._defaults[loop]
+
+    @property
+    def task(self) -> Optional[asyncio.Task]:
+        """Heartbeatを送っているTaskです。セッションが一つもない間はNoneです。"""
+        return self._task
+
+    def register(self, session: HeartbeatSession) -> HeartbeatSession:
+        """セッションを登録してHeartbeatを送り始めます。
+
+        Parameters
+        ----------
+        session : HeartbeatSession
+            登録するセッションです。
+
+        Returns
+        -------
+        session : HeartbeatSession
+            登録したセッションです。"""
+        self._sessions[session.id] = session
+        self._push(session)
+        if self._task is None:
+            self._task = self.loop.create_task(
+                self._run(), name="niconico_dl.heartbeat"
+            )
+        elif self._wake is not None:
+            self._wake.set()
+        return session
+
+    def unregister(self, session: HeartbeatSession) -> None:
+        """セッションの登録を解除してHeartbeatを送るのをやめます。
+
+        Parameters
+        ----------
+        session : HeartbeatSession
+            登録を解除するセッションです。"""
+        if self._registered(session):
+            del self._sessions[session.id]
+            if self._wake is not None:
+                self._wake.set()
+
+    async def _beat(self, session: HeartbeatSession) -> None:
+        # Heartbeatを一回送ります。
+        start = time()
+        try:
+            if session.first:
+                # 最初は普通とは違うやつもリクエストしないといけないのでする。
+                async with session.http.options(
+                    session.url, headers=session.headers[0]
+                ) as r:
+                    r.raise_for_status()
+                session.first = False
+            async with session.http.post(
+                session.url, headers=session.headers[1],
+                json={"session": session.data}
+            ) as r:
+                r.raise_for_status()
+                data = (await r.json(loads=loads))["data"]["session"]
+            session._succeeded(data, time() - start)
+        except Exception as e:
+            session._failed(e, self._retry_interval(session, e))
+
+    async def _run(self) -> None:
+        # 一番近いHeartbeatの時刻か登録か登録の解除があるまで眠り、時刻が来たHeartbeatを送ります。
+        self._wake = asyncio.Event()
+        try:
+            while True:
+                deadline = self._next_deadline()
+                if deadline is None:
+                    break
+                if deadline > time():
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self._wake.wait(), deadline - time()
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                due = self._pop_due()
+                await asyncio.gather(*(self._beat(session) for session in due))
+                self._reschedule(due)
+        finally:
+            self._task = self._wake = None
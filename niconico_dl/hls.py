@@ -0,0 +1,174 @@
+# niconico_dl - HLS
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from urllib.parse import urljoin
+import re
+
+
+_ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class Key(NamedTuple):
+    """HLSのセグメントの暗号化の情報です。
+
+    Attributes
+    ----------
+    method : str
+        暗号化の方式です。`AES-128`のみに対応しています。
+    uri : str
+        鍵のURLです。
+    iv : bytes, optional
+        初期化ベクトルです。ない場合はセグメントのシーケンス番号が使われます。"""
+    method: str
+    uri: str
+    iv: Optional[bytes]
+
+
+class Segment(NamedTuple):
+    """HLSのセグメント一つ分です。
+
+    Attributes
+    ----------
+    url : str
+        セグメントのURLです。
+    sequence : int
+        セグメントのシーケンス番号です。
+    key : Key, optional
+        セグメントの暗号化の情報です。暗号化されていない場合はNoneです。"""
+    url: str
+    sequence: int
+    key: Optional[Key]
+
+    @property
+    def iv(self) -> bytes:
+        """復号に使う初期化ベクトルです。"""
+        if self.key.iv is not None:
+            return self.key.iv
+        return self.sequence.to_bytes(16, "big")
+
+
+def _parse_attributes(text: str) -> dict:
+    return {
+        key: value.strip('"')
+        for key, value in _ATTRIBUTE.findall(text)
+    }
+
+
+def is_master(text: str) -> bool:
+    """プレイリストがマスタープレイリストかどうかを返します。"""
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master(text: str, base_url: str) -> List[Tuple[int, str]]:
+    """マスタープレイリストから画質ごとのプレイリストを取り出します。
+
+    Parameters
+    ----------
+    text : str
+        マスタープレイリストです。
+    base_url : str
+        マスタープレイリストのURLです。相対URLを解決するのに使われます。
+
+    Returns
+    -------
+    variants : List[Tuple[int, str]]
+        `BANDWIDTH`とプレイリストのURLのリストです。`BANDWIDTH`の低い順に並んでいます。"""
+    variants, bandwidth = [], None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            bandwidth = int(_parse_attributes(line[18:]).get("BANDWIDTH", 0))
+        elif line and not line.startswith("#") and bandwidth is not None:
+            variants.append((bandwidth, urljoin(base_url, line)))
+            bandwidth = None
+    return sorted(variants, key=lambda variant: variant[0])
+
+
+def parse_media(text: str, base_url: str) -> List[Segment]:
+    """メディアプレイリストからセグメントを取り出します。
+
+    Parameters
+    ----------
+    text : str
+        メディアプレイリストです。
+    base_url : str
+        メディアプレイリストのURLです。相対URLを解決するのに使われます。
+
+    Returns
+    -------
+    segments : List[Segment]
+        セグメントのリストです。再生する順番に並んでいます。
+
+    Raises
+    ------
+    ValueError
+        `AES-128`以外の方式(`SAMPLE-AES`など)で暗号化されている場合に発生します。"""
+    segments, sequence, key = [], 0, None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line[22:])
+        elif line.startswith("#EXT-X-KEY:"):
+            attributes = _parse_attributes(line[11:])
+            method = attributes.get("METHOD", "NONE")
+            if method == "NONE":
+                key = None
+            elif method != "AES-128":
+                raise ValueError(f"`{method}`で暗号化されたHLSには対応していません。")
+            else:
+                iv = attributes.get("IV")
+                key = Key(
+                    attributes["METHOD"], urljoin(base_url, attributes["URI"]),
+                    bytes.fromhex(iv[2:]) if iv else None
+                )
+        elif line and not line.startswith("#"):
+            segments.append(Segment(urljoin(base_url, line), sequence, key))
+            sequence += 1
+    return segments
+
+
+def decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """AES-128で暗号化されたセグメントを復号します。
+    `cryptography`か`pycryptodome`がインストールされている必要があります。
+
+    Parameters
+    ----------
+    data : bytes
+        暗号化されたセグメントです。
+    key : bytes
+        鍵です。
+    iv : bytes
+        初期化ベクトルです。
+
+    Returns
+    -------
+    data : bytes
+        復号したセグメントです。
+
+    Raises
+    ------
+    ValueError
+        復号した結果のPKCS7のパディングが正しくない場合に発生します。鍵か初期化ベクトルが間違っている可能性があります。"""
+    try:
+        from cryptography.hazmat.primitives.ciphers import (
+            Cipher, algorithms, modes
+        )
+    except ImportError:
+        try:
+            from Crypto.Cipher import AES
+        except ImportError:
+            raise ImportError(
+                "暗号化されたHLSを復号するには`cryptography`か`pycryptodome`をインストールしてください。"
+            )
+        data = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    else:
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        data = decryptor.update(data) + decryptor.finalize()
+    # PKCS7のパディングを確かめてから取り除く。
+    if not data:
+        return data
+    pad = data[-1]
+    if not 1 <= pad <= 16 or data[-pad:] != bytes((pad,)) * pad:
+        raise ValueError("復号したセグメントのパディングが正しくありません。鍵が間違っている可能性があります。")
+    return data[:-pad]
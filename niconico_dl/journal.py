@@ -0,0 +1,151 @@
+# niconico_dl - Journal
+
+from typing import List, Optional, Tuple
+
+from json import loads, dumps
+from threading import Lock
+from time import time
+import os
+
+
+class DownloadJournal:
+    """ダウンロードの進捗をファイルに記録するためのクラスです。  
+    ダウンロードが途中で止まった際に、ダウンロードが終わっていない部分だけをダウンロードし直すのに使われます。  
+    記録は`<保存先>.niconico_dl`というファイルにJSON形式で保存されます。
+
+    Parameters
+    ----------
+    path : str
+        ダウンロードする動画の保存先です。
+    url : str
+        ダウンロードするニコニコ動画のURLです。  
+        記録が別の動画のものだった場合にそれを使わないようにするためのものです。
+    interval : float, default 1.0
+        記録をファイルに保存する最短の間隔(秒)です。
+    persist : bool, default True
+        記録をファイルに保存するかどうかです。  
+        `False`の場合は記録はメモリ上だけで、ダウンロードし直す際に同じ処理の中で続きから始めるためだけに使われます。
+
+    Attributes
+    ----------
+    path : str
+        記録を保存するファイルのパスです。
+    size : int
+        動画のサイズです。
+    done : List[Tuple[int, int]]
+        ダウンロードが終わったバイト範囲のリストです。  
+        範囲は`Range`ヘッダーと同じく終わりの位置も含みます。"""
+
+    EXTENSION = ".niconico_dl"
+
+    def __init__(
+        self, path: str, url: str, interval: float = 1.0, persist: bool = True
+    ):
+        self.path, self.url, self.interval = path + self.EXTENSION, url, interval
+        self.persist = persist
+        self.size: Optional[int] = None
+        self.done: List[Tuple[int, int]] = []
+        self._lock, self._last_save = Lock(), 0.0
+
+    @property
+    def done_size(self) -> int:
+        """ダウンロードが終わったバイト数です。"""
+        return sum(end - start + 1 for start, end in self.done)
+
+    def load(self, size: int) -> bool:
+        """ファイルから記録を読み込みます。
+
+        Parameters
+        ----------
+        size : int
+            ダウンロードする動画のサイズです。
+
+        Returns
+        -------
+        loaded : bool
+            続きからダウンロードできる記録を読み込めたかどうかです。  
+            記録がない場合や別の動画の記録の場合は`False`になります。  
+            既にメモリ上に同じサイズの動画の記録がある場合はそれを使います。"""
+        if self.size == size and self.done:
+            return True
+        if not self.persist:
+            return False
+        try:
+            with open(self.path, "r") as f:
+                data = loads(f.read())
+        except (OSError, ValueError):
+            return False
+        if data.get("url") != self.url or data.get("size") != size:
+            return False
+        self.size, self.done = size, [tuple(range_) for range_ in data["done"]]
+        return bool(self.done)
+
+    def reset(self, size: int) -> None:
+        """記録を空にします。
+
+        Parameters
+        ----------
+        size : int
+            ダウンロードする動画のサイズです。"""
+        with self._lock:
+            self.size, self.done = size, []
+        self.save()
+
+    def add(self, start: int, end: int) -> None:
+        """ダウンロードが終わったバイト範囲を記録します。  
+        前回の保存から`interval`秒以上経っている場合はファイルにも保存します。
+
+        Parameters
+        ----------
+        start : int
+            範囲の始まりの位置です。
+        end : int
+            範囲の終わりの位置です。"""
+        with self._lock:
+            done, merged = sorted(self.done + [(start, end)]), []
+            for range_ in done:
+                if merged and range_[0] <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], range_[1]))
+                else:
+                    merged.append(range_)
+            self.done = merged
+        if time() - self._last_save >= self.interval:
+            self.save()
+
+    def missing(self) -> List[Tuple[int, int]]:
+        """まだダウンロードが終わっていないバイト範囲のリストを返します。
+
+        Returns
+        -------
+        missing : List[Tuple[int, int]]
+            ダウンロードが終わっていないバイト範囲のリストです。"""
+        with self._lock:
+            missing, position = [], 0
+            for start, end in self.done:
+                if start > position:
+                    missing.append((position, start - 1))
+                position = end + 1
+            if position < self.size:
+                missing.append((position, self.size - 1))
+        return missing
+
+    def save(self) -> None:
+        """記録をファイルに保存します。"""
+        if not self.persist:
+            return
+        with self._lock:
+            data = dumps({"url": self.url, "size": self.size, "done": self.done})
+            self._last_save = time()
+            # 書き込み途中で止まっても記録が壊れないように別のファイルに書いてから置き換える。
+            with open(self.path + ".tmp", "w") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+
+    def remove(self) -> None:
+        """記録のファイルを削除します。"""
+        if not self.persist:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,261 @@
+# niconico_dl - Limiter
+
+from typing import Dict, Optional, Union
+
+from threading import Lock
+from time import monotonic, sleep, time
+import asyncio
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class TokenBucket:
+    """トークンバケット方式で通信量や通信の回数を制限するためのクラスです。  
+    スレッドセーフで、同期と非同期のどちらからでも使うことができます。
+
+    Parameters
+    ----------
+    rate : float
+        一秒ごとに補充するトークンの量です。  
+        帯域を制限する場合はバイト毎秒になります。
+    capacity : float, optional
+        貯めておけるトークンの最大の量です。  
+        指定しない場合は`rate`と同じになります。
+
+    Raises
+    ------
+    ValueError
+        `rate`が0以下の場合に発生します。制限しない場合は`TokenBucket`を使わないでください。
+
+    Examples
+    --------
+    ```python
+    # 全体で10MB/sまでに制限する。
+    bucket = niconico_dl.TokenBucket(10 * 1024 * 1024)
+    with niconico_dl.NicoNicoVideo(url) as nico:
+        nico.download("video.mp4", limiter=bucket)
+    ```"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"rateは0より大きくしてください：{rate}")
+        self.rate, self.capacity = rate, capacity or rate
+        self._tokens, self._last = self.capacity, monotonic()
+        self._lock = Lock()
+
+    def _reserve(self, amount: float) -> float:
+        # トークンを先に使って、足りなかった分が補充されるまでの秒数を返す。
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, amount: float = 1) -> None:
+        """トークンを使います。足りない場合は補充されるまで待機します。
+
+        Parameters
+        ----------
+        amount : float, default 1
+            使うトークンの量です。"""
+        wait = self._reserve(amount)
+        if wait:
+            sleep(wait)
+
+    async def acquire_async(self, amount: float = 1) -> None:
+        """`acquire`の非同期版です。
+
+        Parameters
+        ----------
+        amount : float, default 1
+            使うトークンの量です。"""
+        wait = self._reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def _lock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileTokenBucket(TokenBucket):
+    """複数のプロセスで共有できる`TokenBucket`です。  
+    トークンの量をファイルに保存して、ファイルロックをしてから読み書きします。  
+    同じファイルを指定した`FileTokenBucket`同士で制限が共有されます。
+
+    Parameters
+    ----------
+    path : str
+        トークンの量を保存するファイルのパスです。ない場合は作られます。
+    rate : float
+        一秒ごとに補充するトークンの量です。
+    capacity : float, optional
+        貯めておけるトークンの最大の量です。  
+        指定しない場合は`rate`と同じになります。"""
+
+    def __init__(self, path: str, rate: float, capacity: Optional[float] = None):
+        super().__init__(rate, capacity)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _reserve(self, amount: float) -> float:
+        # 他のプロセスと共有するので時刻はUNIX時間を使う。
+        with self._lock:
+            _lock_file(self._fd)
+            try:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                now = time()
+                try:
+                    tokens, last = map(float, os.read(self._fd, 64).split())
+                except ValueError:
+                    tokens, last = self.capacity, now
+                tokens = min(
+                    self.capacity, tokens + max(0.0, now - last) * self.rate
+                ) - amount
+                data = f"{tokens!r} {now!r}".encode().ljust(64)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, data)
+            finally:
+                _unlock_file(self._fd)
+        return -tokens / self.rate if tokens < 0 else 0.0
+
+    def close(self) -> None:
+        """ファイルを閉じます。"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class RateLimiter:
+    """ニコニコ動画への通信の回数と量をプロセス全体で制限するためのクラスです。  
+    ウォッチページの取得、DMCのセッションの作成、動画のダウンロードのそれぞれで別の`TokenBucket`を使います。  
+    `NicoNicoVideo`や`NicoNicoVideoAsync`で`limits`を指定しない場合は、`get_default`で取得できるプロセス全体で共有されるものが使われます。  
+    共有されているものは最初は何も制限しないので、制限する場合は`configure`で設定してください。  
+    Heartbeatは遅れるとセッションが切れてしまうので制限しません。
+
+    Parameters
+    ----------
+    watch_page : float or TokenBucket, optional
+        一秒間にウォッチページを取得する最大の回数か、それに使う`TokenBucket`です。
+    session : float or TokenBucket, optional
+        一秒間にDMCのセッションを作る最大の回数か、それに使う`TokenBucket`です。
+    media : float or TokenBucket, optional
+        動画のダウンロードの合計の最大の速度(バイト毎秒)か、それに使う`TokenBucket`です。
+
+    Examples
+    --------
+    ```python
+    # プロセス全体でウォッチページは一秒に2回、ダウンロードは合計50MB/sまでにする。
+    niconico_dl.RateLimiter.get_default().configure(watch_page=2, media=50 * 1024 * 1024)
+    # 複数のプロセスで制限を共有する場合
+    niconico_dl.RateLimiter.get_default().configure(
+        **niconico_dl.RateLimiter.shared("/tmp/niconico_dl", watch_page=2, session=2)
+    )
+    ```"""
+
+    KINDS = ("watch_page", "session", "media")
+
+    _default: Optional["RateLimiter"] = None
+    _default_lock = Lock()
+
+    def __init__(
+        self, watch_page: Union[float, TokenBucket, None] = None,
+        session: Union[float, TokenBucket, None] = None,
+        media: Union[float, TokenBucket, None] = None
+    ):
+        self.watch_page: Optional[TokenBucket] = None
+        self.session: Optional[TokenBucket] = None
+        self.media: Optional[TokenBucket] = None
+        self.configure(watch_page=watch_page, session=session, media=media)
+
+    @classmethod
+    def get_default(cls) -> "RateLimiter":
+        """プロセス全体で共有される`RateLimiter`を取得します。
+
+        Returns
+        -------
+        limiter : RateLimiter
+            共有されている`RateLimiter`です。"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @staticmethod
+    def shared(directory: str, **rates: float) -> Dict[str, FileTokenBucket]:
+        """複数のプロセスで共有する`FileTokenBucket`を作ります。
+
+        Parameters
+        ----------
+        directory : str
+            トークンの量を保存するファイルを置くフォルダです。ない場合は作られます。
+        **rates : float
+            `watch_page`、`session`、`media`の制限です。
+
+        Returns
+        -------
+        buckets : Dict[str, FileTokenBucket]
+            `configure`にそのまま渡せる辞書です。"""
+        os.makedirs(directory, exist_ok=True)
+        return {
+            kind: FileTokenBucket(
+                os.path.join(directory, f"{kind}.bucket"), rate
+            ) for kind, rate in rates.items()
+        }
+
+    def configure(self, **limits: Union[float, TokenBucket, None]) -> None:
+        """制限を変えます。指定しなかったものはそのままです。
+
+        Parameters
+        ----------
+        **limits : float or TokenBucket, optional
+            `watch_page`、`session`、`media`の制限です。Noneを指定すると制限しなくなります。"""
+        for kind, limit in limits.items():
+            if kind not in self.KINDS:
+                raise ValueError(f"不明な制限の種類です：{kind}")
+            setattr(
+                self, kind, limit if limit is None
+                or isinstance(limit, TokenBucket) else TokenBucket(limit)
+            )
+
+    def acquire(self, kind: str, amount: float = 1) -> None:
+        """`kind`の制限のトークンを使います。制限がない場合は何もしません。
+
+        Parameters
+        ----------
+        kind : str
+            `watch_page`、`session`、`media`のどれかです。
+        amount : float, default 1
+            使うトークンの量です。"""
+        bucket = getattr(self, kind)
+        if bucket is not None:
+            bucket.acquire(amount)
+
+    async def acquire_async(self, kind: str, amount: float = 1) -> None:
+        """`acquire`の非同期版です。"""
+        bucket = getattr(self, kind)
+        if bucket is not None:
+            await bucket.acquire_async(amount)
@@ -0,0 +1,214 @@
+# niconico_dl - Session Pool
+
+from typing import Dict, Iterable, List, Optional
+
+from collections import deque
+import asyncio
+
+from .async_video_manager import NicoNicoVideoAsync
+from .templates import _make_url, _video_id
+
+
+def percentile(values: List[float], rate: float) -> Optional[float]:
+    """値のリストのパーセンタイルを返します。
+
+    Parameters
+    ----------
+    values : List[float]
+        値のリストです。
+    rate : float
+        0から100までのパーセンタイルです。
+
+    Returns
+    -------
+    value : float, optional
+        パーセンタイルの値です。`values`が空の場合はNoneです。"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rate / 100))]
+
+
+class SessionPool:
+    """次に再生されそうな動画のセッションを前もって作っておくためのクラスです。  
+    `prefetch`で渡した動画のセッションを順番に作り、`claim`で取り出されるか`ttl`秒経つまでHeartbeatで生かしておきます。  
+    `claim`ではダウンロードリンクを取得済みの`NicoNicoVideoAsync`が返されるので、ウォッチページの取得やセッションの作成を待たずにすぐ動画を読み込み始められます。
+
+    Parameters
+    ----------
+    max_size : int, default 4
+        前もって作っておくセッションの最大数です。  
+        これを超えて`prefetch`された動画は、`claim`でセッションが取り出されて空きができた時に順番に作られます。
+    ttl : float, default 300
+        作ったセッションを`claim`されないまま生かしておく最長の秒数です。
+    **kwargs
+        `NicoNicoVideoAsync`に渡す引数です。
+
+    Attributes
+    ----------
+    hits : int
+        前もって作っておいたセッションが`claim`で使われた回数です。
+    misses : int
+        `claim`でセッションを新しく作った回数です。
+    latencies : List[float]
+        `claim`を実行してから、取り出した動画の本体の最初のレスポンスが返ってくるまでの秒数(TTFB)の記録です。  
+        `download`や`stream`などで動画を読み込み始めた時に記録されます。読み込まずに閉じた場合は記録されません。
+
+    Examples
+    --------
+    ```python
+    pool = niconico_dl.SessionPool()
+    pool.prefetch(queue)
+    ...
+    nico = await pool.claim(queue.pop(0))
+    async with await nico.stream() as stream:
+        ...
+    await nico.aclose()
+    await pool.close()
+    ```"""
+
+    def __init__(self, max_size: int = 4, ttl: float = 300, **kwargs):
+        self.max_size, self.ttl, self._kwargs = max_size, ttl, kwargs
+        self.hits, self.misses = 0, 0
+        self.latencies: List[float] = []
+        self._queue: deque = deque()
+        self._warming: Dict[str, asyncio.Task] = {}
+        self._ready: Dict[str, NicoNicoVideoAsync] = {}
+        self._expires: Dict[str, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return len(self._warming) + len(self._ready)
+
+    async def __aenter__(self) -> "SessionPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    def prefetch(self, urls: Iterable[str]) -> None:
+        """セッションを前もって作っておく動画を追加します。  
+        渡した順番にセッションが作られます。
+
+        Parameters
+        ----------
+        urls : Iterable[str]
+            ニコニコ動画のURLか動画IDです。"""
+        for url in urls:
+            video_id = _video_id(_make_url(url))
+            if (
+                video_id not in self._warming and video_id not in self._ready
+                and video_id not in self._queue
+            ):
+                self._queue.append(video_id)
+        self._fill()
+
+    def _fill(self) -> None:
+        # 空きがある分だけ順番にセッションを作り始めます。
+        loop = asyncio.get_event_loop()
+        while self._queue and len(self) < self.max_size:
+            video_id = self._queue.popleft()
+            self._warming[video_id] = loop.create_task(
+                self._warm(video_id), name="niconico_dl.pool"
+            )
+
+    async def _open(self, video_id: str) -> NicoNicoVideoAsync:
+        video = NicoNicoVideoAsync(_make_url(video_id), **self._kwargs)
+        try:
+            await video.get_download_link()
+        except BaseException:
+            await video.aclose()
+            raise
+        return video
+
+    async def _warm(self, video_id: str) -> Optional[NicoNicoVideoAsync]:
+        try:
+            video = await self._open(video_id)
+        except Exception:
+            # 失敗した場合は`claim`の時に作り直す。
+            video = None
+        finally:
+            self._warming.pop(video_id, None)
+        if video is not None:
+            self._ready[video_id] = video
+            self._expires[video_id] = video.loop.call_later(
+                self.ttl, self._expire, video_id
+            )
+        self._fill()
+        return video
+
+    def _take(self, video_id: str) -> Optional[NicoNicoVideoAsync]:
+        # 作っておいたセッションを取り出します。
+        video = self._ready.pop(video_id, None)
+        handle = self._expires.pop(video_id, None)
+        if handle is not None:
+            handle.cancel()
+        return video
+
+    def _expire(self, video_id: str) -> None:
+        video = self._take(video_id)
+        if video is not None:
+            video.close()
+        self._fill()
+
+    async def claim(self, url: str) -> NicoNicoVideoAsync:
+        """動画の`NicoNicoVideoAsync`を取り出します。  
+        前もって作ったセッションがあればそれを、作っている途中ならそれが終わるのを待って、なければ新しく作って返します。  
+        返された`NicoNicoVideoAsync`はプールからは消えるので、使い終わったら`aclose`してください。
+
+        Parameters
+        ----------
+        url : str
+            ニコニコ動画のURLか動画IDです。
+
+        Returns
+        -------
+        video : NicoNicoVideoAsync
+            ダウンロードリンクを取得済みでHeartbeatが動いている`NicoNicoVideoAsync`です。"""
+        video_id = _video_id(_make_url(url))
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        try:
+            task = self._warming.get(video_id)
+            if task is not None:
+                await asyncio.shield(task)
+            video = self._take(video_id)
+            if video is not None and not video.is_working_heartbeat():
+                await video.aclose()
+                video = None
+            if video is None:
+                if video_id in self._queue:
+                    self._queue.remove(video_id)
+                self.misses += 1
+                video = await self._open(video_id)
+            else:
+                self.hits += 1
+        finally:
+            self._fill()
+        video._on_first_byte = lambda: self.latencies.append(loop.time() - started)
+        return video
+
+    def stats(self) -> dict:
+        """プールの統計を返します。
+
+        Returns
+        -------
+        stats : dict
+            `hits`、`misses`、`ready`(作り終わったセッションの数)、`warming`(作っている途中のセッションの数)、
+            `queued`(まだ作り始めていない動画の数)と、`claim`から最初のレスポンスまでの秒数(TTFB)の`p50`と`p99`が入ります。"""
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "ready": len(self._ready), "warming": len(self._warming),
+            "queued": len(self._queue),
+            "p50": percentile(self.latencies, 50),
+            "p99": percentile(self.latencies, 99)
+        }
+
+    async def close(self) -> None:
+        """作り始めていない動画を消して、作っておいた全てのセッションを閉じます。"""
+        self._queue.clear()
+        tasks = list(self._warming.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        videos = [self._take(video_id) for video_id in list(self._ready)]
+        await asyncio.gather(*(video.aclose() for video in videos))
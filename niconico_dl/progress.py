@@ -0,0 +1,276 @@
+# niconico_dl - Progress
+
+from typing import Callable, Dict, NamedTuple, Optional, TextIO
+
+from threading import Lock
+from time import monotonic
+import sys
+
+
+class Progress(NamedTuple):
+    """ダウンロードの進捗です。
+
+    Attributes
+    ----------
+    url : str
+        ダウンロードしているニコニコ動画のURLです。
+    done : int
+        ダウンロードが終わったバイト数です。
+    total : int, optional
+        動画のサイズです。HLSの場合などわからない場合はNoneです。
+    speed : float
+        前回の通知から今回の通知までの速度(バイト毎秒)です。
+    average : float
+        指数移動平均で均した速度(バイト毎秒)です。
+    eta : float, optional
+        `average`から計算した残りの秒数です。わからない場合はNoneです。
+    finished : bool
+        ダウンロードが終わったかどうかです。"""
+    url: str
+    done: int
+    total: Optional[int]
+    speed: float
+    average: float
+    eta: Optional[float]
+    finished: bool
+
+    @property
+    def percent(self) -> Optional[float]:
+        """進捗の割合(0から100)です。`total`がわからない場合はNoneです。"""
+        if not self.total:
+            return None
+        return self.done / self.total * 100
+
+
+ProgressCallback = Callable[[Progress], None]
+
+
+class ProgressTracker:
+    """ダウンロードしたバイト数を数えて、一定の間隔で`Progress`をコールバックに渡すクラスです。  
+    `advance`は複数のスレッドから呼び出しても大丈夫です。  
+    コールバックは`advance`を呼び出したスレッドで実行されるので、時間のかかる処理はしないでください。
+
+    Parameters
+    ----------
+    callback : Callable[[Progress], None]
+        進捗を渡す関数です。
+    url : str, default ""
+        `Progress.url`に入れるURLです。
+    interval : float, default 0.5
+        コールバックを呼び出す最短の間隔(秒)です。
+    alpha : float, default 0.3
+        指数移動平均の重みです。大きいほど最近の速度が重視されます。"""
+
+    def __init__(
+        self, callback: ProgressCallback, url: str = "",
+        interval: float = 0.5, alpha: float = 0.3
+    ):
+        self.callback, self.url = callback, url
+        self.interval, self.alpha = interval, alpha
+        self.done, self.total = 0, None
+        self.average = 0.0
+        self._lock = Lock()
+        self._last_time = self._next = monotonic()
+        self._last_done = 0
+
+    def reset(self, done: int = 0, total: Optional[int] = None) -> None:
+        """ダウンロードし直す際などに数え直します。
+
+        Parameters
+        ----------
+        done : int, default 0
+            既にダウンロードが終わっているバイト数です。
+        total : int, optional
+            動画のサイズです。"""
+        with self._lock:
+            self.done, self.total, self._last_done = done, total, done
+            self._last_time = monotonic()
+
+    def advance(self, length: int) -> None:
+        """ダウンロードしたバイト数を追加します。  
+        前回の通知から`interval`秒経っていればコールバックを呼び出します。
+
+        Parameters
+        ----------
+        length : int
+            ダウンロードしたバイト数です。"""
+        with self._lock:
+            self.done += length
+            now = monotonic()
+            if now < self._next:
+                return
+            progress = self._make(now, False)
+        self.callback(progress)
+
+    def finish(self) -> None:
+        """ダウンロードが終わったことを通知します。"""
+        with self._lock:
+            progress = self._make(monotonic(), True)
+        self.callback(progress)
+
+    def _make(self, now: float, finished: bool) -> Progress:
+        # 前回の通知からの速度を計算して`Progress`を作ります。
+        elapsed = now - self._last_time
+        speed = (self.done - self._last_done) / elapsed if elapsed > 0 else 0.0
+        if elapsed > 0:
+            self.average = speed if not self.average \
+                else self.alpha * speed + (1 - self.alpha) * self.average
+        self._last_time, self._last_done = now, self.done
+        self._next = now + self.interval
+        eta = None
+        if self.total is not None and self.average > 0:
+            eta = max(0, self.total - self.done) / self.average
+        return Progress(
+            self.url, self.done, self.total, speed, self.average,
+            0.0 if finished else eta, finished
+        )
+
+
+def _size(value: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GiB"
+
+
+def format_progress(progress: Progress) -> str:
+    """`Progress`を端末に表示するための文字列にします。
+
+    Parameters
+    ----------
+    progress : Progress
+        進捗です。
+
+    Returns
+    -------
+    text : str
+        `45% (1234/5678) 1.2MiB/s ETA 0:12`のような文字列です。"""
+    if progress.total:
+        text = f"{int(progress.percent)}% ({progress.done}/{progress.total})"
+    else:
+        text = _size(progress.done)
+    text += f" {_size(progress.average)}/s"
+    if progress.eta is not None:
+        minutes, seconds = divmod(int(progress.eta), 60)
+        text += f" ETA {minutes}:{seconds:02}"
+    return text
+
+
+def terminal_renderer(
+    prefix: str = "Downloading video... :", file: TextIO = sys.stdout
+) -> ProgressCallback:
+    """進捗を端末の一行に上書きして表示するコールバックを作ります。  
+    `log=True`の場合の進捗の表示にもこれと同じ表示が使われます。
+
+    Parameters
+    ----------
+    prefix : str, default "Downloading video... :"
+        進捗の前に表示する文字列です。
+    file : TextIO, default sys.stdout
+        表示先です。
+
+    Returns
+    -------
+    callback : Callable[[Progress], None]
+        `download`の`progress`に渡せるコールバックです。"""
+    def render(progress: Progress) -> None:
+        print(
+            f"\r{prefix} {format_progress(progress)}",
+            end="\n" if progress.finished else "", file=file, flush=True
+        )
+    return render
+
+
+class CombinedProgress:
+    """複数のダウンロードの進捗をまとめて端末の一行に表示するクラスです。  
+    インスタンスをそのまま`download`の`progress`に渡せます。  
+    複数のスレッドから呼び出しても大丈夫です。
+
+    Parameters
+    ----------
+    total : int, optional
+        ダウンロードする動画の数です。わからない場合はNoneです。
+    file : TextIO, default sys.stderr
+        表示先です。
+    interval : float, default 0.5
+        表示を更新する最短の間隔(秒)です。
+
+    Examples
+    --------
+    ```python
+    progress = niconico_dl.CombinedProgress(len(urls))
+    for result in niconico_dl.NicoNicoBatch(urls, progress=progress):
+        progress.complete(result.url, result.ok)
+    progress.close()
+    ```"""
+
+    def __init__(
+        self, total: Optional[int] = None, file: TextIO = sys.stderr,
+        interval: float = 0.5
+    ):
+        self.total, self.file, self.interval = total, file, interval
+        self.completed = self.failed = 0
+        self._active: Dict[str, Progress] = {}
+        self._finished_bytes = 0
+        self._lock, self._next = Lock(), 0.0
+
+    def __call__(self, progress: Progress) -> None:
+        with self._lock:
+            if progress.finished:
+                self._active.pop(progress.url, None)
+                self._finished_bytes += progress.done
+            else:
+                self._active[progress.url] = progress
+            self._render(False)
+
+    def complete(self, url: str, ok: bool = True) -> None:
+        """動画一つの処理が終わったことを伝えます。
+
+        Parameters
+        ----------
+        url : str
+            終わったニコニコ動画のURLです。
+        ok : bool, default True
+            成功したかどうかです。"""
+        with self._lock:
+            self._active.pop(url, None)
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+            self._render(True)
+
+    def message(self, text: str) -> None:
+        """進捗の表示を崩さないようにメッセージを表示します。
+
+        Parameters
+        ----------
+        text : str
+            表示するメッセージです。"""
+        with self._lock:
+            print(f"\r\x1b[K{text}", file=self.file, flush=True)
+            self._render(True)
+
+    def close(self) -> None:
+        """最後の進捗を表示して改行します。"""
+        with self._lock:
+            self._render(True)
+            print(file=self.file, flush=True)
+
+    def format(self) -> str:
+        """今の進捗を`[3/10 1 failed 2 active] 12.0MiB 3.4MiB/s`のような文字列にします。"""
+        done = self._finished_bytes + sum(
+            progress.done for progress in self._active.values()
+        )
+        speed = sum(progress.average for progress in self._active.values())
+        text = f"[{self.completed}/{'?' if self.total is None else self.total}"
+        if self.failed:
+            text += f" {self.failed} failed"
+        return f"{text} {len(self._active)} active] {_size(done)} {_size(speed)}/s"
+
+    def _render(self, force: bool) -> None:
+        now = monotonic()
+        if not force and now < self._next:
+            return
+        self._next = now + self.interval
+        print(f"\r\x1b[K{self.format()}", end="", file=self.file, flush=True)
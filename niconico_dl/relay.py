@@ -0,0 +1,243 @@
+# niconico_dl - Relay
+
+from typing import Dict, Optional
+
+from aiohttp import ClientError, web
+import asyncio
+
+from .async_video_manager import NicoNicoVideoAsync
+from .stream import _auth
+from .templates import _make_url
+
+
+# クライアントにそのまま渡すレスポンスのヘッダーです。
+PASS_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Range", "Accept-Ranges",
+    "Last-Modified", "ETag"
+)
+# セッションが使えなくなったと判断するステータスコードです。
+EXPIRED_STATUSES = (401, 403, 404, 410)
+
+
+class _Relay:
+    # 一つの動画のセッションとそれを見ているクライアントの数です。
+    # `retired`は新しいクライアントには使わず、見ているクライアントがいなくなったら閉じるという意味です。
+    def __init__(self, video: NicoNicoVideoAsync, url: str, now: float):
+        self.video, self.url, self.params = video, url, _auth(video.result_data)
+        self.viewers, self.last_used, self.retired = 0, now, False
+
+    @property
+    def alive(self) -> bool:
+        return self.video.is_working_heartbeat()
+
+
+class RelayServer:
+    """ニコニコ動画の動画をそのまま配信するHTTPサーバーです。  
+    `/watch/<動画ID>`にアクセスするとその動画を配信し、`Range`ヘッダーもそのまま使えます。  
+    同じ動画を同時に見ているクライアントは一つのセッションを共有し、Heartbeatは`NicoNicoVideoAsync`のものが使われます。  
+    誰も見ていない状態が`idle_timeout`秒続いたセッションは閉じられます。  
+    `/status`では開いているセッションとそれぞれを見ているクライアントの数をJSONで返します。
+
+    Parameters
+    ----------
+    host : str, default "127.0.0.1"
+        サーバーのホストです。
+    port : int, default 8080
+        サーバーのポートです。
+    idle_timeout : float, default 60
+        誰も見ていないセッションを閉じるまでの秒数です。
+    chunk_size : int, default 65536
+        一度にクライアントに送るバイト数です。
+    **kwargs
+        `NicoNicoVideoAsync`に渡す引数です。
+
+    Examples
+    --------
+    ```python
+    niconico_dl.RelayServer(port=8080).run()
+    # ffplay http://127.0.0.1:8080/watch/sm9
+    ```
+    コマンドラインからは`python -m niconico_dl serve --port 8080`で動かせます。"""
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 8080,
+        idle_timeout: float = 60, chunk_size: int = 65536, **kwargs
+    ):
+        self.host, self.port = host, port
+        self.idle_timeout, self.chunk_size = idle_timeout, chunk_size
+        self._kwargs = kwargs
+        self._relays: Dict[str, _Relay] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+        self.app = web.Application()
+        self.app.router.add_route("GET", "/watch/{video_id}", self._watch)
+        self.app.router.add_route("HEAD", "/watch/{video_id}", self._watch)
+        self.app.router.add_get("/status", self._status)
+
+    async def _open(self, video_id: str) -> _Relay:
+        # 新しくセッションを作ります。
+        video = NicoNicoVideoAsync(_make_url(video_id), **self._kwargs)
+        try:
+            url = await video.get_download_link()
+        except BaseException:
+            await video.aclose()
+            raise
+        return _Relay(video, url, video.loop.time())
+
+    async def _get_relay(self, video_id: str) -> _Relay:
+        # 使えるセッションがあればそれを、なければ作って返します。
+        relay = self._relays.get(video_id)
+        if relay is not None and relay.alive:
+            return relay
+        if relay is not None:
+            self._drop(video_id, relay)
+        task = self._pending.get(video_id)
+        if task is None:
+            # 同時に来たリクエストで同じ動画のセッションを二つ作らないようにする。
+            task = asyncio.get_running_loop().create_task(
+                self._open(video_id), name="niconico_dl.relay"
+            )
+            task.add_done_callback(lambda task: self._opened(video_id, task))
+            self._pending[video_id] = task
+        return await asyncio.shield(task)
+
+    def _opened(self, video_id: str, task: asyncio.Task) -> None:
+        # セッションを作り終わったら登録します。
+        del self._pending[video_id]
+        if not task.cancelled() and task.exception() is None:
+            self._relays[video_id] = task.result()
+
+    def _drop(self, video_id: str, relay: _Relay) -> None:
+        # 新しいクライアントには使わないようにして、誰も見ていなければ閉じます。
+        # 他のクライアントが見ている場合は、最後のクライアントが離れた時に`_leave`で閉じます。
+        if self._relays.get(video_id) is relay:
+            del self._relays[video_id]
+        relay.retired = True
+        if relay.viewers <= 0:
+            relay.video.close()
+
+    def _leave(self, relay: _Relay) -> None:
+        relay.viewers -= 1
+        relay.last_used = relay.video.loop.time()
+        if relay.retired and relay.viewers <= 0:
+            relay.video.close()
+
+    async def _watch(self, request: web.Request) -> web.StreamResponse:
+        video_id = request.match_info["video_id"]
+        headers = {}
+        for key in ("Range", "If-Range"):
+            if key in request.headers:
+                headers[key] = request.headers[key]
+
+        for count in range(2):
+            try:
+                relay = await self._get_relay(video_id)
+            except Exception as e:
+                raise web.HTTPBadGateway(text=f"{e.__class__.__name__}: {e}")
+            relay.viewers += 1
+            try:
+                session = relay.video._get_session()
+                async with session.request(
+                    request.method, relay.url, params=relay.params,
+                    headers=dict(relay.video._headers.media, **headers)
+                ) as r:
+                    if r.status in EXPIRED_STATUSES and count == 0:
+                        # セッションが切れたなら作り直してもう一度試す。
+                        self._drop(video_id, relay)
+                        continue
+                    response = web.StreamResponse(status=r.status)
+                    for key in PASS_HEADERS:
+                        if key in r.headers:
+                            response.headers[key] = r.headers[key]
+                    await response.prepare(request)
+                    if request.method != "HEAD":
+                        try:
+                            async for chunk in r.content.iter_chunked(
+                                self.chunk_size
+                            ):
+                                await relay.video.limits.acquire_async(
+                                    "media", len(chunk)
+                                )
+                                await response.write(chunk)
+                        except ConnectionResetError:
+                            # クライアントが切断した場合はそのまま終わる。
+                            raise
+                        except ClientError:
+                            # 途中で上流が切れた場合はもう送れないので接続を切る。
+                            request.transport.close()
+                            return response
+                    await response.write_eof()
+                    return response
+            except ClientError as e:
+                if count == 0:
+                    self._drop(video_id, relay)
+                    continue
+                raise web.HTTPBadGateway(text=f"{e.__class__.__name__}: {e}")
+            finally:
+                self._leave(relay)
+        raise web.HTTPBadGateway(text="セッションを作り直しても動画を取得できませんでした。")
+
+    async def _status(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            video_id: {"viewers": relay.viewers, "alive": relay.alive}
+            for video_id, relay in self._relays.items()
+        })
+
+    async def _reap(self) -> None:
+        # 誰も見ていない状態が続いているセッションを閉じます。
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 2))
+            now = loop.time()
+            for video_id, relay in list(self._relays.items()):
+                if relay.viewers <= 0 and (
+                    now - relay.last_used >= self.idle_timeout
+                    or not relay.alive
+                ):
+                    self._drop(video_id, relay)
+
+    async def start(self) -> None:
+        """サーバーを動かします。止めるには`close`を実行してください。"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            # 空いているポートが選ばれた場合はそれを記録しておく。
+            self.port = site._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.get_running_loop().create_task(
+            self._reap(), name="niconico_dl.relay"
+        )
+
+    async def close(self) -> None:
+        """サーバーを止めて全てのセッションを閉じます。"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        for task in self._pending.values():
+            task.cancel()
+        relays = list(self._relays.items())
+        for video_id, relay in relays:
+            self._drop(video_id, relay)
+        # 共有セッションを手放し終わるまで待つ。
+        await asyncio.gather(*(relay.video.aclose() for _, relay in relays))
+
+    async def serve_forever(self) -> None:
+        """サーバーを動かして止められるまで待機します。"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.close()
+
+    def run(self) -> None:
+        """サーバーを動かします。`Ctrl+C`で止まるまで戻りません。"""
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,191 @@
+# niconico_dl - Retry
+
+from typing import Iterable, Optional
+
+from threading import Lock
+from random import random
+
+
+# しばらく待てば成功する可能性のあるステータスコードです。
+TRANSIENT_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+# セッションが切れた場合などに返されて、セッションを作り直せば成功するステータスコードです。
+SESSION_STATUSES = frozenset((401, 403, 404, 410))
+
+
+def _status(error: BaseException) -> Optional[int]:
+    # `requests`と`aiohttp`のどちらのエラーからもステータスコードを取り出します。
+    # 読み込み中に切断された場合などの成功したレスポンスのエラーはステータスコードのないエラーとして扱う。
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) and status >= 400 else None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    # `Retry-After`ヘッダーの秒数を取り出します。日時で指定されている場合は使いません。
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return max(0.0, float(headers["Retry-After"])) if headers else None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """やり直しの回数を複数の処理で共有して制限するためのクラスです。  
+    障害が起きている時に全てのダウンロードがやり直しを繰り返して負荷をかけ続けないようにします。  
+    やり直す度にトークンを一つ使い、処理が成功する度に`ratio`個のトークンが補充されます。  
+    スレッドセーフです。
+
+    Parameters
+    ----------
+    capacity : float, default 10
+        貯めておけるトークンの最大の量で、最初に貯まっている量です。
+    ratio : float, default 0.2
+        処理が成功した際に補充するトークンの量です。  
+        0.2の場合は成功した処理五回につき一回までやり直せます。"""
+
+    def __init__(self, capacity: float = 10, ratio: float = 0.2):
+        self.capacity, self.ratio = capacity, ratio
+        self.tokens = capacity
+        self._lock = Lock()
+
+    def withdraw(self) -> bool:
+        """トークンを一つ使います。
+
+        Returns
+        -------
+        withdrawn : bool
+            トークンが残っていてやり直せるかどうかです。"""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def deposit(self) -> None:
+        """処理が成功した際にトークンを補充します。"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+
+class RetryPolicy:
+    """通信に失敗した際にやり直すかどうかとどれだけ待つかを決めるクラスです。  
+    待つ時間は`backoff * 2 ** attempt`秒で`max_backoff`秒までで、`jitter`が有効な場合はそこから0秒までのランダムな時間になります。  
+    サーバーから`Retry-After`が返された場合はそちらを優先します。
+
+    Parameters
+    ----------
+    attempts : int, default 3
+        やり直す最大の回数です。
+    backoff : float, default 0.5
+        最初にやり直す際に待つ秒数の基準です。
+    max_backoff : float, default 30.0
+        待つ最大の秒数です。
+    jitter : bool, default True
+        待つ時間をランダムにするかどうかです。  
+        同時に失敗した処理が同時にやり直して再び失敗するのを防ぎます。
+    statuses : Iterable[int], optional
+        やり直すステータスコードです。  
+        指定しない場合は`TRANSIENT_STATUSES`(`429`や`5xx`など)と`SESSION_STATUSES`(`403`や`404`など)になります。  
+        ステータスコードのないエラー(接続の失敗やタイムアウトなど)は常にやり直します。
+    budget : RetryBudget, optional
+        やり直しの回数を他の処理と共有して制限するための`RetryBudget`です。
+
+    Examples
+    --------
+    ```python
+    policy = niconico_dl.RetryPolicy(attempts=5, budget=niconico_dl.RetryBudget())
+    with niconico_dl.NicoNicoVideo(url) as nico:
+        nico.download("video.mp4", retry=policy)
+    ```"""
+
+    def __init__(
+        self, attempts: int = 3, backoff: float = 0.5,
+        max_backoff: float = 30.0, jitter: bool = True,
+        statuses: Optional[Iterable[int]] = None,
+        budget: Optional[RetryBudget] = None
+    ):
+        self.attempts, self.backoff = attempts, backoff
+        self.max_backoff, self.jitter = max_backoff, jitter
+        self.statuses = frozenset(
+            TRANSIENT_STATUSES | SESSION_STATUSES
+            if statuses is None else statuses
+        )
+        self.budget = budget
+
+    @classmethod
+    def from_value(cls, retry) -> "RetryPolicy":
+        """回数か`RetryPolicy`から`RetryPolicy`を作ります。
+
+        Parameters
+        ----------
+        retry : int or RetryPolicy
+            やり直す回数か`RetryPolicy`です。
+
+        Returns
+        -------
+        policy : RetryPolicy
+            `retry`が`RetryPolicy`の場合はそのままです。"""
+        return retry if isinstance(retry, RetryPolicy) else cls(retry)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """エラーがやり直せるものかどうかを返します。
+
+        Parameters
+        ----------
+        error : BaseException
+            発生したエラーです。
+
+        Returns
+        -------
+        retryable : bool
+            ステータスコードのないエラーか、`statuses`に含まれるステータスコードのエラーの場合に`True`です。"""
+        status = _status(error)
+        return status is None or status in self.statuses
+
+    def should_retry(self, attempt: int, error: BaseException) -> bool:
+        """やり直すべきかどうかを返します。  
+        やり直す場合は`budget`のトークンを使います。
+
+        Parameters
+        ----------
+        attempt : int
+            今までにやり直した回数です。
+        error : BaseException
+            発生したエラーです。
+
+        Returns
+        -------
+        retry : bool
+            やり直すべきかどうかです。"""
+        return attempt < self.attempts and self.is_retryable(error) and (
+            self.budget is None or self.budget.withdraw()
+        )
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """やり直す前に待つ秒数を返します。
+
+        Parameters
+        ----------
+        attempt : int
+            今までにやり直した回数です。
+        error : BaseException, optional
+            発生したエラーです。`Retry-After`が含まれていればその秒数を使います。
+
+        Returns
+        -------
+        delay : float
+            待つ秒数です。"""
+        if error is not None:
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * random() if self.jitter else delay
+
+    def succeeded(self) -> None:
+        """処理が成功したことを`budget`に伝えます。"""
+        if self.budget is not None:
+            self.budget.deposit()
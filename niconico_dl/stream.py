@@ -0,0 +1,455 @@
+# niconico_dl - Stream
+
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+from threading import Event, Thread
+from queue import Full, Queue
+from time import sleep
+import asyncio
+import io
+
+from .templates import _RangeNotSupported
+from .retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from .async_video_manager import NicoNicoVideoAsync
+    from .video_manager import NicoNicoVideo
+
+
+def _parse_size(status: int, headers) -> Optional[int]:
+    # レスポンスのヘッダーから動画全体のサイズを取り出します。
+    if status == 206:
+        total = headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = headers.get("content-length")
+    return int(length) if length is not None else None
+
+
+def _auth(data: dict) -> Tuple[Tuple[str, str], ...]:
+    return (("ht2_nicovideo", data["content_auth"]["content_auth_info"]["value"]),)
+
+
+def _whence(position: int, offset: int, whence: int, size: Optional[int]) -> int:
+    # `seek`の引数から新しい位置を計算します。
+    if whence == io.SEEK_SET:
+        new = offset
+    elif whence == io.SEEK_CUR:
+        new = position + offset
+    elif whence == io.SEEK_END:
+        if size is None:
+            raise io.UnsupportedOperation("動画のサイズがわからないので末尾からシークできません。")
+        new = size + offset
+    else:
+        raise ValueError(f"whenceの値が不正です：{whence}")
+    if new < 0:
+        raise ValueError(f"シーク先が負の位置です：{new}")
+    return new
+
+
+class VideoReader(io.RawIOBase):
+    """ニコニコ動画の動画をファイルのように読み込むためのクラスです。  
+    `NicoNicoVideo.open`から作られます。  
+    裏のスレッドで`buffer_size`個のチャンクまで先読みをして、`seek`した場合は`Range`ヘッダーを使ってその位置から読み込み直します。  
+    これを閉じるまでHeartbeatは動き続けます。
+
+    Parameters
+    ----------
+    video : NicoNicoVideo
+        読み込む動画の`NicoNicoVideo`です。
+    chunk_size : int, default 65536
+        一度に読み込むバイト数です。
+    buffer_size : int, default 16
+        先読みしておくチャンクの最大数です。
+    close_video : bool, default False
+        これを閉じた際に`video`も閉じるかどうかです。
+    retry : int or RetryPolicy, default 3
+        読み込みに失敗した際にセッションを作り直して今の位置から読み込み直す回数か`RetryPolicy`です。  
+        回数は連続で失敗した回数で、読み込みに成功すると数え直します。
+
+    Attributes
+    ----------
+    size : int, optional
+        動画のサイズです。最初に読み込むまではNoneの場合があります。
+
+    Examples
+    --------
+    ```python
+    with niconico_dl.NicoNicoVideo(url) as nico, nico.open() as f:
+        subprocess.run(["ffmpeg", "-i", "pipe:0", "audio.mp3"], stdin=f)
+    ```"""
+
+    def __init__(
+        self, video: "NicoNicoVideo", chunk_size: int = 65536,
+        buffer_size: int = 16, close_video: bool = False,
+        retry: Union[int, RetryPolicy] = 3
+    ):
+        super().__init__()
+        self.video, self.chunk_size = video, chunk_size
+        self.buffer_size, self.close_video = buffer_size, close_video
+        self._policy, self._attempt = RetryPolicy.from_value(retry), 0
+        self.size: Optional[int] = None
+        self._url = video.get_download_link()
+        self._params = _auth(video.result_data)
+        self._position, self._chunk = 0, memoryview(b"")
+        self._queue: Optional[Queue] = None
+        self._stop: Optional[Event] = None
+        self._thread: Optional[Thread] = None
+
+        # 先にサイズを取得しておく。
+        r = video._get_session().head(
+            self._url, params=self._params, headers=video._headers.media
+        )
+        r.raise_for_status()
+        self._ranged = r.headers.get("accept-ranges", "").lower() == "bytes"
+        self.size = _parse_size(r.status_code, r.headers)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._ranged
+
+    def tell(self) -> int:
+        return self._position
+
+    def _start(self) -> None:
+        # 今の位置から先読みをするスレッドを動かします。
+        self._queue, self._stop = Queue(self.buffer_size), Event()
+        self._thread = Thread(
+            target=self._read_ahead,
+            args=(self._position, self._queue, self._stop),
+            name="niconico_dl.stream", daemon=True
+        )
+        self._thread.start()
+
+    def _stop_read_ahead(self) -> None:
+        if self._thread is not None:
+            # スレッドは次のチャンクを読み込んだ時点で終わるので待たない。
+            self._stop.set()
+            self._queue = self._stop = self._thread = None
+        self._chunk = memoryview(b"")
+
+    def _read_ahead(self, position: int, queue: Queue, stop: Event) -> None:
+        def put(item) -> bool:
+            # 読み込む側が止めるまでキューが空くのを待ちます。
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                except Full:
+                    continue
+                else:
+                    return True
+            return False
+
+        headers = dict(self.video._headers.media)
+        if position:
+            headers["Range"] = f"bytes={position}-"
+        try:
+            with self.video._get_session().get(
+                self._url, params=self._params, headers=headers, stream=True
+            ) as r:
+                r.raise_for_status()
+                if position and r.status_code != 206:
+                    raise _RangeNotSupported()
+                if self.size is None:
+                    self.size = _parse_size(r.status_code, r.headers)
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        self.video.limits.acquire("media", len(chunk))
+                        if not put(chunk):
+                            return
+        except BaseException as e:
+            put(e)
+        else:
+            put(b"")
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        if self.closed:
+            raise ValueError("閉じたVideoReaderは読み込めません。")
+        view, done = memoryview(buffer).cast("B"), 0
+        while done < len(view):
+            if not self._chunk:
+                if self.size is not None and self._position >= self.size:
+                    break
+                if self._thread is None:
+                    self._start()
+                item = self._queue.get()
+                if isinstance(item, BaseException):
+                    self._stop_read_ahead()
+                    if isinstance(item, _RangeNotSupported):
+                        raise io.UnsupportedOperation(
+                            "サーバーがRangeに対応していないためシークできません。"
+                        )
+                    if self._retry(item):
+                        continue
+                    raise item
+                if not item:
+                    self._queue.put(item)
+                    break
+                self._chunk, self._attempt = memoryview(item), 0
+            length = min(len(self._chunk), len(view) - done)
+            view[done:done + length] = self._chunk[:length]
+            self._chunk = self._chunk[length:]
+            done += length
+            self._position += length
+        return done
+
+    def _retry(self, error: BaseException) -> bool:
+        # 通信に失敗した場合は少し待ってからセッションを作り直して、今の位置から読み込み直します。
+        import requests
+
+        if not isinstance(error, requests.RequestException) \
+                or (self._position and not self._ranged) \
+                or not self._policy.should_retry(self._attempt, error):
+            return False
+        sleep(self._policy.delay(self._attempt, error))
+        self._attempt += 1
+        self.video._reconnect()
+        self._url = self.video.get_download_link()
+        self._params = _auth(self.video.result_data)
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        position = _whence(self._position, offset, whence, self.size)
+        if position != self._position:
+            if not self._ranged:
+                raise io.UnsupportedOperation(
+                    "サーバーがRangeに対応していないためシークできません。"
+                )
+            # 先読みしたチャンクの中なら読み込み直さない。
+            if self._position < position < self._position + len(self._chunk):
+                self._chunk = self._chunk[position - self._position:]
+            else:
+                self._stop_read_ahead()
+            self._position = position
+        return self._position
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop_read_ahead()
+            if self.close_video:
+                self.video.close()
+        super().close()
+
+
+class AsyncVideoStream:
+    """ニコニコ動画の動画を非同期で少しずつ読み込むためのクラスです。  
+    `NicoNicoVideoAsync.stream`から作られます。  
+    `async for`でチャンクごとに読み込むか`read`で指定したバイト数を読み込めます。  
+    裏のTaskで`buffer_size`個のチャンクまで先読みをして、`seek`した場合は`Range`ヘッダーを使ってその位置から読み込み直します。  
+    これを閉じるまでHeartbeatは動き続けます。
+
+    Parameters
+    ----------
+    video : NicoNicoVideoAsync
+        読み込む動画の`NicoNicoVideoAsync`です。
+    chunk_size : int, default 65536
+        一度に読み込むバイト数です。
+    buffer_size : int, default 16
+        先読みしておくチャンクの最大数です。
+    close_video : bool, default False
+        これを閉じた際に`video`も閉じるかどうかです。
+    retry : int or RetryPolicy, default 3
+        読み込みに失敗した際にセッションを作り直して今の位置から読み込み直す回数か`RetryPolicy`です。  
+        回数は連続で失敗した回数で、読み込みに成功すると数え直します。
+
+    Attributes
+    ----------
+    size : int, optional
+        動画のサイズです。最初に読み込むまではNoneの場合があります。
+
+    Examples
+    --------
+    ```python
+    async with niconico_dl.NicoNicoVideoAsync(url) as nico:
+        async with await nico.stream() as stream:
+            async for chunk in stream:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+    ```"""
+
+    def __init__(
+        self, video: "NicoNicoVideoAsync", chunk_size: int = 65536,
+        buffer_size: int = 16, close_video: bool = False,
+        retry: Union[int, RetryPolicy] = 3
+    ):
+        self.video, self.chunk_size = video, chunk_size
+        self.buffer_size, self.close_video = buffer_size, close_video
+        self._policy, self._attempt = RetryPolicy.from_value(retry), 0
+        self.size: Optional[int] = None
+        self.closed = False
+        self._url: Optional[str] = None
+        self._position, self._chunk = 0, memoryview(b"")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _prepare(self) -> "AsyncVideoStream":
+        # ダウンロードリンクと動画のサイズを取得します。
+        self._url = await self.video.get_download_link()
+        self._params = _auth(self.video.result_data)
+        async with self.video._get_session().head(
+            self._url, params=self._params, headers=self.video._headers.media
+        ) as r:
+            r.raise_for_status()
+            self._ranged = r.headers.get("accept-ranges", "").lower() == "bytes"
+            self.size = _parse_size(r.status, r.headers)
+        return self
+
+    async def __aenter__(self) -> "AsyncVideoStream":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+    def __aiter__(self) -> "AsyncVideoStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        data = await self.read(self.chunk_size)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    def tell(self) -> int:
+        """今の読み込み位置を返します。"""
+        return self._position
+
+    def seekable(self) -> bool:
+        """`seek`が使えるかどうかを返します。"""
+        return self._ranged
+
+    async def _read_ahead(self, position: int, queue: asyncio.Queue) -> None:
+        headers = dict(self.video._headers.media)
+        if position:
+            headers["Range"] = f"bytes={position}-"
+        try:
+            async with self.video._get_session().get(
+                self._url, params=self._params, headers=headers
+            ) as r:
+                r.raise_for_status()
+                if position and r.status != 206:
+                    raise _RangeNotSupported()
+                if self.video._on_first_byte is not None:
+                    self.video._first_byte()
+                if self.size is None:
+                    self.size = _parse_size(r.status, r.headers)
+                async for chunk in r.content.iter_chunked(self.chunk_size):
+                    await self.video.limits.acquire_async("media", len(chunk))
+                    await queue.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await queue.put(e)
+        else:
+            await queue.put(b"")
+
+    async def _stop_read_ahead(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._queue = self._task = None
+        self._chunk = memoryview(b"")
+
+    async def read(self, size: int = -1) -> bytes:
+        """指定したバイト数まで読み込みます。
+
+        Parameters
+        ----------
+        size : int, default -1
+            読み込む最大のバイト数です。負の値の場合は最後まで読み込みます。
+
+        Returns
+        -------
+        data : bytes
+            読み込んだデータです。最後まで読み込んだ場合は空です。"""
+        if self.closed:
+            raise ValueError("閉じたAsyncVideoStreamは読み込めません。")
+        data = bytearray()
+        while size < 0 or len(data) < size:
+            if not self._chunk:
+                if self.size is not None and self._position >= self.size:
+                    break
+                if self._task is None:
+                    self._queue = asyncio.Queue(self.buffer_size)
+                    self._task = self.video.loop.create_task(
+                        self._read_ahead(self._position, self._queue),
+                        name="niconico_dl.stream"
+                    )
+                item = await self._queue.get()
+                if isinstance(item, BaseException):
+                    await self._stop_read_ahead()
+                    if isinstance(item, _RangeNotSupported):
+                        raise io.UnsupportedOperation(
+                            "サーバーがRangeに対応していないためシークできません。"
+                        )
+                    if await self._retry(item):
+                        continue
+                    raise item
+                if not item:
+                    self._queue.put_nowait(item)
+                    break
+                self._chunk, self._attempt = memoryview(item), 0
+            length = len(self._chunk) if size < 0 \
+                else min(len(self._chunk), size - len(data))
+            data += self._chunk[:length]
+            self._chunk = self._chunk[length:]
+            self._position += length
+        return bytes(data)
+
+    async def _retry(self, error: BaseException) -> bool:
+        # 通信に失敗した場合は少し待ってからセッションを作り直して、今の位置から読み込み直します。
+        from aiohttp import ClientError
+
+        if not isinstance(error, (ClientError, asyncio.TimeoutError)) \
+                or (self._position and not self._ranged) \
+                or not self._policy.should_retry(self._attempt, error):
+            return False
+        await asyncio.sleep(self._policy.delay(self._attempt, error))
+        self._attempt += 1
+        await self.video._reconnect()
+        self._url = await self.video.get_download_link()
+        self._params = _auth(self.video.result_data)
+        return True
+
+    async def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """読み込む位置を変えます。
+
+        Parameters
+        ----------
+        offset : int
+            位置です。
+        whence : int, default io.SEEK_SET
+            `offset`の基準です。`io.SEEK_SET`、`io.SEEK_CUR`、`io.SEEK_END`のどれかです。
+
+        Returns
+        -------
+        position : int
+            新しい位置です。
+
+        Raises
+        ------
+        io.UnsupportedOperation
+            サーバーが`Range`に対応していない場合に発生します。"""
+        position = _whence(self._position, offset, whence, self.size)
+        if position != self._position:
+            if not self._ranged:
+                raise io.UnsupportedOperation(
+                    "サーバーがRangeに対応していないためシークできません。"
+                )
+            if self._position < position < self._position + len(self._chunk):
+                self._chunk = self._chunk[position - self._position:]
+            else:
+                await self._stop_read_ahead()
+            self._position = position
+        return self._position
+
+    async def aclose(self) -> None:
+        """先読みを止めて閉じます。`close_video`が有効な場合は動画も閉じます。"""
+        if not self.closed:
+            self.closed = True
+            await self._stop_read_ahead()
+            if self.close_video:
+                await self.video.aclose()
@@ -1,9 +1,73 @@
 # niconico_dl - Templates
 
+from typing import Mapping, NamedTuple, Optional, Sequence, Union
+
+from types import MappingProxyType
+from html import unescape
 from copy import copy
+import re
+
+
+class HeaderSet(NamedTuple):
+    """通信の種類ごとのヘッダーです。  
+    中身は書き換えられない`MappingProxyType`なので、複数のスレッドやインスタンスで共有しても大丈夫です。  
+    ヘッダーを追加したり変えたりする場合は`build`で新しい辞書を作ってください。  
+    `headers[1]`のように添字でも取り出せるので、今まで通りのリストと同じ形式で使えます。
+
+    Attributes
+    ----------
+    options : Mapping[str, str]
+        HeartbeatのOPTIONSに使うヘッダーです。
+    api : Mapping[str, str]
+        DMCのセッションAPIに使うヘッダーです。
+    watch : Mapping[str, str]
+        ウォッチページの取得に使うヘッダーです。"""
+    options: Mapping[str, str]
+    api: Mapping[str, str]
+    watch: Mapping[str, str]
+
+    @classmethod
+    def make(cls, headers: Sequence[Mapping[str, str]]) -> "HeaderSet":
+        """`HEADERS`と同じ形式のリストから`HeaderSet`を作ります。  
+        渡したリストや辞書は後で書き換えても影響しないようにコピーされます。
+
+        Parameters
+        ----------
+        headers : Sequence[Mapping[str, str]]
+            OPTIONS用、セッションAPI用、ウォッチページ用の三つのヘッダーです。
+
+        Returns
+        -------
+        headers : HeaderSet
+            作った`HeaderSet`です。`headers`が`HeaderSet`の場合はそのままです。"""
+        if isinstance(headers, HeaderSet):
+            return headers
+        return cls(*(MappingProxyType(dict(header)) for header in headers))
 
+    @property
+    def media(self) -> Mapping[str, str]:
+        """動画の本体の取得に使うヘッダーです。`api`の`Content-Type`を`video/mp4`にしたものです。"""
+        return self.build(1, **{"Content-Type": "video/mp4"})
 
-HEADERS = [
+    def build(self, kind: Union[int, str], **extra: str) -> Mapping[str, str]:
+        """指定した種類のヘッダーに`extra`を足した新しいヘッダーを作ります。
+
+        Parameters
+        ----------
+        kind : int or str
+            ヘッダーの種類です。添字か`options`、`api`、`watch`のどれかです。
+        **extra : str
+            足したり上書きしたりするヘッダーです。
+
+        Returns
+        -------
+        headers : Mapping[str, str]
+            新しいヘッダーです。元のヘッダーは変わりません。"""
+        base = self[kind] if isinstance(kind, int) else getattr(self, kind)
+        return MappingProxyType(dict(base, **extra)) if extra else base
+
+
+HEADERS = HeaderSet.make([
     {
         "Host": "api.dmc.nico",
         "Connection": "keep-alive",
@@ -52,19 +116,31 @@ HEADERS = [
         "Accept-Encoding": "gzip, deflate, br",
         "Accept-Language": "ja,en;q=0.9,en-GB;q=0.8,en-US;q=0.7"
     }
-]
+])
 MODES = ("hls_parameters", "http_output_download_parameters") 
 
 
 URLS = {
-    "base_heartbeat": "https://api.dmc.nico/api/sessions"
+    "base_heartbeat": "https://api.dmc.nico/api/sessions",
+    "base_watch": "https://www.nicovideo.jp/watch/"
 }
 
 
-def _make_sessiondata(movie: dict, mode: str = MODES[0]) -> dict:
+def _make_sessiondata(
+    movie: dict, mode: str = MODES[0],
+    videos: Optional[Sequence[str]] = None,
+    audios: Optional[Sequence[str]] = None
+) -> dict:
     # 動画データからニコニコとの通信に使うセッションデータを作る関数。
+    # `videos`や`audios`を指定した場合はそのIDの動画や音声だけを要求します。
+    # `videos`を空にすると音声だけのセッションになります。
     data = {}
-    session =  movie["session"]
+    # 動画データを書き換えないように`videos`と`audios`はコピーしてから使います。
+    session = dict(
+        movie["session"],
+        videos=list(movie["session"]["videos"] if videos is None else videos),
+        audios=list(movie["session"]["audios"] if audios is None else audios)
+    )
 
     data["content_type"] = "movie"
     data["content_src_id_sets"] = [{"content_src_ids": []}]
@@ -135,6 +211,70 @@ def _make_sessiondata(movie: dict, mode: str = MODES[0]) -> dict:
     return {"session": data}
 
 
+def _make_url(url: str) -> str:
+    # 動画IDが渡された場合はニコニコ動画のURLにする関数。
+    if url.startswith(("http://", "https://")):
+        return url
+    return URLS["base_watch"] + url
+
+
+def _video_id(url: str) -> str:
+    # ニコニコ動画のURLから動画IDを取り出す関数。
+    return url.split("?")[0].split("#")[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+def _split_ranges(ranges: list, count: int) -> list:
+    # バイト範囲のリストを合計で大体`count`個の範囲になるように分割する関数。
+    # 範囲は`(start, end)`で`end`は`Range`ヘッダーと同じく範囲に含まれます。
+    total, result = sum(end - start + 1 for start, end in ranges), []
+    for start, end in ranges:
+        length = end - start + 1
+        pieces = max(1, min(length, round(count * length / total)))
+        step = -(-length // pieces)
+        for piece in range(start, end + 1, step):
+            result.append((piece, min(piece + step, end + 1) - 1))
+    return result
+
+
+_API_DATA = re.compile(r"""\sdata-api-data\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+def _extract_api_data(text: str) -> Optional[str]:
+    # ウォッチページのHTMLから`#js-initial-watch-data`の`data-api-data`を取り出す関数。
+    # HTML全体を解析すると遅いので、そのタグだけを探してその属性の値を取り出します。
+    index = text.find("js-initial-watch-data")
+    while index != -1:
+        start, end = text.rfind("<", 0, index), text.find(">", index)
+        if start != -1 and end != -1:
+            match = _API_DATA.search(text, start, end)
+            if match is not None:
+                return unescape(
+                    match.group(1) if match.group(1) is not None
+                    else match.group(2)
+                )
+        index = text.find("js-initial-watch-data", index + 1)
+    return None
+
+
+def _parse_api_data(text: str) -> Optional[str]:
+    # ウォッチページのHTMLから`data-api-data`を取り出す関数。
+    # 基本的に`_extract_api_data`を使い、取り出せなかった場合はBeautifulSoupで解析します。
+    data = _extract_api_data(text)
+    if data is None:
+        from bs4 import BeautifulSoup
+
+        tag = BeautifulSoup(text, "html.parser").find(
+            "div", {"id": "js-initial-watch-data"}
+        )
+        data = None if tag is None else tag.get("data-api-data")
+    return data
+
+
 class NicoNicoAcquisitionFailed(Exception):
     """ニコニコ動画から情報を取得するのに失敗した際に発生するもの。"""
+    pass
+
+
+class _RangeNotSupported(Exception):
+    # サーバーが`Range`に対応していない際に分割ダウンロードを中断するためのもの。
     pass
\ No newline at end of file
@@ -0,0 +1,237 @@
+# niconico_dl - Tracing
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from threading import Lock
+from time import perf_counter, time
+
+
+class Span(NamedTuple):
+    """計測した処理一つ分の記録です。
+
+    Attributes
+    ----------
+    name : str
+        処理の名前です。  
+        `watch_page`(ウォッチページの取得)、`parse`(動画の情報の取り出し)、`session`(セッションの作成)、
+        `head`(動画のサイズの取得)、`transfer`(動画の本体の取得)、`heartbeat`(Heartbeat)、`download`(ダウンロード全体)があります。
+    start : float
+        処理を始めた時刻(UNIX時間)です。
+    duration : float
+        処理にかかった秒数です。
+    attributes : dict
+        処理の詳細です。`video`(動画ID)や`bytes`、`ttfb`、失敗した場合は`error`などが入ります。"""
+    name: str
+    start: float
+    duration: float
+    attributes: Dict[str, Any]
+
+    @property
+    def end(self) -> float:
+        """処理が終わった時刻(UNIX時間)です。"""
+        return self.start + self.duration
+
+
+class DownloadStats:
+    """ダウンロード一回分の統計です。  
+    `Tracer`を指定した場合に`download`から返されます。  
+    接続やウォッチページの取得など、前回の`download`からそのダウンロードが終わるまでの処理が記録されます。
+
+    Attributes
+    ----------
+    url : str
+        ダウンロードしたニコニコ動画のURLです。
+    phases : Dict[str, float]
+        処理の名前ごとのかかった秒数の合計です。
+    bytes : int
+        ダウンロードしたバイト数です。
+    retries : int
+        接続し直した回数です。
+    ttfb : List[float]
+        リクエストを送ってから最初のレスポンスが返ってくるまでの秒数のリストです。
+    dns : List[float]
+        DNSの名前解決にかかった秒数のリストです。DNSのキャッシュを使った場合は記録されません。非同期版のみで記録されます。
+    connect : List[float]
+        新しい接続を作るのにかかった秒数(DNSの名前解決を含む)のリストです。非同期版のみで記録されます。
+    tls : List[float]
+        HTTPSの新しい接続を作るのにかかった秒数からDNSの名前解決を除いたもの(TCPの接続とTLSのハンドシェイク)のリストです。  
+        `aiohttp`はTLSのハンドシェイクだけの時間を計測する手段を提供していないため、TCPの接続の時間も含みます。非同期版のみで記録されます。
+    heartbeat : List[float]
+        ダウンロード中に送ったHeartbeatの往復にかかった秒数のリストです。"""
+
+    def __init__(self, url: str):
+        self.url, self.phases = url, {}
+        self.bytes, self.retries = 0, 0
+        self.ttfb: List[float] = []
+        self.dns: List[float] = []
+        self.connect: List[float] = []
+        self.tls: List[float] = []
+        self.heartbeat: List[float] = []
+        self._lock = Lock()
+
+    def add_bytes(self, length: int) -> None:
+        """ダウンロードしたバイト数を足します。複数のスレッドから呼び出しても大丈夫です。"""
+        with self._lock:
+            self.bytes += length
+
+    def add_phase(self, name: str, duration: float) -> None:
+        """処理にかかった秒数を`phases`に足します。複数のスレッドから呼び出しても大丈夫です。"""
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def __repr__(self) -> str:
+        return f"<DownloadStats {self.to_dict()}>"
+
+    def to_dict(self) -> dict:
+        """統計を辞書にして返します。"""
+        return {
+            "url": self.url, "phases": dict(self.phases), "bytes": self.bytes,
+            "retries": self.retries, "ttfb": list(self.ttfb),
+            "dns": list(self.dns), "connect": list(self.connect),
+            "tls": list(self.tls),
+            "heartbeat": list(self.heartbeat)
+        }
+
+
+class _SpanContext:
+    # `with`構文で処理にかかった時間を計測します。
+    __slots__ = ("tracer", "name", "attributes", "stats", "_start", "_counter")
+
+    def __init__(
+        self, tracer: "Tracer", name: str, attributes: dict,
+        stats: Optional[DownloadStats]
+    ):
+        self.tracer, self.name, self.attributes = tracer, name, attributes
+        self.stats = stats
+
+    def __enter__(self) -> "_SpanContext":
+        self._start, self._counter = time(), perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = perf_counter() - self._counter
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        if self.stats is not None:
+            self.stats.add_phase(self.name, duration)
+        self.tracer.record(
+            Span(self.name, self._start, duration, self.attributes)
+        )
+
+
+class _NullSpan:
+    # `Tracer`を指定していない場合に使う何もしないものです。
+    __slots__ = ()
+
+    @property
+    def attributes(self) -> Dict[str, Any]:
+        return {}
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """`NicoNicoVideo`や`NicoNicoVideoAsync`の処理にかかった時間を受け取るためのクラスです。  
+    `tracer`に渡すと処理ごとに`Span`が`on_span`に、ダウンロードが終わると`DownloadStats`が`on_stats`に渡されます。  
+    `tracer`を渡さない場合は計測自体をしません。  
+    これを継承して`record`と`finish`を上書きすることもできます。
+
+    Parameters
+    ----------
+    on_span : Callable[[Span], Any], optional
+        処理が終わる度に呼ばれる関数です。
+    on_stats : Callable[[DownloadStats], Any], optional
+        ダウンロードが終わる度に呼ばれる関数です。
+
+    Examples
+    --------
+    ```python
+    tracer = niconico_dl.Tracer(on_span=print)
+    with niconico_dl.NicoNicoVideo(url, tracer=tracer) as nico:
+        stats = nico.download("video.mp4")
+    ```
+    `stats.phases`は`{"watch_page": 0.12, "session": 0.31, "transfer": 8.4, ...}`のような辞書になります。"""
+
+    def __init__(
+        self, on_span: Optional[Callable[[Span], Any]] = None,
+        on_stats: Optional[Callable[[DownloadStats], Any]] = None
+    ):
+        self.on_span, self.on_stats = on_span, on_stats
+
+    def span(
+        self, name: str, stats: Optional[DownloadStats] = None, **attributes
+    ) -> _SpanContext:
+        """`with`構文で処理にかかった時間を計測します。
+
+        Parameters
+        ----------
+        name : str
+            処理の名前です。
+        stats : DownloadStats, optional
+            かかった時間を`phases`に足す`DownloadStats`です。
+        **attributes
+            `Span.attributes`に入れる値です。"""
+        return _SpanContext(self, name, attributes, stats)
+
+    def record(self, span: Span) -> None:
+        """処理が終わった際に呼ばれます。"""
+        if self.on_span is not None:
+            self.on_span(span)
+
+    def finish(self, stats: DownloadStats) -> None:
+        """ダウンロードが終わった際に呼ばれます。"""
+        if self.on_stats is not None:
+            self.on_stats(stats)
+
+
+class OpenTelemetryTracer(Tracer):
+    """`Span`をOpenTelemetryのスパンとして記録する`Tracer`です。  
+    使うには`opentelemetry-api`をインストールしてください。
+
+    Parameters
+    ----------
+    tracer : opentelemetry.trace.Tracer, optional
+        使うOpenTelemetryの`Tracer`です。指定しない場合は`niconico_dl`という名前で取得したものが使われます。
+    **kwargs
+        `Tracer`に渡す引数です。"""
+
+    def __init__(self, tracer: Any = None, **kwargs):
+        super().__init__(**kwargs)
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError(
+                    "OpenTelemetryTracerを使うには`opentelemetry-api`をインストールしてください。"
+                )
+            tracer = trace.get_tracer("niconico_dl")
+        self.tracer = tracer
+
+    def record(self, span: Span) -> None:
+        otel_span = self.tracer.start_span(
+            f"niconico_dl.{span.name}", start_time=int(span.start * 1e9),
+            attributes={
+                f"niconico_dl.{key}": value
+                for key, value in span.attributes.items()
+                if isinstance(value, (str, bool, int, float))
+            }
+        )
+        otel_span.end(end_time=int(span.end * 1e9))
+        super().record(span)
+
+
+def _span(
+    tracer: Optional[Tracer], name: str,
+    stats: Optional[DownloadStats] = None, **attributes
+):
+    # `tracer`がNoneの場合は何もしないものを返します。
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, stats, **attributes)
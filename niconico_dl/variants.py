@@ -0,0 +1,226 @@
+# niconico_dl - Variants
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Variant(NamedTuple):
+    """動画か音声の画質や音質一つ分の情報です。
+
+    Attributes
+    ----------
+    id : str
+        セッションの`video_src_ids`や`audio_src_ids`に使うIDです。例：`archive_h264_720p`
+    kind : str
+        `video`か`audio`です。
+    bitrate : int
+        ビットレート(ビット毎秒)です。
+    width : int, optional
+        横幅です。音声の場合はNoneです。
+    height : int, optional
+        縦幅です。音声の場合はNoneです。
+    label : str, optional
+        `720p`のような表示用の名前です。
+    available : bool
+        今のアカウントで使えるかどうかです。"""
+    id: str
+    kind: str
+    bitrate: int
+    width: Optional[int]
+    height: Optional[int]
+    label: Optional[str]
+    available: bool
+
+
+class Quality(NamedTuple):
+    """`NicoNicoVideo`や`NicoNicoVideoAsync`の`quality`に渡して、セッションを作る際の画質の選び方を決めるものです。  
+    条件に合う中で一番良いもの(`lowest`が有効な場合は一番悪いもの)が選ばれます。  
+    条件に合うものがない場合は一番ビットレートの低いものが選ばれます。
+
+    Attributes
+    ----------
+    max_height : int, optional
+        動画の縦幅の上限です。
+    max_bitrate : int, optional
+        動画のビットレート(ビット毎秒)の上限です。
+    throughput : float, optional
+        計測した通信速度(バイト毎秒)です。  
+        動画と音声の合計のビットレートがこの速度の`headroom`倍に収まるものを選びます。  
+        `Progress.average`などを使うことができます。
+    lowest : bool, default False
+        一番悪いものを選ぶかどうかです。プレビューを大量に保存する場合などに通信量を減らせます。
+    headroom : float, default 0.8
+        `throughput`のうち動画に使う割合です。
+
+    Examples
+    --------
+    ```python
+    with niconico_dl.NicoNicoVideo(url, quality=niconico_dl.Quality(max_height=360)) as nico:
+        nico.download("video.mp4")
+    ```"""
+    max_height: Optional[int] = None
+    max_bitrate: Optional[int] = None
+    throughput: Optional[float] = None
+    lowest: bool = False
+    headroom: float = 0.8
+
+
+def list_variants(movie: dict) -> Dict[str, List[Variant]]:
+    """`media.delivery.movie`から選べる画質と音質の一覧を作ります。
+
+    Parameters
+    ----------
+    movie : dict
+        `get_info`で取得した動画の情報の`media.delivery.movie`です。
+
+    Returns
+    -------
+    variants : Dict[str, List[Variant]]
+        `video`と`audio`それぞれの`Variant`のリストです。ビットレートの高い順に並んでいます。"""
+    variants = {}
+    for kind in ("video", "audio"):
+        allowed = set(movie["session"][f"{kind}s"])
+        variants[kind] = sorted((
+            Variant(
+                item["id"], kind, item["metadata"].get("bitrate", 0),
+                item["metadata"].get("resolution", {}).get("width"),
+                item["metadata"].get("resolution", {}).get("height"),
+                item["metadata"].get("label"),
+                item.get("isAvailable", True) and item["id"] in allowed
+            ) for item in movie.get(f"{kind}s", ())
+        ), key=lambda variant: variant.bitrate, reverse=True)
+    return variants
+
+
+def _pick(variants: List[Variant], lowest: bool) -> Optional[Variant]:
+    if not variants:
+        return None
+    return min(variants, key=lambda variant: variant.bitrate) if lowest \
+        else max(variants, key=lambda variant: (variant.bitrate, variant.height or 0))
+
+
+def select_variants(
+    movie: dict, quality: Quality
+) -> Tuple[Optional[Variant], Optional[Variant]]:
+    """`quality`に従って動画と音声を選びます。
+
+    Parameters
+    ----------
+    movie : dict
+        `get_info`で取得した動画の情報の`media.delivery.movie`です。
+    quality : Quality
+        選び方です。
+
+    Returns
+    -------
+    variants : Tuple[Optional[Variant], Optional[Variant]]
+        選んだ動画と音声です。使えるものがない場合はNoneです。"""
+    variants = list_variants(movie)
+    videos = [variant for variant in variants["video"] if variant.available]
+    audios = [variant for variant in variants["audio"] if variant.available]
+
+    audio = _pick(audios, quality.lowest)
+    budget = None
+    if quality.throughput is not None:
+        budget = quality.throughput * 8 * quality.headroom \
+            - (audio.bitrate if audio is not None else 0)
+    candidates = [
+        variant for variant in videos
+        if (quality.max_height is None or (variant.height or 0) <= quality.max_height)
+        and (quality.max_bitrate is None or variant.bitrate <= quality.max_bitrate)
+        and (budget is None or variant.bitrate <= budget)
+    ]
+    return _pick(candidates, quality.lowest) or _pick(videos, True), audio
+
+
+def choose_variants(
+    movie: dict, video: Optional[str] = None, audio: Optional[str] = None,
+    quality: Optional[Quality] = None
+) -> Tuple[Optional[Variant], Optional[Variant]]:
+    """IDか`quality`で動画と音声を選びます。  
+    IDを指定しなかった方は`quality`で選ばれ、`quality`も指定しない場合は一番良いものが選ばれます。
+
+    Parameters
+    ----------
+    movie : dict
+        `get_info`で取得した動画の情報の`media.delivery.movie`です。
+    video : str, optional
+        動画のIDです。
+    audio : str, optional
+        音声のIDです。
+    quality : Quality, optional
+        選び方です。
+
+    Returns
+    -------
+    variants : Tuple[Optional[Variant], Optional[Variant]]
+        選んだ動画と音声です。
+
+    Raises
+    ------
+    ValueError
+        存在しないか使えないIDを指定した場合に発生します。"""
+    variants = list_variants(movie)
+    chosen = list(select_variants(movie, quality or Quality()))
+    for index, (kind, id_) in enumerate((("video", video), ("audio", audio))):
+        if id_ is None:
+            continue
+        for variant in variants[kind]:
+            if variant.id == id_ and variant.available:
+                chosen[index] = variant
+                break
+        else:
+            raise ValueError(f"使えない{kind}のIDです：{id_}")
+    return chosen[0], chosen[1]
+
+
+def resolve_variants(
+    movie: dict, selected: Optional[Tuple[Optional[Variant], Optional[Variant]]] = None,
+    quality: Optional[Quality] = None, audio_only: bool = False,
+    muxed: bool = False
+) -> Optional[Tuple[Optional[Variant], Optional[Variant]]]:
+    """セッションで要求する動画と音声を決めます。
+
+    Parameters
+    ----------
+    movie : dict
+        `get_info`で取得した動画の情報の`media.delivery.movie`です。
+    selected : Tuple[Optional[Variant], Optional[Variant]], optional
+        `select_variant`で選ばれた動画と音声です。
+    quality : Quality, optional
+        選び方です。
+    audio_only : bool, default False
+        音声だけを要求するかどうかです。有効な場合は動画がNoneになります。
+    muxed : bool, default False
+        `audio_only`が有効な場合に、音声だけのセッションの代わりに一番ビットレートの低い動画と組み合わせるかどうかです。
+
+    Returns
+    -------
+    variants : Tuple[Optional[Variant], Optional[Variant]], optional
+        要求する動画と音声です。Noneの場合は全てを要求します。"""
+    variants = selected
+    if variants is None and (quality is not None or audio_only):
+        variants = select_variants(movie, quality or Quality())
+    if audio_only:
+        video = None
+        if muxed:
+            video = _pick([
+                variant for variant in list_variants(movie)["video"]
+                if variant.available
+            ], True)
+        variants = (video, variants[1])
+    return variants
+
+
+def _src_ids(
+    variants: Optional[Tuple[Optional[Variant], Optional[Variant]]],
+    audio_only: bool = False
+) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+    # `resolve_variants`の結果を`_make_sessiondata`に渡すIDのリストにします。
+    # 選べなかった方は全てを要求するが、音声だけの場合の動画は空にする。
+    if variants is None:
+        return None, None
+    video, audio = variants
+    return (
+        [video.id] if video is not None else [] if audio_only else None,
+        None if audio is None else [audio.id]
+    )
@@ -1,16 +1,40 @@
 # niconico_dl - Video Manager
 
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from itertools import islice
 from json import loads, dumps
-from bs4 import BeautifulSoup
-from threading import Thread
+from threading import Event, Lock
 from time import sleep, time
+from os.path import exists, getsize
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
+from urllib3.util.retry import Retry
 import requests
 
 from .templates import (
-    _make_sessiondata, HEADERS, URLS, NicoNicoAcquisitionFailed
+    _make_sessiondata, _parse_api_data, _split_ranges, _video_id,
+    _RangeNotSupported,
+    HEADERS, MODES, URLS, HeaderSet, NicoNicoAcquisitionFailed
 )
+from .journal import DownloadJournal
+from .stream import VideoReader
+from .writer import AdaptiveBuffer, FileWriter, MIN_BUFFER_SIZE
+from .progress import (
+    ProgressCallback, ProgressTracker, format_progress
+)
+from .tracing import DownloadStats, Span, Tracer, _span
+from . import hls
+from .cache import InfoCache
+from .limiter import RateLimiter, TokenBucket
+from .retry import RetryPolicy
+from .variants import (
+    Quality, Variant, _src_ids, choose_variants, list_variants,
+    resolve_variants
+)
+from .heartbeat import HeartbeatManager, HeartbeatSession
 
 
 class NicoNicoVideo:
@@ -23,24 +47,87 @@ class NicoNicoVideo:
         ニコニコ動画のURLです。
     log : bool, default False
         ログ出力をするかどうかです。
-    headers : dict, Optional
-        通信時に使用するヘッダーです。  
-        指定されない場合は`niconico_dl.HEADERS`を使用するので普通は変えなくて大丈夫です。
+    headers : HeaderSet or list, optional
+        通信時に使用するヘッダーです。`niconico_dl.HEADERS`と同じ形式のリストも使えます。  
+        指定されない場合は`niconico_dl.HEADERS`を使用するので普通は変えなくて大丈夫です。  
+        渡したものはコピーされて書き換えられることはありません。
+    session : requests.Session, optional
+        通信に使用するセッションです。  
+        指定しない場合は全ての`NicoNicoVideo`で共有されるセッションが使われます。  
+        共有セッションはスレッドをまたいで使われるので、スレッドプールで沢山の動画をダウンロードする際も接続が使い回されます。
+    heartbeat_manager : HeartbeatManager, optional
+        Heartbeatを送るのに使う`HeartbeatManager`です。  
+        指定しない場合はプロセス全体で共有されるものが使われ、全てのセッションのHeartbeatが一つのスレッドから送られます。
+    cache : InfoCache, optional
+        `get_info`で取得した動画の情報を保存しておくキャッシュです。  
+        指定した場合は同じ動画の情報をウォッチページから取得し直さずにキャッシュから取り出します。
+    hls : bool, default False
+        HLSで動画を配信するセッションを作るかどうかです。  
+        有効にした場合`download`はセグメントを並列でダウンロードしてつなげたMPEG-TSを保存します。
+    tracer : Tracer, optional
+        ウォッチページの取得やセッションの作成、ダウンロードなどの処理にかかった時間を受け取る`Tracer`です。  
+        指定した場合は`download`が`DownloadStats`を返します。指定しない場合は計測しません。
+    quality : Quality, optional
+        セッションを作る際の画質の選び方です。  
+        指定しない場合は使える全ての画質を要求して、どれを配信するかはニコニコ動画に任せます。  
+        後から`select_variant`で変えることもできます。
+    limits : RateLimiter, optional
+        ウォッチページの取得、セッションの作成、動画のダウンロードの制限に使う`RateLimiter`です。  
+        指定しない場合はプロセス全体で共有される`RateLimiter.get_default`が使われます。
+    audio_only : bool, default False
+        音声だけを配信するセッションを作るかどうかです。  
+        `download`、`get_download_link`、`open`(`stream`)の全てで音声だけになり、通信量を大きく減らせます。  
+        保存したファイルは音声だけのMP4なので、拡張子は`.m4a`にするのがおすすめです。  
+        音声だけのセッションをニコニコ動画が受け付けない場合は、一番ビットレートの低い動画と組み合わせたセッションになります。
 
     Attributes
     ----------
-    heartbeat_thread : threading.Thread
-        Heartbeatのスレッドです。  
+    heartbeat : HeartbeatSession
+        Heartbeatで生かしているセッションです。`health`で状態を確認できます。  
         Heartbeatを動かすまでこれはNoneです。
+    variant : Tuple[Optional[Variant], Optional[Variant]], optional
+        今のセッションで要求している動画と音声です。  
+        `quality`も`select_variant`も使っていない場合はNoneで、その場合は全ての画質を要求しています。  
+        `audio_only`が有効な場合は動画がNoneで、音声だけのセッションを受け付けられなかった場合は組み合わせた動画になります。
+
+    Notes
+    -----
+    別々の`NicoNicoVideo`はスレッドプールなどで複数のスレッドから同時に使って大丈夫です。  
+    共有セッション、`HeartbeatManager`、`RateLimiter`はロックで守られていて、ヘッダーは書き換えられない`HeaderSet`を使うので、インスタンス同士が影響し合うことはありません。  
+    ですが一つの`NicoNicoVideo`の`download`などを複数のスレッドから同時に実行するのはやめてください。
 
     SeeAlso
     -------
     NicoNicoVideoAsync : このクラスの非同期バージョンです。"""
+
+    JOURNAL_CHUNK_SIZE = 1048576
+    ADAPTER_OPTIONS = {
+        "pool_connections": 10, "pool_maxsize": 32,
+        "max_retries": Retry(
+            total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)
+        )
+    }
+    _shared_session: Optional[requests.Session] = None
+    _shared_session_lock = Lock()
+
     def __init__(
-        self, url: str, log: bool = False, headers: Optional[dict] = None
+        self, url: str, log: bool = False, headers: Optional[dict] = None,
+        session: Optional[requests.Session] = None,
+        heartbeat_manager: Optional[HeartbeatManager] = None,
+        cache: Optional[InfoCache] = None, hls: bool = False,
+        tracer: Optional[Tracer] = None,
+        quality: Optional[Quality] = None,
+        limits: Optional[RateLimiter] = None, audio_only: bool = False
     ):
-        self._headers = headers or HEADERS
-        self.heartbeat_thread: Thread = None
+        self._headers = HeaderSet.make(headers or HEADERS)
+        self.heartbeat: Optional[HeartbeatSession] = None
+        self._session = session
+        self._heartbeat_manager, self._cache = heartbeat_manager, cache
+        self._hls, self._tracer = hls, tracer
+        self.limits = limits or RateLimiter.get_default()
+        self._quality, self._audio_only = quality, audio_only
+        self._selected: Optional[Tuple[Optional[Variant], Optional[Variant]]] = None
+        self.variant: Optional[Tuple[Optional[Variant], Optional[Variant]]] = None
 
         if "nico.ms" in url:
             url = url.replace("nico.ms/", "www.nicovideo.jp/watch/")
@@ -49,9 +136,9 @@ class NicoNicoVideo:
             url = url.replace("sp", "www")
 
         self._url, self._log = url, log
+        self.stats = DownloadStats(url) if tracer is not None else None
         self._data, self._download_link = {}, None
-        self._working_heartbeat = False
-        self._stop = False
+        self._working_heartbeat = Event()
 
     def print(self, *args, first: str = "", **kwargs) -> None:
         """niconico_dl用に用意したログ出力用の`print`です。"""
@@ -72,6 +159,47 @@ class NicoNicoVideo:
         # Heartbeatをストップします。
         self.close()
 
+    @classmethod
+    def configure_adapter(cls, **options) -> None:
+        """共有セッションのコネクションプールとリトライの設定をします。  
+        既に共有セッションが作られている場合は作り直されます。
+
+        Parameters
+        ----------
+        **options
+            `requests.adapters.HTTPAdapter`に渡す引数です。  
+            例えば`pool_connections`(プールするホストの数)、`pool_maxsize`(ホストごとの最大接続数)、
+            `max_retries`(`urllib3.util.retry.Retry`かリトライの回数)などです。"""
+        with cls._shared_session_lock:
+            cls.ADAPTER_OPTIONS = dict(cls.ADAPTER_OPTIONS, **options)
+            if NicoNicoVideo._shared_session is not None:
+                NicoNicoVideo._shared_session.close()
+                NicoNicoVideo._shared_session = None
+
+    @classmethod
+    def make_session(cls) -> requests.Session:
+        """`ADAPTER_OPTIONS`の設定でコネクションプールを使う`requests.Session`を作ります。
+
+        Returns
+        -------
+        session : requests.Session
+            作ったセッションです。"""
+        session, adapter = requests.Session(), HTTPAdapter(**cls.ADAPTER_OPTIONS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get_session(self) -> requests.Session:
+        # 通信に使うセッションを取得します。
+        # セッションが指定されていない場合は共有セッションを使います。
+        if self._session is not None:
+            return self._session
+        if NicoNicoVideo._shared_session is None:
+            with self._shared_session_lock:
+                if NicoNicoVideo._shared_session is None:
+                    NicoNicoVideo._shared_session = self.make_session()
+        return NicoNicoVideo._shared_session
+
     def connect(self) -> None:
         """ニコニコ動画に接続します。  
         `download`を使用するにはこれを実行してからする必要があります。  
@@ -85,12 +213,7 @@ class NicoNicoVideo:
         with niconico_dl.NicoNicoVideo(url) as nico:
             nico.download("video.mp4")
         ```"""
-        self.heartbeat_thread = Thread(
-            target=self._heartbeat,
-            name="niconico_dl.heartbeat"
-        )
-        self.heartbeat_thread.start()
-        self.wait_until_working_heartbeat()
+        self._start_session(MODES[0] if self._hls else MODES[1])
 
     def close(self, close_loop: bool = True) -> None:
         """NicoNicoVideoAsyncを終了します。  
@@ -98,8 +221,9 @@ class NicoNicoVideo:
         もし動画のダウンロードが終わったのならこれを実行してください。  
         `with`構文を使用するのならこれを実行する必要はありません。  
         `with`構文の使用例は`connect`の説明にあります。"""
-        self._stop = True
-        self.heartbeat_thread.join()
+        self._working_heartbeat.clear()
+        if self.heartbeat is not None:
+            self._get_heartbeat_manager().unregister(self.heartbeat)
 
     def get_info(self) -> dict:
         """ニコニコ動画のウェブページから動画のデータを取得する関数です。
@@ -114,27 +238,35 @@ class NicoNicoVideo:
         NicoNicoAcquisitionFailed
             ニコニコ動画から情報を取得するのに失敗した際に発生します。"""
         self.print("Getting video data...")
+        if not self._data and self._cache is not None:
+            self._data = self._cache.get(_video_id(self._url)) or {}
         if not self._data:
             # もし動画データを取得していないなら動画URLのHTMLから動画データを取得する。
             # Heartbeatの通信にも必要なものでもあります。
-            soup = BeautifulSoup(
-                requests.get(self._url, headers=self._headers[2]).text,
-                "html.parser"
-            )
-            data = soup.find(
-                "div", {"id": "js-initial-watch-data"}
-            ).get("data-api-data")
-            if data:
-                self._data = loads(data)
-            else:
-                raise NicoNicoAcquisitionFailed("ニコニコ動画から情報を取得するのに失敗しました。")
+            self._fetch_info()
         self.print("Done.")
         return self._data
 
+    def _fetch_info(self) -> None:
+        # ウォッチページから動画データを取得します。
+        video_id = _video_id(self._url)
+        self.limits.acquire("watch_page")
+        with _span(self._tracer, "watch_page", self.stats, video=video_id):
+            r = self._get_session().get(self._url, headers=self._headers[2])
+            r.raise_for_status()
+            text = r.text
+        with _span(self._tracer, "parse", self.stats, video=video_id):
+            data = _parse_api_data(text)
+        if data:
+            self._data = loads(data)
+            if self._cache is not None:
+                self._cache.set(video_id, self._data)
+        else:
+            raise NicoNicoAcquisitionFailed("ニコニコ動画から情報を取得するのに失敗しました。")
+
     def wait_until_working_heartbeat(self) -> None:
         """Heartbeatが動き出すまで待機します。"""
-        while not self._working_heartbeat:
-            pass
+        self._working_heartbeat.wait()
 
     def is_working_heartbeat(self) -> bool:
         """Heartbeatが動いているかの真偽値を返します。
@@ -143,7 +275,49 @@ class NicoNicoVideo:
         -------
         is_working : bool
             Heartbeatが動いているかどうかの真偽値です。"""
-        return self._working_heartbeat
+        return self._working_heartbeat.is_set() and self.heartbeat.alive
+
+    def get_variants(self) -> Dict[str, List[Variant]]:
+        """選べる画質と音質の一覧を取得します。
+
+        Returns
+        -------
+        variants : Dict[str, List[Variant]]
+            `video`と`audio`それぞれの`Variant`のリストです。ビットレートの高い順に並んでいます。"""
+        return list_variants((self.get_info())["media"]["delivery"]["movie"])
+
+    def select_variant(
+        self, video: Optional[str] = None, audio: Optional[str] = None,
+        quality: Optional[Quality] = None
+    ) -> Tuple[Optional[Variant], Optional[Variant]]:
+        """セッションで要求する動画と音声を選びます。  
+        `video`と`audio`でIDを指定するか、`quality`で選び方を指定します。  
+        IDを指定しなかった方は`quality`で、`quality`も指定しない場合は一番良いものが選ばれます。  
+        既にHeartbeatが動いている場合は選んだものでセッションを作り直します。
+
+        Parameters
+        ----------
+        video : str, optional
+            動画のIDです。`get_variants`で取得できる`Variant.id`です。
+        audio : str, optional
+            音声のIDです。
+        quality : Quality, optional
+            選び方です。
+
+        Returns
+        -------
+        variant : Tuple[Optional[Variant], Optional[Variant]]
+            選んだ動画と音声です。
+
+        Raises
+        ------
+        ValueError
+            存在しないか使えないIDを指定した場合に発生します。"""
+        movie = (self.get_info())["media"]["delivery"]["movie"]
+        self._selected = choose_variants(movie, video, audio, quality)
+        if self.heartbeat is not None and self._working_heartbeat.is_set():
+            self._reconnect()
+        return self._selected
 
     def get_download_link(self) -> str:
         """
@@ -170,7 +344,40 @@ class NicoNicoVideo:
 
         return self._download_link
 
-    def download(self, path: str, load_chunk_size: int = 1024) -> None:
+    def open(
+        self, chunk_size: int = 65536, buffer_size: int = 16,
+        retry: Union[int, RetryPolicy] = 3
+    ) -> VideoReader:
+        """動画をファイルのように読み込むための`VideoReader`を作ります。  
+        一時ファイルを作らずにffmpegなどに動画を渡したい場合に使えます。  
+        Heartbeatが動いていない場合は動かして、`VideoReader`を閉じた際に止めます。
+
+        Parameters
+        ----------
+        chunk_size : int, default 65536
+            一度に読み込むバイト数です。
+        buffer_size : int, default 16
+            先読みしておくチャンクの最大数です。
+        retry : int or RetryPolicy, default 3
+            読み込みに失敗した際に接続し直して今の位置から読み込み直す回数か`RetryPolicy`です。
+
+        Returns
+        -------
+        reader : VideoReader
+            シークのできるファイルのようなオブジェクトです。"""
+        return VideoReader(
+            self, chunk_size, buffer_size, not self.is_working_heartbeat(),
+            retry
+        )
+
+    def download(
+        self, path: str, load_chunk_size: int = MIN_BUFFER_SIZE,
+        connections: int = 1, resume: bool = True,
+        retry: Union[int, RetryPolicy] = 3,
+        limiter: Optional[TokenBucket] = None,
+        progress: Optional[ProgressCallback] = None,
+        progress_interval: float = 0.5
+    ) -> Optional[DownloadStats]:
         """ニコニコ動画の動画をダウンロードします。  
         mp4形式でダウンロードされます。
 
@@ -187,15 +394,105 @@ class NicoNicoVideo:
         Notes
         -----
         もし`with`構文を使用しないでダウンロードする場合は、ダウンロード前に`connect`を、ダウンロード終了後に`close`を実行してください。  
-        動画データの通信に必要なHeartbeatが永遠に動き続けることになります。
+        動画データの通信に必要なHeartbeatが永遠に動き続けることになります。  
+        `connections`を2以上にした場合は動画をバイト範囲に分割して複数の接続で同時にダウンロードします。  
+        サーバーが`Range`に対応していない場合は通常通り一つの接続でダウンロードします。  
+        `resume`が有効な場合はダウンロードの進捗を`<path>.niconico_dl`に記録します。  
+        ダウンロードに失敗した際は`retry`に従って少し待ってからニコニコ動画に接続し直して、ダウンロードが終わっていない部分だけをダウンロードし直します。  
+        これは`resume`が無効な場合も同じです。Heartbeatが止まってセッションが切れていた場合もセッションを作り直します。  
+        同じ保存先で実行し直した場合も前回の続きからダウンロードします。  
+        `hls`を有効にしている場合は`connections`は同時にダウンロードするセグメントの数になり、`resume`は使われません。
 
         Parameters
         ----------
         path : str
             ダウンロードするニコニコ動画の動画の保存先です。
-        load_chunk_size : int, default 1024
-            一度にどれほどの量をダウンロードするかです。"""
+        load_chunk_size : int, default 65536
+            一度にどれほどの量をダウンロードするかの最初の値です。  
+            読み込める量に合わせて`niconico_dl.writer.MAX_BUFFER_SIZE`(4MiB)まで自動で大きくなります。
+        connections : int, default 1
+            同時に使用する接続の数です。
+        resume : bool, default True
+            途中からのダウンロードをできるようにするかどうかです。
+        retry : int or RetryPolicy, default 3
+            ダウンロードに失敗した際に接続し直す回数か、やり直し方を決める`RetryPolicy`です。  
+            回数を指定した場合は`RetryPolicy`の初期設定で、待つ時間を伸ばしながらやり直します。
+        limiter : TokenBucket, optional
+            ダウンロードの速度を制限するための`TokenBucket`です。  
+            複数のダウンロードで同じものを使えば合計の速度を制限できます。
+        progress : Callable[[Progress], None], optional
+            進捗を受け取る関数です。`progress_interval`秒ごとに`Progress`が渡されます。  
+            指定しない場合は`log`が有効な時だけ`terminal_renderer`と同じ表示で進捗を出力します。
+        progress_interval : float, default 0.5
+            `progress`を呼び出す最短の間隔(秒)です。
+
+        Returns
+        -------
+        stats : DownloadStats, optional
+            `tracer`を指定した場合はダウンロードの統計です。指定していない場合はNoneです。"""
         self.print("Now loading...")
+        BASE = "Downloading video... :"
+        journal = DownloadJournal(path, self._url, persist=resume) \
+            if not self._hls else None
+        policy = RetryPolicy.from_value(retry)
+        if progress is None and self._log:
+            progress = lambda progress: self.print(
+                BASE, format_progress(progress), first="\r", end=""
+            )
+        tracker = ProgressTracker(progress, self._url, progress_interval) \
+            if progress is not None else None
+
+        with _span(self._tracer, "download", self.stats, video=_video_id(self._url)):
+            attempt, reconnect = 0, False
+            while True:
+                try:
+                    if reconnect or (
+                        self.heartbeat is not None and not self.heartbeat.alive
+                    ):
+                        # 失敗した後やHeartbeatが止まってセッションが切れている場合はセッションを作り直す。
+                        self._reconnect()
+                        reconnect = False
+                    if self._hls:
+                        self._download_hls(
+                            path, connections, BASE, limiter, tracker
+                        )
+                    else:
+                        self._download(
+                            path, load_chunk_size, connections, journal, BASE,
+                            limiter, tracker
+                        )
+                except requests.RequestException as e:
+                    if journal is not None and journal.size is not None:
+                        journal.save()
+                    if not policy.should_retry(attempt, e):
+                        raise e
+                    delay = policy.delay(attempt, e)
+                    self.print(
+                        f"Failed to download ({e}), retrying in {delay:.1f}s...",
+                        first="\n"
+                    )
+                    if self.stats is not None:
+                        self.stats.retries += 1
+                    sleep(delay)
+                    attempt, reconnect = attempt + 1, True
+                else:
+                    policy.succeeded()
+                    break
+
+        if journal is not None:
+            journal.remove()
+        if tracker is not None:
+            tracker.finish()
+        self.print("Done.", first="\n")
+        return self._finish_stats()
+
+    def _download(
+        self, path: str, load_chunk_size: int, connections: int,
+        journal: Optional[DownloadJournal], base: str,
+        limiter: Optional[TokenBucket] = None,
+        tracker: Optional[ProgressTracker] = None
+    ) -> None:
+        # ダウンロードが終わっていない部分をダウンロードします。
         url = self.get_download_link()
 
         params = (
@@ -204,85 +501,281 @@ class NicoNicoVideo:
                 self.result_data["content_auth"]["content_auth_info"]["value"]
             ),
         )
-        headers = self._headers[1]
-        headers["Content-Type"] = "video/mp4"
+        headers = self._headers.media
+
+        self.print(base, "Now loading...", first="\r", end="")
+
+        session = self._get_session()
+        with _span(self._tracer, "head", self.stats):
+            r = session.head(url, headers=headers, params=params)
+            r.raise_for_status()
+        if self.stats is not None:
+            self.stats.ttfb.append(r.elapsed.total_seconds())
+        size = int(r.headers.get("content-length"))
+        ranged = r.headers.get("accept-ranges", "").lower() == "bytes"
+
+        if (
+            ranged and journal is not None and journal.load(size)
+            and exists(path) and getsize(path) == size
+        ):
+            missing = journal.missing()
+            self.print(
+                base, f"Resuming from {journal.done_size}/{size}...",
+                first="\r", end=""
+            )
+        else:
+            # 先にファイルを動画のサイズで作っておいて各範囲をその位置に直接書き込む。
+            with open(path, "wb") as f:
+                f.truncate(size)
+            if journal is not None:
+                journal.reset(size)
+            missing = [(0, size - 1)]
+
+        if tracker is not None:
+            tracker.reset(
+                size - sum(end - start + 1 for start, end in missing), size
+            )
 
-        BASE = "Downloading video... :"
-        self.print(BASE, "Now loading...", first="\r", end="")
+        def fetch(start: int, end: int, use_range: bool) -> None:
+            # 指定されたバイト範囲をダウンロードしてファイルのその位置に書き込みます。
+            with _span(
+                self._tracer, "transfer", self.stats, start=start, end=end
+            ) as span:
+                r = session.get(
+                    url, params=params, stream=True, headers=dict(
+                        headers, Range=f"bytes={start}-{end}"
+                    ) if use_range else headers
+                )
+                r.raise_for_status()
+                if use_range and r.status_code != 206:
+                    r.close()
+                    raise _RangeNotSupported()
+                if self.stats is not None:
+                    span.attributes["ttfb"] = r.elapsed.total_seconds()
+                    self.stats.ttfb.append(span.attributes["ttfb"])
+                # 使い回すバッファに直接読み込んでファイルに書き込む。
+                r.raw.decode_content = True
+                buffer, position, now = AdaptiveBuffer(load_chunk_size), start, start
+                try:
+                    with r, FileWriter(path) as writer:
+                        while True:
+                            view = buffer.view
+                            try:
+                                length = r.raw.readinto(view)
+                            except HTTPError as e:
+                                raise requests.ConnectionError(e, response=r)
+                            if not length:
+                                break
+                            self.limits.acquire("media", length)
+                            if limiter is not None:
+                                limiter.acquire(length)
+                            writer.write(view[:length], now)
+                            buffer.update(length)
+                            now += length
+                            if tracker is not None:
+                                tracker.advance(length)
+                            # 書き込みが終わった部分を記録する。
+                            if journal is not None and (
+                                now - position >= self.JOURNAL_CHUNK_SIZE
+                            ):
+                                journal.add(position, now - 1)
+                                position = now
+                finally:
+                    # 失敗した場合もやり直す際にその続きから始められるように書き込んだ部分を記録する。
+                    if journal is not None and now > position:
+                        journal.add(position, now - 1)
+                    if self.stats is not None:
+                        span.attributes["bytes"] = now - start
+                        self.stats.add_bytes(now - start)
+
+        if not missing:
+            # 前回のダウンロードが記録を消す前に止まった場合など、全て終わっている場合は何もしない。
+            return
+        if not ranged or (connections <= 1 and missing == [(0, size - 1)]):
+            return fetch(0, size - 1, False)
+
+        ranges = _split_ranges(missing, connections)
+        with ThreadPoolExecutor(
+            min(len(ranges), connections),
+            thread_name_prefix="niconico_dl.download"
+        ) as executor:
+            futures = [
+                executor.submit(fetch, *range_, True) for range_ in ranges
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except _RangeNotSupported:
+                for future in futures:
+                    future.cancel()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            else:
+                return
 
-        size = int(
-            requests.head(
-                url, headers=headers, params=params
-            ).headers.get("content-length")
+        self.print(
+            "Range is not supported, falling back to single connection...",
+            first="\n"
         )
+        if journal is not None:
+            journal.reset(size)
+        if tracker is not None:
+            tracker.reset(0, size)
+        fetch(0, size - 1, False)
+
+    def _download_hls(
+        self, path: str, connections: int, base: str,
+        limiter: Optional[TokenBucket] = None,
+        tracker: Optional[ProgressTracker] = None
+    ) -> None:
+        # HLSのセグメントを並列でダウンロードして順番通りにつなげて保存します。
+        url = self.get_download_link()
+        params = (
+            (
+                "ht2_nicovideo",
+                self.result_data["content_auth"]["content_auth_info"]["value"]
+            ),
+        )
+        headers, session = self._headers.media, self._get_session()
+
+        def get(url: str, **kwargs) -> requests.Response:
+            r = session.get(url, headers=headers, **kwargs)
+            r.raise_for_status()
+            return r
+
+        self.print(base, "Loading playlist...", first="\r", end="")
+        r = get(url, params=params)
+        if hls.is_master(r.text):
+            # 一番画質の良いものを使う。
+            r = get(hls.parse_master(r.text, r.url)[-1][1])
+        segments, keys, lock = hls.parse_media(r.text, r.url), {}, Lock()
+
+        def fetch(segment: hls.Segment) -> bytes:
+            with _span(
+                self._tracer, "transfer", self.stats, segment=segment.url
+            ) as span:
+                data = get(segment.url).content
+                if self.stats is not None:
+                    span.attributes["bytes"] = len(data)
+                    self.stats.add_bytes(len(data))
+            if segment.key is not None:
+                with lock:
+                    if segment.key.uri not in keys:
+                        keys[segment.key.uri] = get(segment.key.uri).content
+                data = hls.decrypt(data, keys[segment.key.uri], segment.iv)
+            return data
+
+        # 同時にダウンロードするのは`connections`個までで、終わったものから順番に書き込む。
+        window, futures, iterator = max(1, connections), deque(), iter(segments)
+        with ThreadPoolExecutor(
+            window, thread_name_prefix="niconico_dl.download"
+        ) as executor:
+            for segment in islice(iterator, window):
+                futures.append(executor.submit(fetch, segment))
+            try:
+                with open(path, "wb") as f:
+                    for _ in segments:
+                        data = futures.popleft().result()
+                        segment = next(iterator, None)
+                        if segment is not None:
+                            futures.append(executor.submit(fetch, segment))
+                        self.limits.acquire("media", len(data))
+                        if limiter is not None:
+                            limiter.acquire(len(data))
+                        f.write(data)
+                        if tracker is not None:
+                            tracker.advance(len(data))
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _reconnect(self) -> None:
+        # Heartbeatを止めてニコニコ動画に接続し直します。
+        # 新しいセッションでダウンロードリンクを取得し直すのに使います。
+        self.close()
+        self._download_link = None
+        self.connect()
 
-        r = requests.get(url, headers=headers, params=params, stream=True)
-        r.raise_for_status()
-        now_size = 0
-
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=load_chunk_size):
-                if chunk:
-                    now_size += len(chunk)
-                    f.write(chunk)
-                    self.print(
-                        BASE,
-                        f"{int(now_size/size*100)}% ({now_size}/{size})",
-                        first="\r", end=""
-                    )
-
-        self.print("Done.", first="\n")
+    def _get_heartbeat_manager(self) -> HeartbeatManager:
+        if self._heartbeat_manager is None:
+            self._heartbeat_manager = HeartbeatManager.get_default()
+        return self._heartbeat_manager
+
+    def _on_heartbeat(self, data: dict) -> None:
+        # Heartbeatが成功した際に`HeartbeatManager`から呼ばれます。
+        self.result_data = data
+        self.print("Received data", data)
+        if self._tracer is not None and self.heartbeat is not None:
+            latency = self.heartbeat.latency
+            self.stats.heartbeat.append(latency)
+            self._tracer.record(Span(
+                "heartbeat", time() - latency, latency,
+                {"video": _video_id(self._url), "session": self.heartbeat.id}
+            ))
+
+    def _finish_stats(self) -> Optional[DownloadStats]:
+        # 統計を`Tracer`に渡して次のダウンロード用に新しくします。
+        if self._tracer is None:
+            return None
+        stats, self.stats = self.stats, DownloadStats(self._url)
+        self._tracer.finish(stats)
+        return stats
+
+    def _post_session(
+        self, session: requests.Session, movie: dict, mode: str
+    ) -> dict:
+        # `self.variant`で選んだものを要求するセッションを作ります。
+        videos, audios = _src_ids(self.variant, self._audio_only)
+        data = _make_sessiondata(movie, mode=mode, videos=videos, audios=audios)
+        self.print("Sending Heartbeat Init Data... :", data)
+        self.limits.acquire("session")
+        with _span(
+            self._tracer, "session", self.stats, video=_video_id(self._url)
+        ):
+            r = session.post(
+                URLS["base_heartbeat"] + "?_format=json",
+                headers=self._headers[1], data=dumps(data)
+            )
+            r.raise_for_status()
+        return r.json()["data"]["session"]
 
-    def _heartbeat(self, mode = "http_output_download_parameters") -> None:
-        # Heartbeatです。
+    def _start_session(self, mode = "http_output_download_parameters") -> None:
+        # セッションを作って`HeartbeatManager`にHeartbeatを任せます。
         self.print("Starting heartbeat...")
-        if not self._data:
+        if self._cache is not None and not \
+                self._cache.is_volatile_fresh(_video_id(self._url)):
+            # キャッシュの`media.delivery`の情報が古い場合は取得し直す。
+            self._fetch_info()
+        elif not self._data:
             self.get_info()
 
-        # セッションに必要なデータを`NicoNicoVideoAsync.get_info`で取得したデータから取得します。
-        data = _make_sessiondata(
-            self._data["media"]["delivery"]["movie"], mode=mode
+        # セッションに必要なデータを`NicoNicoVideo.get_info`で取得したデータから取得します。
+        movie = self._data["media"]["delivery"]["movie"]
+        self.variant = resolve_variants(
+            movie, self._selected, self._quality, self._audio_only
         )
-        self.print("Sending Heartbeat Init Data... :", data)
 
         # 一番最初のHeartbeatの通信をします。
-        r = requests.post(
-            URLS["base_heartbeat"] + "?_format=json",
-            headers=self._headers[1], data=dumps(data)
-        )
-        self.result_data = r.json()["data"]["session"]
-        session_id = self.result_data["id"]
-
-        self.print("Done. session_id. : " + str(session_id))
-        self._working_heartbeat = True
-
-        data, first = {"session": self.result_data}, True
-        get_interval = lambda now: now + data["session"]["keep_method"]["heartbeat"]["lifetime"] / 1000 - 3
-        make_url = lambda session_id: f"{URLS['base_heartbeat']}/{session_id}?_format=json&_method=PUT"
-        after = get_interval(time())
-
-        while not self._stop:
-            now = time()
-            # ここで定期的にHeartbeatを送ります。
-            if now >= after:
-                self.print("Sending heartbeat...", data)
-
-                if first:
-                    # 最初は普通とは違うものを先にリクエストする必要があるのでそれをリクエストする。
-                    r = requests.options(make_url(session_id), headers=self._headers[0])
-                    r.raise_for_status()
-                    first = False
-
-                r = requests.post(
-                    make_url(session_id), headers=self._headers[1],
-                    data=dumps(data)
-                )
-                self.result_data = r.json()["data"]["session"]
-
-                self.print("Done.")
-                data = {"session": self.result_data}
-                self.print("Received data", data)
+        session = self._get_session()
+        try:
+            self.result_data = self._post_session(session, movie, mode)
+        except requests.HTTPError as e:
+            if not self._audio_only or self.variant[0] is not None \
+                    or e.response is None or e.response.status_code >= 500:
+                raise
+            # 音声だけのセッションを受け付けない場合は一番小さい動画と組み合わせる。
+            self.print("Audio only session was rejected, retrying with the smallest video...")
+            self.variant = resolve_variants(
+                movie, self._selected, self._quality, True, True
+            )
+            self.result_data = self._post_session(session, movie, mode)
 
-                after = get_interval(now)
-            else:
-                sleep(0.05)
\ No newline at end of file
+        self.print("Done. session_id. : " + str(self.result_data["id"]))
+        self.heartbeat = self._get_heartbeat_manager().register(
+            HeartbeatSession(
+                self.result_data, session, self._headers, self._on_heartbeat
+            )
+        )
+        self._working_heartbeat.set()
\ No newline at end of file
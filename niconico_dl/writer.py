@@ -0,0 +1,100 @@
+# niconico_dl - Writer
+
+from typing import Union
+
+from threading import Lock
+import os
+
+
+MIN_BUFFER_SIZE = 65536
+MAX_BUFFER_SIZE = 4194304
+
+
+class AdaptiveBuffer:
+    """使い回すための読み込み用のバッファです。  
+    読み込みでバッファが一杯になった場合は次から大きくして、少ししか読み込めなかった場合は小さくします。
+
+    Parameters
+    ----------
+    minimum : int, default MIN_BUFFER_SIZE
+        バッファの最小のサイズです。
+    maximum : int, default MAX_BUFFER_SIZE
+        バッファの最大のサイズです。
+
+    Attributes
+    ----------
+    size : int
+        今のバッファのサイズです。"""
+
+    def __init__(
+        self, minimum: int = MIN_BUFFER_SIZE, maximum: int = MAX_BUFFER_SIZE
+    ):
+        self.minimum, self.maximum = minimum, max(minimum, maximum)
+        self.size = self.minimum
+        self._buffer = bytearray()
+
+    @property
+    def view(self) -> memoryview:
+        """読み込み先に使う`size`バイトの`memoryview`です。"""
+        if len(self._buffer) < self.size:
+            # 前の`memoryview`が残っていても大丈夫なように作り直す。
+            self._buffer = bytearray(self.size)
+        return memoryview(self._buffer)[:self.size]
+
+    def update(self, filled: int) -> None:
+        """読み込んだバイト数からバッファのサイズを調整します。
+
+        Parameters
+        ----------
+        filled : int
+            読み込めたバイト数です。"""
+        if filled >= self.size and self.size < self.maximum:
+            self.size = min(self.size * 2, self.maximum)
+        elif filled < self.size // 4 and self.size > self.minimum:
+            self.size = max(self.size // 2, self.minimum)
+
+
+class FileWriter:
+    """ファイルの指定した位置に書き込むためのクラスです。  
+    `os.pwrite`を使うので一つのファイルを複数のスレッドから同時に使えます。  
+    `os.pwrite`がない環境ではロックをして`os.lseek`と`os.write`で書き込みます。
+
+    Parameters
+    ----------
+    path : str
+        書き込むファイルのパスです。ファイルは既に存在している必要があります。"""
+
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self._lock = Lock()
+
+    def __enter__(self) -> "FileWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, data: Union[bytes, bytearray, memoryview], offset: int) -> None:
+        """データを指定した位置に書き込みます。
+
+        Parameters
+        ----------
+        data : bytes or bytearray or memoryview
+            書き込むデータです。
+        offset : int
+            書き込む位置です。"""
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(self.fd, view, offset)
+            else:
+                with self._lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = os.write(self.fd, view)
+            view, offset = view[written:], offset + written
+
+    def close(self) -> None:
+        """ファイルを閉じます。"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
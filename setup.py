@@ -36,9 +36,9 @@ setup(
         ]
     },
     install_requires=["aiofiles", "aiohttp", "requests", "bs4"],
+    extras_require={"hls": ["cryptography"]},
+    python_requires=">=3.8",
     classifiers=[
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
     ]
@@ -0,0 +1,18 @@
+# niconico_dl - Test Fixtures
+
+import pytest
+
+from niconico_dl import templates
+
+from benchmarks.server import start_server
+
+
+@pytest.fixture(scope="session")
+def server():
+    # ニコニコ動画の代わりをするローカルのサーバーです。終わったら`URLS`を元に戻します。
+    urls = dict(templates.URLS)
+    server = start_server(256 * 1024)
+    yield server
+    server.shutdown()
+    server.server_close()
+    templates.URLS.update(urls)
@@ -0,0 +1,33 @@
+# niconico_dl - Async Video Manager Tests
+
+import asyncio
+
+from niconico_dl import NicoNicoVideoAsync
+
+
+def shared_keys(loop) -> list:
+    return [key for key in NicoNicoVideoAsync._shared_sessions if key[0] is loop]
+
+
+def test_aclose_closes_shared_session(server):
+    async def main():
+        async with NicoNicoVideoAsync(server.watch_url("sm1")) as nico:
+            session = nico._get_session()
+        assert session.closed
+        assert not shared_keys(asyncio.get_running_loop())
+
+    asyncio.run(main())
+
+
+def test_close_outside_loop_releases_shared_session(server):
+    # イベントループが止まっている時に`close`しても共有セッションを手放して閉じます。
+    loop = asyncio.new_event_loop()
+    try:
+        nico = NicoNicoVideoAsync(server.watch_url("sm1"), loop=loop)
+        loop.run_until_complete(nico.get_info())
+        session = nico._get_session()
+        nico.close()
+        assert session.closed
+        assert not shared_keys(loop)
+    finally:
+        loop.close()
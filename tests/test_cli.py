@@ -0,0 +1,25 @@
+# niconico_dl - CLI Tests
+
+import pytest
+
+from niconico_dl.__main__ import main
+
+
+@pytest.mark.parametrize("template", ("videos/{title}.mp4", "{title}/{id}.mp4"))
+def test_output_subdirectory(server, tmp_path, monkeypatch, template):
+    # 保存先のフォルダがない場合は作ってからダウンロードします。
+    monkeypatch.chdir(tmp_path)
+    main(["sm1", "sm2", "-o", template, "-q"])
+    for video_id in ("sm1", "sm2"):
+        path = tmp_path / template.format(id=video_id, title=f"Benchmark {video_id}")
+        assert path.read_bytes() == server.body
+
+
+def test_invalid_output_template(server, tmp_path, monkeypatch):
+    # 使えないテンプレートは通信する前にエラーにします。
+    monkeypatch.chdir(tmp_path)
+    before = dict(server.stats)
+    with pytest.raises(SystemExit) as e:
+        main(["sm1", "-o", "{bogus}.mp4"])
+    assert e.value.code == 2
+    assert server.stats == before
@@ -0,0 +1,43 @@
+# niconico_dl - HLS Tests
+
+import pytest
+
+from niconico_dl import hls
+
+# 暗号化されたセグメントを作るのに`cryptography`を使います。
+pytest.importorskip("cryptography")
+
+from benchmarks.server import _encrypt  # noqa: E402
+
+
+KEY, IV = b"0123456789abcdef", (5).to_bytes(16, "big")
+PLAYLIST = """#EXTM3U
+#EXT-X-MEDIA-SEQUENCE:5
+#EXT-X-KEY:METHOD={method},URI="key"
+#EXTINF:6.0,
+0.ts
+#EXT-X-ENDLIST"""
+
+
+def test_parse_aes_128():
+    segments = hls.parse_media(PLAYLIST.format(method="AES-128"), "https://a/b/c.m3u8")
+    assert segments[0].key.uri == "https://a/b/key"
+    assert segments[0].iv == IV
+
+
+@pytest.mark.parametrize("method", ("SAMPLE-AES", "SAMPLE-AES-CTR"))
+def test_unsupported_method(method):
+    with pytest.raises(ValueError):
+        hls.parse_media(PLAYLIST.format(method=method), "https://a/b/c.m3u8")
+
+
+@pytest.mark.parametrize("size", (0, 1, 15, 16, 1000))
+def test_decrypt(size):
+    data = bytes(range(256)) * 4
+    assert hls.decrypt(_encrypt(data[:size], KEY, 5), KEY, IV) == data[:size]
+
+
+def test_decrypt_with_wrong_key():
+    # 間違った鍵で復号した場合は黙って切り詰めずにエラーにします。
+    with pytest.raises(ValueError):
+        hls.decrypt(_encrypt(b"x" * 1000, KEY, 5), b"fedcba9876543210", IV)
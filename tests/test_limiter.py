@@ -0,0 +1,32 @@
+# niconico_dl - Limiter Tests
+
+import pytest
+
+from niconico_dl import NicoNicoBatch, RateLimiter, TokenBucket
+from niconico_dl.__main__ import main
+
+
+@pytest.mark.parametrize("rate", (0, -1))
+def test_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate)
+    with pytest.raises(ValueError):
+        RateLimiter(media=rate)
+
+
+def test_acquire_within_capacity():
+    bucket = TokenBucket(1000)
+    assert bucket._reserve(1000) == 0.0
+    assert bucket._reserve(500) > 0
+
+
+def test_zero_bandwidth_is_unlimited():
+    # CLIの`--bandwidth 0`と同じく0は制限なしです。
+    assert "limiter" not in NicoNicoBatch([], bandwidth=0)._kwargs
+    assert isinstance(NicoNicoBatch([], bandwidth=1024)._kwargs["limiter"], TokenBucket)
+
+
+def test_zero_bandwidth_cli(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main(["sm1", "--bandwidth", "0", "-q"])
+    assert (tmp_path / "sm1.mp4").read_bytes() == server.body
@@ -0,0 +1,20 @@
+# niconico_dl - Session Pool Tests
+
+import asyncio
+
+from niconico_dl import SessionPool
+
+
+def test_latency_is_recorded_at_first_byte(server):
+    # `claim`しただけでは記録せず、動画の最初のレスポンスが返ってきた時に記録します。
+    async def main():
+        async with SessionPool() as pool:
+            pool.prefetch([server.watch_url("sm1")])
+            nico = await pool.claim(server.watch_url("sm1"))
+            assert pool.hits == 1 and pool.latencies == []
+            async with await nico.stream() as stream:
+                assert await stream.read(1)
+            assert len(pool.latencies) == 1
+            await nico.aclose()
+
+    asyncio.run(main())
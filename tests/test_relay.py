@@ -0,0 +1,24 @@
+# niconico_dl - Relay Tests
+
+import asyncio
+
+from niconico_dl import RelayServer
+
+
+def test_drop_keeps_session_for_other_viewers(server):
+    # 一人のクライアントで失敗してセッションを作り直す場合でも、
+    # 他のクライアントが見ている間は古いセッションを閉じません。
+    async def main():
+        relay_server = RelayServer(port=0)
+        relay = await relay_server._get_relay("sm1")
+        relay.viewers += 2
+        relay_server._drop("sm1", relay)
+        assert "sm1" not in relay_server._relays
+        assert relay.alive
+        relay_server._leave(relay)
+        assert relay.alive
+        relay_server._leave(relay)
+        assert not relay.alive
+        await relay_server.close()
+
+    asyncio.run(main())
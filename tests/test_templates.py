@@ -0,0 +1,78 @@
+# niconico_dl - Templates Tests
+
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+import pytest
+
+from niconico_dl import HEADERS, MODES, NicoNicoVideo
+from niconico_dl.templates import _make_sessiondata
+
+from benchmarks.server import make_api_data
+
+
+JOBS = 64
+
+
+def snapshot() -> list:
+    return [dict(header) for header in HEADERS]
+
+
+def test_headers_are_read_only():
+    with pytest.raises(TypeError):
+        HEADERS.api["Content-Type"] = "video/mp4"
+
+
+def test_concurrent_header_merges():
+    # 複数のスレッドでヘッダーを作っても`HEADERS`も他のスレッドのヘッダーも変わりません。
+    before = snapshot()
+
+    def merge(index: int) -> tuple:
+        custom = [dict(header, **{"X-Index": str(index)}) for header in before]
+        nico = NicoNicoVideo(f"https://www.nicovideo.jp/watch/sm{index}", headers=custom)
+        # 渡したヘッダーを後から書き換えてもインスタンスには影響しない。
+        custom[1]["X-Index"] = "changed"
+        return (
+            index, nico._headers, nico._headers.media,
+            HEADERS.build("api", **{"X-Index": str(index)}), HEADERS.media
+        )
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(merge, range(JOBS)))
+
+    for index, headers, media, built, shared_media in results:
+        assert all(header["X-Index"] == str(index) for header in headers)
+        assert media["X-Index"] == str(index)
+        assert media["Content-Type"] == "video/mp4"
+        assert headers.api["Content-Type"] == "application/json"
+        assert built["X-Index"] == str(index)
+        assert "X-Index" not in shared_media
+    assert snapshot() == before
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_concurrent_sessiondata(mode):
+    # 複数のスレッドでセッションデータを作っても元の動画データは変わりません。
+    movies = [
+        make_api_data(f"sm{index}")["media"]["delivery"]["movie"]
+        for index in range(JOBS)
+    ]
+    before, headers = deepcopy(movies), snapshot()
+
+    def make(index: int) -> dict:
+        videos = None if index % 2 else ["archive_h264_360p"]
+        return _make_sessiondata(movies[index], mode, videos=videos)["session"]
+
+    with ThreadPoolExecutor(16) as executor:
+        sessions = list(executor.map(make, range(JOBS)))
+
+    assert movies == before
+    assert snapshot() == headers
+    for index, session in enumerate(sessions):
+        assert session["recipe_id"] == f"nicovideo-sm{index}"
+        mux = session["content_src_id_sets"][0]["content_src_ids"][0]["src_id_to_mux"]
+        assert mux["video_src_ids"] == (
+            ["archive_h264_720p", "archive_h264_360p"] if index % 2
+            else ["archive_h264_360p"]
+        )
+        assert mode in session["protocol"]["parameters"]["http_parameters"]["parameters"]
@@ -0,0 +1,27 @@
+# niconico_dl - Tracing Tests
+
+from concurrent.futures import ThreadPoolExecutor
+import sys
+
+from niconico_dl import DownloadStats, Tracer
+
+
+def test_concurrent_spans_keep_every_phase():
+    # 範囲ごとのダウンロードのように複数のスレッドで同時に計測しても、かかった時間が消えないようにします。
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    spans = []
+    tracer, stats = Tracer(on_span=spans.append), DownloadStats("x")
+
+    def transfer(_):
+        for _ in range(2000):
+            with tracer.span("transfer", stats):
+                pass
+
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(transfer, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(spans) == 16000
+    assert abs(stats.phases["transfer"] - sum(span.duration for span in spans)) < 1e-9